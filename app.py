@@ -1,44 +1,99 @@
 #!/usr/bin/env python3
+import sys
+import time
+
 import aws_cdk as cdk
 
 from stack.bde_fdw_rds_stack import Application
+from stack.lambda_bundling import format_bundling_report
+
+
+def main() -> None:
+    synth_start = time.perf_counter()
+
+    app = cdk.App()
+
+    # Print lambda bundling cache hits / misses and synth duration: cdk synth -c bundling_report=true
+    bundling_report = str(app.node.try_get_context("bundling_report")).lower() == "true"
+
+    # Instantiate additional context specified in cdk.json based on environment type
+    environment = app.node.try_get_context("prod_env")
+
+    aws_account = environment.get("account_id")
+    aws_region = environment.get("region")
+    aws_vpc_id = environment.get("vpc_id")
+    aws_subnets = environment.get("subnets")
+
+    rds_fdw_instance_type = environment.get("rds_fdw_instance_type")
+    rds_fdw_engine_version = environment.get("rds_fdw_engine_version", "15")
+    rds_fdw_parameters = environment.get("rds_fdw_parameters")
+
+    cdk_env = cdk.Environment(account=aws_account, region=aws_region)
 
-app = cdk.App()
+    bde_host_name = environment.get("bde_host_name")
+    bde_analytics_user_secret = environment.get("bde_analytics_user_secret")
+    bde_foreign_schemas = environment.get("bde_foreign_schemas")
+    fdw_tuning = environment.get("fdw_tuning")
+    bde_replicas = environment.get("bde_replicas")
+    bde_schema_servers = environment.get("bde_schema_servers")
 
-# Instantiate additional context specified in cdk.json based on environment type
-environment = app.node.try_get_context("prod_env")
+    bde_rds_security_group = environment.get("bde_rds_security_group")
+    bastion_host_security_group = environment.get("bastion_host_security_group")
 
-aws_account = environment.get("account_id")
-aws_region = environment.get("region")
-aws_vpc_id = environment.get("vpc_id")
-aws_subnets = environment.get("subnets")
+    slim_lambda_packages = environment.get("slim_lambda_packages", False)
+    provisioning_iam_auth_user = environment.get("provisioning_iam_auth_user")
+    analyst_resource_profile = environment.get("analyst_resource_profile")
+    rds_proxy = environment.get("rds_proxy")
 
-rds_fdw_instance_type = environment.get("rds_fdw_instance_type")
+    bde_cached_tables = environment.get("bde_cached_tables")
+    table_cache_refresh_minutes = environment.get("table_cache_refresh_minutes", 15)
 
-cdk_env = cdk.Environment(account=aws_account, region=aws_region)
+    analyze_priority_tables = environment.get("analyze_priority_tables")
+    analyze_schedule_minutes = environment.get("analyze_schedule_minutes", 60)
+    statement_telemetry_minutes = environment.get("statement_telemetry_minutes", 15)
 
-bde_host_name = environment.get("bde_host_name")
-bde_analytics_user_secret = environment.get("bde_analytics_user_secret")
+    export_queries = environment.get("export_queries")
+    export_retention_days = environment.get("export_retention_days", 7)
 
-bde_rds_security_group = environment.get("bde_rds_security_group")
-bastion_host_security_group = environment.get("bastion_host_security_group")
+    stack = Application(
+        app,
+        "BdeFdwRdsStack",
+        description="Provision AWS Postgres RDS with FDW, to query BDE Processor RDS.",
+        env=cdk_env,
+        aws_account=aws_account,
+        vpc_id=aws_vpc_id,
+        subnet_ids=aws_subnets,
+        rds_fdw_instance_type=rds_fdw_instance_type,
+        rds_fdw_engine_version=rds_fdw_engine_version,
+        rds_fdw_parameters=rds_fdw_parameters,
+        bde_host_name=bde_host_name,
+        bde_analytics_user_secret=bde_analytics_user_secret,
+        bde_rds_security_group=bde_rds_security_group,
+        bastion_host_security_group=bastion_host_security_group,
+        bde_foreign_schemas=bde_foreign_schemas,
+        fdw_tuning=fdw_tuning,
+        bde_replicas=bde_replicas,
+        bde_schema_servers=bde_schema_servers,
+        slim_lambda_packages=slim_lambda_packages,
+        provisioning_iam_auth_user=provisioning_iam_auth_user,
+        analyst_resource_profile=analyst_resource_profile,
+        rds_proxy=rds_proxy,
+        bde_cached_tables=bde_cached_tables,
+        table_cache_refresh_minutes=table_cache_refresh_minutes,
+        analyze_priority_tables=analyze_priority_tables,
+        analyze_schedule_minutes=analyze_schedule_minutes,
+        statement_telemetry_minutes=statement_telemetry_minutes,
+        export_queries=export_queries,
+        export_retention_days=export_retention_days,
+    )
 
+    # RUN: cdk synth -c environment=non-prod --profile bde-processor-nonprod
+    app.synth()
 
-Application(
-    app,
-    "BdeFdwRdsStack",
-    description="Provision AWS Postgres RDS with FDW, to query BDE Processor RDS.",
-    env=cdk_env,
-    aws_account=aws_account,
-    vpc_id=aws_vpc_id,
-    subnet_ids=aws_subnets,
-    rds_fdw_instance_type=rds_fdw_instance_type,
-    bde_host_name=bde_host_name,
-    bde_analytics_user_secret=bde_analytics_user_secret,
-    bde_rds_security_group=bde_rds_security_group,
-    bastion_host_security_group=bastion_host_security_group,
-)
+    if bundling_report:
+        print(format_bundling_report(stack.lambda_bundles, time.perf_counter() - synth_start), file=sys.stderr)
 
 
-# RUN: cdk synth -c environment=non-prod --profile bde-processor-nonprod
-app.synth()
+# Lambda bundling runs in a process pool; spawned workers re-import this module and must not synth the app again
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+from psycopg2.extensions import connection
+from shared.table_cache import fetch_value
+
+# Read-only user the foreign servers log in as, like the BDE analytics user in production
+BDE_ANALYTICS_USER = {"username": "bde_analytics", "password": "bde_analytics"}
+
+BDE_TABLES = ("crs_appellation", "crs_legal_desc", "crs_legal_desc_prl", "crs_parcel", "crs_title")
+
+# A cut-down copy of the BDE tables analysts query most, with the column types of the real ones. Parcels are squares
+# on a grid in NZGD2000; every title has a legal description covering two neighbouring parcels, and every parcel
+# an appellation.
+SQL_CREATE_TABLES = """
+    DROP SCHEMA IF EXISTS bde CASCADE;
+    DROP SCHEMA IF EXISTS table_version CASCADE;
+    CREATE EXTENSION IF NOT EXISTS postgis;
+    CREATE SCHEMA bde;
+    CREATE SCHEMA table_version;
+
+    CREATE TABLE table_version.revision (id integer PRIMARY KEY, revision_time timestamp NOT NULL, comment text);
+
+    CREATE TABLE bde.crs_parcel (
+        id integer PRIMARY KEY,
+        toc_code varchar(4) NOT NULL,
+        parcel_intent varchar(4) NOT NULL,
+        status varchar(4) NOT NULL,
+        total_area numeric(20, 4),
+        calculated_area numeric(20, 4),
+        audit_id integer NOT NULL,
+        shape geometry(MultiPolygon, 4167)
+    );
+
+    CREATE TABLE bde.crs_title (
+        title_no varchar(20) PRIMARY KEY,
+        register_type varchar(4) NOT NULL,
+        type varchar(4) NOT NULL,
+        status varchar(4) NOT NULL,
+        issue_date timestamp NOT NULL,
+        audit_id integer NOT NULL
+    );
+
+    CREATE TABLE bde.crs_legal_desc (
+        id integer PRIMARY KEY,
+        type varchar(4) NOT NULL,
+        status varchar(4) NOT NULL,
+        ttl_title_no varchar(20),
+        audit_id integer NOT NULL
+    );
+
+    CREATE TABLE bde.crs_legal_desc_prl (
+        lgd_id integer NOT NULL,
+        par_id integer NOT NULL,
+        sequence integer NOT NULL,
+        audit_id integer NOT NULL,
+        PRIMARY KEY (lgd_id, par_id)
+    );
+
+    CREATE TABLE bde.crs_appellation (
+        id integer PRIMARY KEY,
+        par_id integer NOT NULL,
+        type varchar(4) NOT NULL,
+        title char(1) NOT NULL,
+        survey char(1) NOT NULL,
+        status varchar(4) NOT NULL,
+        parcel_type varchar(4),
+        parcel_value varchar(60),
+        appellation_value varchar(60),
+        audit_id integer NOT NULL
+    );
+"""
+
+SQL_INSERT_ROWS = """
+    INSERT INTO table_version.revision VALUES (1, now(), 'Synthetic benchmark dataset');
+
+    INSERT INTO bde.crs_parcel
+    SELECT i,
+           'PRIM',
+           (ARRAY['FSIM', 'ROAD', 'DCDB', 'HYDR'])[1 + i %% 4],
+           CASE WHEN i %% 10 = 0 THEN 'HIST' ELSE 'CURR' END,
+           810.0 + i %% 7,
+           ST_Area(ST_MakeEnvelope(x, y, x + 0.0009, y + 0.0009, 4167)::geography),
+           i,
+           ST_Multi(ST_MakeEnvelope(x, y, x + 0.0009, y + 0.0009, 4167))
+    FROM generate_series(1, %(parcels)s) AS i,
+         LATERAL (SELECT 172.0 + (i %% 1000) * 0.001 AS x, -43.0 + (i / 1000) * 0.001 AS y) AS grid;
+
+    INSERT INTO bde.crs_title
+    SELECT format('CB%%sA/%%s', i %% 50, i), 'FHOL', 'FHOL', CASE WHEN i %% 20 = 0 THEN 'CANC' ELSE 'LIVE' END,
+           timestamp '1990-01-01' + i * interval '1 hour', i
+    FROM generate_series(1, %(parcels)s / 2) AS i;
+
+    INSERT INTO bde.crs_legal_desc
+    SELECT i, 'ETT', 'REGD', format('CB%%sA/%%s', i %% 50, i), i
+    FROM generate_series(1, %(parcels)s / 2) AS i;
+
+    INSERT INTO bde.crs_legal_desc_prl
+    SELECT i, 2 * i - parcel, 2 - parcel, i
+    FROM generate_series(1, %(parcels)s / 2) AS i, generate_series(0, 1) AS parcel;
+
+    INSERT INTO bde.crs_appellation
+    SELECT i, i, 'LEGL', 'Y', 'N', 'CURR', 'LOT', (1 + i %% 100)::text,
+           format('Lot %%s DP %%s', 1 + i %% 100, 10000 + i / 100), i
+    FROM generate_series(1, %(parcels)s) AS i;
+
+    CREATE INDEX ON bde.crs_parcel USING gist (shape);
+    CREATE INDEX ON bde.crs_parcel (status);
+    CREATE INDEX ON bde.crs_legal_desc (ttl_title_no);
+    CREATE INDEX ON bde.crs_legal_desc_prl (par_id);
+    CREATE INDEX ON bde.crs_appellation (par_id);
+    ANALYZE;
+"""
+
+# Privileges as on production BDE: the analytics user can read the replicated schemas and nothing else
+SQL_GRANT_ANALYTICS_USER = """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_roles WHERE rolname = 'bde_analytics') THEN
+            CREATE ROLE bde_analytics WITH LOGIN PASSWORD 'bde_analytics';
+        END IF;
+    END
+    $$;
+    GRANT USAGE ON SCHEMA bde, table_version TO bde_analytics;
+    GRANT SELECT ON ALL TABLES IN SCHEMA bde, table_version TO bde_analytics;
+"""
+
+
+def count_parcels(conn: connection) -> int:
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('bde.crs_parcel') IS NOT NULL")
+        if not fetch_value(cur):
+            return 0
+        cur.execute("SELECT count(*) FROM bde.crs_parcel")
+        parcels: int = fetch_value(cur)
+    return parcels
+
+
+def load_bde_dataset(conn: connection, parcels: int) -> bool:
+    """Create the synthetic BDE schemas with `parcels` parcels, unless a dataset of that size is loaded already.
+
+    Loading a million parcels takes minutes, so the dataset is kept between runs of the benchmarks.
+    """
+    if count_parcels(conn) == parcels:
+        return False
+
+    with conn.cursor() as cur:
+        cur.execute(SQL_CREATE_TABLES)
+        cur.execute(SQL_INSERT_ROWS, {"parcels": parcels})
+        cur.execute(SQL_GRANT_ANALYTICS_USER)
+    return True
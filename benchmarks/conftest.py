@@ -0,0 +1,147 @@
+import importlib.util
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Iterator
+
+import psycopg2
+import pytest
+from psycopg2 import sql
+from psycopg2.extensions import connection, parse_dsn
+from shared.fdw_tuning import SQL_SERVER_OPTIONS, alter_options, parse_options
+from shared.foreign_schema import FOREIGN_SERVER
+from shared.table_cache import CACHE_SCHEMA, fetch_value
+
+from benchmarks.bde_dataset import BDE_ANALYTICS_USER, BDE_TABLES, load_bde_dataset
+
+# The defaults are the instances in docker-compose.yml. BENCHMARK_BDE_HOST is where the fdw instance finds the bde
+# instance, which from inside the compose network is not where the benchmarks find it.
+BENCHMARK_BDE_DSN = os.environ.get("BENCHMARK_BDE_DSN", "host=localhost port=5433 user=postgres password=postgres dbname=bde")
+BENCHMARK_FDW_DSN = os.environ.get(
+    "BENCHMARK_FDW_DSN", "host=localhost port=5434 user=postgres password=postgres dbname=bde_analytics"
+)
+BENCHMARK_BDE_HOST = os.environ.get("BENCHMARK_BDE_HOST", "bde")
+BENCHMARK_PARCELS = int(os.environ.get("BENCHMARK_PARCELS", "100000"))
+
+# Settings to compare, by name: an fdw_tuning profile as in cdk.json, bde_cached_tables, and whether the server
+# ships PostGIS functions to BDE. Every query is timed in every configuration.
+BENCHMARK_CONFIGURATIONS = Path(os.environ.get("BENCHMARK_CONFIGURATIONS", Path(__file__).with_name("configurations.json")))
+CONFIGURATIONS: dict[str, dict[str, Any]] = json.loads(BENCHMARK_CONFIGURATIONS.read_text())
+
+RDS_INIT_HANDLER = Path(__file__).parents[1] / "lambda_functions" / "rds_init_script" / "lambda-handler.py"
+
+
+class StaticCredentials:
+    def __init__(self, credentials: dict[str, str]) -> None:
+        self.credentials = credentials
+
+    def get(self) -> dict[str, str]:
+        return self.credentials
+
+    def invalidate(self) -> None:
+        pass
+
+
+@dataclass(frozen=True)
+class BenchmarkConfiguration:
+    name: str
+    # Qualified name of each BDE table, e.g. {"crs_parcel": "bde_cache.crs_parcel"}, for formatting the queries
+    tables: dict[str, str]
+    init_report: dict[str, Any]
+
+
+def connect_or_skip(dsn: str, environment_variable: str) -> connection:
+    try:
+        conn: connection = psycopg2.connect(dsn)
+        return conn
+    except psycopg2.OperationalError as error:
+        pytest.skip(f"Cannot connect to {environment_variable}; start benchmarks/docker-compose.yml or set it: {error}")
+
+
+def set_extension_shipping(conn: connection, enabled: bool) -> None:
+    # Without the extensions option, PostGIS functions and operators in a query are evaluated locally
+    with conn.cursor() as cur:
+        cur.execute(SQL_SERVER_OPTIONS, (FOREIGN_SERVER,))
+        options = parse_options(fetch_value(cur))
+        if enabled:
+            alter_options(cur, sql.SQL("SERVER"), sql.Identifier(FOREIGN_SERVER), options, {"extensions": "postgis"})
+        elif "extensions" in options:
+            cur.execute(
+                sql.SQL("ALTER SERVER {server} OPTIONS (DROP extensions)").format(server=sql.Identifier(FOREIGN_SERVER))
+            )
+
+
+@pytest.fixture(name="bde_dataset", scope="session")
+def fixture_bde_dataset() -> int:
+    conn = connect_or_skip(BENCHMARK_BDE_DSN, "BENCHMARK_BDE_DSN")
+    conn.autocommit = True
+    try:
+        load_bde_dataset(conn, BENCHMARK_PARCELS)
+    finally:
+        conn.close()
+    return BENCHMARK_PARCELS
+
+
+@pytest.fixture(name="fdw_connection", scope="session")
+def fixture_fdw_connection() -> Iterator[connection]:
+    conn = connect_or_skip(BENCHMARK_FDW_DSN, "BENCHMARK_FDW_DSN")
+    conn.autocommit = True
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+@pytest.fixture(name="rds_init_handler", scope="session")
+def fixture_rds_init_handler(bde_dataset: int, fdw_connection: connection) -> Iterator[ModuleType]:
+    """The RDS Init lambda handler, logging in to the local pair instead of using secrets from Secrets Manager."""
+    # Cached copies of an earlier, possibly differently sized, dataset would be kept as they are
+    with fdw_connection.cursor() as cur:
+        cur.execute(sql.SQL("DROP SCHEMA IF EXISTS {schema} CASCADE").format(schema=sql.Identifier(CACHE_SCHEMA)))
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.syspath_prepend(str(RDS_INIT_HANDLER.parents[1]))
+        monkeypatch.setenv("BDE_HOST_NAME", BENCHMARK_BDE_HOST)
+        monkeypatch.setenv("RDS_FDW_HOST", parse_dsn(BENCHMARK_FDW_DSN).get("host", "localhost"))
+        monkeypatch.setenv("RDS_FDW_DB", parse_dsn(BENCHMARK_FDW_DSN).get("dbname", "postgres"))
+        monkeypatch.setenv("BDE_FOREIGN_SCHEMAS", "bde,table_version")
+        for unused in ("BDE_REPLICA_HOSTS", "BDE_SCHEMA_SERVERS", "RDS_FDW_PROVISIONER"):
+            monkeypatch.delenv(unused, raising=False)
+
+        spec = importlib.util.spec_from_file_location("rds_init_handler", RDS_INIT_HANDLER)
+        assert spec is not None and spec.loader is not None
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+        monkeypatch.setattr(module, "connect", lambda _credentials, **_connect_kwargs: psycopg2.connect(BENCHMARK_FDW_DSN))
+        monkeypatch.setattr(module, "bde_analytics_user_credentials", StaticCredentials(BDE_ANALYTICS_USER))
+        yield module
+
+
+@pytest.fixture(name="configuration", scope="session", params=list(CONFIGURATIONS))
+def fixture_configuration(
+    request: pytest.FixtureRequest, rds_init_handler: ModuleType, fdw_connection: connection
+) -> Iterator[BenchmarkConfiguration]:
+    settings = CONFIGURATIONS[request.param]
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        fdw_tuning_profile = rds_init_handler.load_fdw_tuning_profile(json.dumps(settings.get("fdw_tuning", {})))
+        cached_tables = rds_init_handler.load_cached_tables(json.dumps(settings.get("cached_tables", [])))
+        monkeypatch.setattr(rds_init_handler, "FDW_TUNING_PROFILE", fdw_tuning_profile)
+        monkeypatch.setattr(rds_init_handler, "BDE_CACHED_TABLES", cached_tables)
+
+        # A rebuild re-imports the foreign tables, so no options or statistics are left from the last configuration
+        init_report = rds_init_handler.handler({"mode": "rebuild"}, None)
+        set_extension_shipping(fdw_connection, settings.get("extensions", True))
+
+        tables = {table: f"bde.{table}" for table in BDE_TABLES}
+        tables.update({cached_table.table: f"{CACHE_SCHEMA}.{cached_table.table}" for cached_table in cached_tables})
+        yield BenchmarkConfiguration(request.param, tables, init_report)
+
+
+def pytest_benchmark_update_json(output_json: dict[str, Any]) -> None:
+    # Recorded with the results, so that only runs against the same dataset and settings are compared
+    output_json["dataset"] = {"parcels": BENCHMARK_PARCELS}
+    output_json["configurations"] = CONFIGURATIONS
@@ -0,0 +1,66 @@
+from typing import Any
+
+import pytest
+from psycopg2.extensions import connection
+
+from benchmarks.conftest import BenchmarkConfiguration
+
+# Analyst queries against the BDE tables, formatted with the table names of the configuration, so that the cached
+# configurations read the local copies
+QUERIES = {
+    # A single parcel by key, as when following a link from a web map
+    "parcel_by_id": "SELECT id, status, parcel_intent, ST_AsText(shape) FROM {crs_parcel} WHERE id = 4242",
+    # An aggregate pushed down whole, returning a handful of rows
+    "parcel_intent_summary": (
+        "SELECT parcel_intent, count(*), sum(calculated_area) FROM {crs_parcel} WHERE status = 'CURR' GROUP BY parcel_intent"
+    ),
+    # PostGIS functions and operators only run on BDE when the server lists postgis in its extensions
+    "parcels_in_extent": (
+        "SELECT id, ST_Area(shape) FROM {crs_parcel} "
+        "WHERE ST_Intersects(shape, ST_MakeEnvelope(172.1, -42.99, 172.3, -42.95, 4167))"
+    ),
+    # Titles with the parcels and appellations they cover, a join across five tables
+    "title_parcels": """
+        SELECT t.title_no, a.appellation_value, p.calculated_area
+        FROM {crs_title} t
+        JOIN {crs_legal_desc} l ON l.ttl_title_no = t.title_no
+        JOIN {crs_legal_desc_prl} lp ON lp.lgd_id = l.id
+        JOIN {crs_parcel} p ON p.id = lp.par_id
+        JOIN {crs_appellation} a ON a.par_id = p.id
+        WHERE t.title_no LIKE 'CB12A/%' AND t.status = 'LIVE'
+    """,
+    # A full extract, where the round trips saved by a larger fetch_size count most
+    "parcel_extract": "SELECT id, status, parcel_intent, ST_AsText(shape) FROM {crs_parcel}",
+}
+
+
+def run_query(conn: connection, query: str) -> int:
+    with conn.cursor() as cur:
+        cur.execute(query)
+        return len(cur.fetchall())
+
+
+def foreign_scans(conn: connection, query: str) -> list[dict[str, str]]:
+    # What each configuration sends to BDE, from the pushdown helpers the init script installs
+    with conn.cursor() as cur:
+        cur.execute("SELECT relations, remote_sql, local_filter FROM fdw_pushdown.foreign_scans(%s)", (query,))
+        return [
+            {"relations": relations, "remote_sql": remote_sql, "local_filter": local_filter}
+            for relations, remote_sql, local_filter in cur.fetchall()
+        ]
+
+
+@pytest.mark.parametrize("query_name", QUERIES)
+def test_query(benchmark: Any, fdw_connection: connection, configuration: BenchmarkConfiguration, query_name: str) -> None:
+    query = QUERIES[query_name].format(**configuration.tables)
+
+    # Grouped by query, so each table compares the configurations against one another
+    benchmark.group = query_name
+    benchmark.extra_info["configuration"] = configuration.name
+    benchmark.extra_info["fdw_tuning"] = configuration.init_report["fdw_tuning"]["tables"]["bde"]
+    benchmark.extra_info["foreign_scans"] = foreign_scans(fdw_connection, query)
+
+    rows = benchmark(run_query, fdw_connection, query)
+
+    benchmark.extra_info["rows"] = rows
+    assert rows > 0
@@ -0,0 +1,36 @@
+import os
+from typing import Any
+
+from aws_lambda_powertools.utilities.typing import LambdaContext
+from shared.credentials import SecretCredentials, connect
+from shared.foreign_statistics import analyze_foreign_tables
+
+# ----- FDW Analytics -----
+rds_fdw_host = os.environ["RDS_FDW_HOST"]
+rds_fdw_db = os.environ["RDS_FDW_DB"]
+rds_fdw_root_credentials = SecretCredentials("RDS_FDW_ROOT")
+
+BDE_FOREIGN_SCHEMAS = os.environ.get("BDE_FOREIGN_SCHEMAS", "bde,table_version,lds,bde_ext,bde_control").split(",")
+# Comma separated schema.table names analyzed ahead of everything else, from analyze_priority_tables in cdk.json
+ANALYZE_PRIORITY_TABLES = [table for table in os.environ.get("ANALYZE_PRIORITY_TABLES", "").split(",") if table]
+# Leaves headroom under the Lambda timeout to record the last table and return
+ANALYZE_TIME_BUDGET_SECONDS = float(os.environ.get("ANALYZE_TIME_BUDGET_SECONDS", "720"))
+# 3000 sampled rows per table, against 30000 at the Postgres default of 100
+ANALYZE_STATISTICS_TARGET = int(os.environ.get("ANALYZE_STATISTICS_TARGET", "10"))
+
+
+# Runs on a schedule; each run analyzes as many foreign tables as fit in the time budget, in rotation
+def handler(_event: dict[str, Any], _context: LambdaContext) -> dict[str, Any]:
+    conn = connect(rds_fdw_root_credentials, host=rds_fdw_host, database=rds_fdw_db)
+
+    try:
+        return analyze_foreign_tables(
+            conn,
+            BDE_FOREIGN_SCHEMAS,
+            ANALYZE_PRIORITY_TABLES,
+            time_budget=ANALYZE_TIME_BUDGET_SECONDS,
+            statistics_target=ANALYZE_STATISTICS_TARGET,
+        )
+
+    finally:
+        conn.close()
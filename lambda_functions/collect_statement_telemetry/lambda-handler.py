@@ -0,0 +1,28 @@
+import os
+from typing import Any
+
+from aws_lambda_powertools.utilities.typing import LambdaContext
+from shared.credentials import SecretCredentials, connect
+from shared.statement_telemetry import collect_statement_deltas, publish_statement_metrics
+
+# ----- FDW Analytics -----
+rds_fdw_host = os.environ["RDS_FDW_HOST"]
+rds_fdw_db = os.environ["RDS_FDW_DB"]
+rds_fdw_root_credentials = SecretCredentials("RDS_FDW_ROOT")
+
+BDE_FOREIGN_SCHEMAS = os.environ.get("BDE_FOREIGN_SCHEMAS", "bde,table_version,lds,bde_ext,bde_control").split(",")
+# Foreign scan statements published with their own metrics each run, heaviest total time first
+TOP_FOREIGN_STATEMENTS = int(os.environ.get("TOP_FOREIGN_STATEMENTS", "10"))
+
+
+# Runs on a schedule and publishes, as CloudWatch embedded metrics, what each role ran since the previous run
+def handler(_event: dict[str, Any], _context: LambdaContext) -> dict[str, Any]:
+    conn = connect(rds_fdw_root_credentials, host=rds_fdw_host, database=rds_fdw_db)
+
+    try:
+        deltas = collect_statement_deltas(conn, BDE_FOREIGN_SCHEMAS)
+
+    finally:
+        conn.close()
+
+    return {"statements": len(deltas), "roles": publish_statement_metrics(deltas, TOP_FOREIGN_STATEMENTS)}
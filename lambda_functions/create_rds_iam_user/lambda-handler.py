@@ -1,46 +1,94 @@
 import json
 import os
-from typing import TYPE_CHECKING, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
 
-import boto3
-from aws_lambda_powertools.utilities import parameters
 from aws_lambda_powertools.utilities.typing import LambdaContext
-from psycopg2 import Error, connect, sql
+from botocore.exceptions import ClientError
+from psycopg2 import Error, sql
+from psycopg2.extensions import cursor
+from shared.clients import aws_account_id, iam_client
+from shared.connections import WarmConnection
+from shared.credentials import Credentials, IamAuthTokenCredentials, SecretCredentials
+from shared.proxy_auth import (
+    delete_proxy_password,
+    generate_proxy_password,
+    list_proxy_analyst_roles,
+    list_rds_iam_analyst_roles,
+    load_declared_proxy_auth,
+    register_proxy_secrets,
+    scram_sha_256_verifier,
+    store_proxy_password,
+)
+from shared.reconciliation import (
+    ANALYST_POLICY_PATH,
+    ANALYST_USER_TAG,
+    analyst_policy_name,
+    diff_analysts,
+    list_analyst_iam_users,
+    read_analyst_roles,
+)
+from shared.resource_profile import apply_resource_profile, list_analyst_roles, load_analyst_resource_profile
 
 # ----- Environment Variables -----
 rds_fdw_host = os.environ["RDS_FDW_HOST"]
 rds_fdw_db = os.environ["RDS_FDW_DB"]
 rds_resource_id = os.environ["RDS_FDW_RESOURCE_ID"]
 
-rds_fdw_root_secret: Any = parameters.get_secret(os.environ["RDS_FDW_ROOT"])
+rds_fdw_iam_auth_user = os.environ.get("RDS_FDW_IAM_AUTH_USER")
 
-rds_fdw_root_secret_key_value = json.loads(rds_fdw_root_secret)
-rds_fdw_root_user = rds_fdw_root_secret_key_value["username"]
-rds_fdw_root_pw = rds_fdw_root_secret_key_value["password"]
+# Set when the stack puts an RDS Proxy in front of the instance; analysts then connect through the proxy
+rds_fdw_proxy_name = os.environ.get("RDS_FDW_PROXY_NAME")
+rds_fdw_proxy_endpoint = os.environ.get("RDS_FDW_PROXY_ENDPOINT")
+rds_fdw_proxy_resource_id = os.environ.get("RDS_FDW_PROXY_ARN", "").rsplit(":", 1)[-1]
+# The proxy's authentication list as the stack declares it; analyst secrets are added after these entries
+rds_fdw_proxy_auth = load_declared_proxy_auth(os.environ.get("RDS_FDW_PROXY_AUTH"))
+analyst_endpoint = rds_fdw_proxy_endpoint or rds_fdw_host
 
+# Authenticate as the provisioning role with an IAM auth token when one is configured, otherwise as root
+rds_fdw_credentials: Credentials = (
+    IamAuthTokenCredentials(rds_fdw_host, 5432, rds_fdw_iam_auth_user)
+    if rds_fdw_iam_auth_user
+    else SecretCredentials("RDS_FDW_ROOT")
+)
+# IAM database authentication requires SSL
+rds_connection = WarmConnection(rds_fdw_credentials, host=rds_fdw_host, database=rds_fdw_db, sslmode="require")
 
-if TYPE_CHECKING:
-    from mypy_boto3_iam import IAMClient
-    from mypy_boto3_sts import STSClient
+IAM_MAX_WORKERS = int(os.environ.get("IAM_MAX_WORKERS", "8"))
 
-else:
-    IAMClient = STSClient = dict
+# Session limits and connection limit for every analyst role, from analyst_resource_profile in cdk.json
+ANALYST_RESOURCE_PROFILE = load_analyst_resource_profile(os.environ.get("ANALYST_RESOURCE_PROFILE"))
 
-boto3_iam_client: IAMClient = boto3.client("iam")
-boto3_sts_client: STSClient = boto3.client("sts")
 
-
-def create_rds_user_from_iam(username: str) -> None:
-    conn = connect(
-        host=rds_fdw_host,
-        database=rds_fdw_db,
-        user=rds_fdw_root_user,
-        password=rds_fdw_root_pw,
-    )
+def create_rds_user_from_iam(cur: cursor, username: str) -> None:
+    # The proxy logs in with a password, which RDS refuses for rds_iam members; analysts still authenticate to the
+    # proxy with IAM auth tokens, and never see the password
+    proxy_password = generate_proxy_password() if rds_fdw_proxy_name else None
 
     sql_create_user = sql.SQL("CREATE ROLE {username} WITH LOGIN").format(
         username=sql.Identifier(username),
     )
+    if proxy_password is not None:
+        # Only the verifier goes to the database, never the password
+        sql_create_user = sql.SQL("CREATE ROLE {username} WITH LOGIN PASSWORD {password}").format(
+            username=sql.Identifier(username), password=sql.Literal(scram_sha_256_verifier(proxy_password))
+        )
+    sql_grant_iam_role = sql.SQL("GRANT rds_iam TO {username}").format(
+        username=sql.Identifier(username),
+    )
+
+    cur.execute(sql_create_user)
+    create_user_schema(cur, username)
+    if proxy_password is None:
+        cur.execute(sql_grant_iam_role)
+    apply_resource_profile(cur, username, ANALYST_RESOURCE_PROFILE)
+
+    # Stored last, so a failure above leaves no secret for a role that was rolled back
+    if proxy_password is not None:
+        store_proxy_password(username, proxy_password)
+
+
+def create_user_schema(cur: cursor, username: str) -> None:
     sql_user_create_schema = sql.SQL("CREATE SCHEMA {username}").format(
         username=sql.Identifier(username),
     )
@@ -55,64 +103,362 @@ def create_rds_user_from_iam(username: str) -> None:
     sql_user_grant_schema_execute = sql.SQL("GRANT EXECUTE ON ALL FUNCTIONS IN SCHEMA {username} TO {username}").format(
         username=sql.Identifier(username),
     )
-    sql_grant_iam_role = sql.SQL("GRANT rds_iam TO {username}").format(
-        username=sql.Identifier(username),
+
+    cur.execute(sql_user_create_schema)
+    cur.execute(sql_user_grant_schema_usage)
+    cur.execute(sql_user_grant_schema_privileges)
+    cur.execute(sql_user_grant_schema_execute)
+
+
+# Moves an analyst created before the proxy from IAM auth to a password the proxy logs in with
+def migrate_rds_user_to_proxy(cur: cursor, username: str) -> None:
+    proxy_password = generate_proxy_password()
+
+    cur.execute(
+        sql.SQL("ALTER ROLE {username} WITH PASSWORD {password}").format(
+            username=sql.Identifier(username), password=sql.Literal(scram_sha_256_verifier(proxy_password))
+        )
     )
+    cur.execute(sql.SQL("REVOKE rds_iam FROM {username}").format(username=sql.Identifier(username)))
 
-    try:
-        with conn.cursor() as cur:
-            try:
-                cur.execute(sql_create_user)
-                cur.execute(sql_user_create_schema)
-                cur.execute(sql_user_grant_schema_usage)
-                cur.execute(sql_user_grant_schema_privileges)
-                cur.execute(sql_user_grant_schema_execute)
-                cur.execute(sql_grant_iam_role)
+    store_proxy_password(username, proxy_password)
+
+
+# Moves an analyst back from the proxy to IAM auth on the instance, once the proxy is gone
+def restore_rds_user_iam_auth(cur: cursor, username: str) -> None:
+    cur.execute(sql.SQL("GRANT rds_iam TO {username}").format(username=sql.Identifier(username)))
+    cur.execute(sql.SQL("ALTER ROLE {username} WITH PASSWORD NULL").format(username=sql.Identifier(username)))
+
+    delete_proxy_password(username)
+
+
+# Gives the login back to an analyst whose IAM user is tagged again after revoke_rds_user
+def restore_rds_user(cur: cursor, username: str) -> None:
+    cur.execute(sql.SQL("ALTER ROLE {username} LOGIN").format(username=sql.Identifier(username)))
 
-            except Error:
-                conn.rollback()
-                raise
 
-            conn.commit()
+# Takes away the login of an analyst whose IAM user is gone; the role and the tables in its schema are kept
+def revoke_rds_user(cur: cursor, username: str) -> None:
+    cur.execute(sql.SQL("ALTER ROLE {username} NOLOGIN").format(username=sql.Identifier(username)))
 
-    finally:
-        conn.close()
+
+def provision_rds_users(
+    provision: Callable[[cursor, str], None], usernames: Optional[list[str]] = None
+) -> dict[str, Optional[str]]:
+    # All users share one connection and transaction; a savepoint per user means one failure
+    # (e.g. the role already exists) only rolls back that user. Without usernames, every analyst role is provisioned.
+    # The connection stays open for the next warm invocation.
+    conn = rds_connection.get()
+    errors: dict[str, Optional[str]] = {}
+
+    with conn.cursor() as cur:
+        try:
+            for username in list_analyst_roles(cur) if usernames is None else usernames:
+                cur.execute("SAVEPOINT provision_rds_user")
+                try:
+                    provision(cur, username)
+                except (Error, ClientError) as error:
+                    cur.execute("ROLLBACK TO SAVEPOINT provision_rds_user")
+                    errors[username] = str(error).strip()
+                else:
+                    cur.execute("RELEASE SAVEPOINT provision_rds_user")
+                    errors[username] = None
+
+        except Error:
+            conn.rollback()
+            raise
+
+        conn.commit()
+
+    return errors
 
 
 def ensure_iam_user_exists(username: str, iam_policy_arn: str) -> None:
     try:
-        boto3_iam_client.get_user(UserName=username)
-    except boto3_iam_client.exceptions.NoSuchEntityException:
-        boto3_iam_client.create_user(
+        iam_client().get_user(UserName=username)
+    except iam_client().exceptions.NoSuchEntityException:
+        iam_client().create_user(
             UserName=username,
         )
-    boto3_iam_client.attach_user_policy(UserName=username, PolicyArn=iam_policy_arn)
-    boto3_iam_client.tag_user(UserName=username, Tags=[{"Key": "BDE_Analytics_User", "Value": "True"}])
+    iam_client().attach_user_policy(UserName=username, PolicyArn=iam_policy_arn)
+    tag_iam_user(username)
 
 
-def generate_iam_user_policy(username: str) -> str:
+def tag_iam_user(username: str) -> None:
+    # The endpoint the user connects to, the proxy when there is one, is recorded on the IAM user
+    iam_client().tag_user(
+        UserName=username,
+        Tags=[ANALYST_USER_TAG, {"Key": "BDE_Analytics_Endpoint", "Value": analyst_endpoint}],
+    )
+
+
+def iam_user_policy_document(username: str) -> str:
     # Resource arn needs to be specific to a particular user to prevent individuals from connecting as another user.
     # https://docs.aws.amazon.com/AmazonRDS/latest/UserGuide/UsingWithRDS.IAMDBAuth.IAMPolicy.html
-    aws_account_id = boto3_sts_client.get_caller_identity()["Account"]
-    resource_arn = f"arn:aws:rds-db:ap-southeast-2:{aws_account_id}:dbuser:{rds_resource_id}/{username}"
+    resource_arns = [f"arn:aws:rds-db:ap-southeast-2:{aws_account_id()}:dbuser:{rds_resource_id}/{username}"]
+    # The instance stays allowed, so analysts not yet moved to the proxy can still log in directly
+    if rds_fdw_proxy_name:
+        resource_arns.append(f"arn:aws:rds-db:ap-southeast-2:{aws_account_id()}:dbuser:{rds_fdw_proxy_resource_id}/{username}")
+
+    return json.dumps(
+        {
+            "Version": "2012-10-17",
+            "Statement": [{"Action": "rds-db:connect", "Resource": resource_arns, "Effect": "Allow"}],
+        }
+    )
 
-    iam_user_policy_document = {
-        "Version": "2012-10-17",
-        "Statement": [{"Action": "rds-db:connect", "Resource": resource_arn, "Effect": "Allow"}],
-    }
 
-    response = boto3_iam_client.create_policy(
-        PolicyName=f"bde-analytics-iam-policy-{username}",
-        Path="/bde-analytics-policies/",
-        PolicyDocument=json.dumps(iam_user_policy_document),
+def analyst_policy_arn(username: str) -> str:
+    return f"arn:aws:iam::{aws_account_id()}:policy{ANALYST_POLICY_PATH}{analyst_policy_name(username)}"
+
+
+def generate_iam_user_policy(username: str) -> str:
+    response = iam_client().create_policy(
+        PolicyName=analyst_policy_name(username),
+        Path=ANALYST_POLICY_PATH,
+        PolicyDocument=iam_user_policy_document(username),
         Description="IAM policy allowing user access to bde analytics.",
     )
 
     return response["Policy"]["Arn"]
 
 
-def handler(event: dict[str, str], _context: LambdaContext) -> None:
-    iam_policy_arn = generate_iam_user_policy(username=event["username"])
-    ensure_iam_user_exists(username=event["username"], iam_policy_arn=iam_policy_arn)
+def update_iam_user_policy(username: str) -> Optional[str]:
+    # Replaces the policy of a user created before the proxy with one that also allows the proxy
+    policy_arn = analyst_policy_arn(username)
+    try:
+        # A policy keeps at most five versions, so the old ones go first
+        for version in iam_client().list_policy_versions(PolicyArn=policy_arn)["Versions"]:
+            if not version["IsDefaultVersion"]:
+                iam_client().delete_policy_version(PolicyArn=policy_arn, VersionId=version["VersionId"])
+        iam_client().create_policy_version(
+            PolicyArn=policy_arn, PolicyDocument=iam_user_policy_document(username), SetAsDefault=True
+        )
+        tag_iam_user(username)
+    except ClientError as error:
+        return str(error)
+
+    return None
+
+
+def provision_iam_user(username: str) -> Optional[str]:
+    try:
+        iam_policy_arn = generate_iam_user_policy(username=username)
+        ensure_iam_user_exists(username=username, iam_policy_arn=iam_policy_arn)
+    except ClientError as error:
+        return str(error)
+
+    return None
+
+
+def attach_iam_user_policy(username: str) -> Optional[str]:
+    # The policy may still exist, only detached from the user
+    policy_arn = analyst_policy_arn(username)
+    try:
+        try:
+            iam_client().attach_user_policy(UserName=username, PolicyArn=policy_arn)
+        except iam_client().exceptions.NoSuchEntityException:
+            iam_client().attach_user_policy(UserName=username, PolicyArn=generate_iam_user_policy(username=username))
+    except ClientError as error:
+        return str(error)
+
+    return None
+
+
+def create_iam_clients() -> None:
+    # lru_cache does not guard the first call, and creating clients from boto3's default session is not thread-safe,
+    # so the clients the IAM workers share are created before the pool starts
+    iam_client()
+    aws_account_id()
+
+
+def reconcile_analysts(dry_run: bool, revoke_orphans: bool) -> dict[str, Any]:
+    """Compare the tagged IAM users with the analyst roles and, unless dry_run, fix what is missing.
+
+    Missing roles, schemas and policies are created and revoked roles get their login back; orphaned roles only lose
+    their login when revoke_orphans is set.
+    """
+    iam_users = list_analyst_iam_users()
+
+    conn = rds_connection.get()
+    with conn.cursor() as cur:
+        roles = read_analyst_roles(cur, sorted(iam_users))
+    # Ends the transaction the catalog read started; the connection stays open for the next warm invocation
+    conn.rollback()
+
+    drift = diff_analysts(iam_users, roles)
+    report: dict[str, Any] = {**drift.report(), "dry_run": dry_run, "errors": {}}
+    if dry_run:
+        return report
+
+    create_iam_clients()
+    with ThreadPoolExecutor(max_workers=IAM_MAX_WORKERS) as executor:
+        iam_errors = dict(zip(drift.missing_policies, executor.map(attach_iam_user_policy, drift.missing_policies)))
+
+    # One transaction for every change, with a savepoint per user; a revoked role may be missing its schema as well
+    provisions: dict[str, list[Callable[[cursor, str], None]]] = {}
+    for usernames, provision in (
+        (drift.missing_roles, create_rds_user_from_iam),
+        (drift.missing_schemas, create_user_schema),
+        (drift.revoked_roles, restore_rds_user),
+        (drift.orphaned_roles if revoke_orphans else [], revoke_rds_user),
+    ):
+        for username in usernames:
+            provisions.setdefault(username, []).append(provision)
+
+    def provision_analyst(cur: cursor, username: str) -> None:
+        for provision in provisions[username]:
+            provision(cur, username)
+
+    database_errors = provision_rds_users(provision_analyst, list(provisions)) if provisions else {}
+
+    proxy_errors: dict[str, Optional[str]] = {}
+    if rds_fdw_proxy_name and any(database_errors[username] is None for username in drift.missing_roles):
+        try:
+            register_proxy_secrets(rds_fdw_proxy_name, rds_fdw_proxy_auth)
+        except ClientError as error:
+            proxy_errors = {username: str(error) for username in drift.missing_roles if database_errors[username] is None}
+
+    report["errors"] = {
+        stage: {username: error for username, error in errors.items() if error is not None}
+        for stage, errors in (("iam", iam_errors), ("database", database_errors), ("proxy", proxy_errors))
+    }
+    return report
+
+
+# Re-applies the current resource profile, to the given analyst roles or all of them, after it changed in cdk.json
+def apply_resource_profiles(usernames: Optional[list[str]]) -> dict[str, dict[str, str]]:
+    errors = provision_rds_users(
+        lambda cur, username: apply_resource_profile(cur, username, ANALYST_RESOURCE_PROFILE), usernames
+    )
+    return {
+        username: {"status": "failed", "stage": "database", "error": error} if error is not None else {"status": "updated"}
+        for username, error in errors.items()
+    }
+
+
+def register_proxy_logins(proxy_name: str) -> dict[str, Any]:
+    """Move the analysts still on IAM auth to the proxy, and add every analyst missing from its authentication list.
+
+    Safe to repeat: analysts already moved are skipped, and only missing secrets are added.
+    """
+    conn = rds_connection.get()
+    with conn.cursor() as cur:
+        usernames = list_rds_iam_analyst_roles(cur)
+    conn.rollback()
+
+    # The proxy must be allowed before the instance login is taken away; users whose policy fails keep IAM auth
+    create_iam_clients()
+    with ThreadPoolExecutor(max_workers=IAM_MAX_WORKERS) as executor:
+        iam_errors = dict(zip(usernames, executor.map(update_iam_user_policy, usernames)))
+
+    iam_users = [username for username in usernames if iam_errors[username] is None]
+    database_errors = provision_rds_users(migrate_rds_user_to_proxy, iam_users) if iam_users else {}
+
+    return {
+        "migrated": [username for username, error in database_errors.items() if error is None],
+        "registered": register_proxy_secrets(proxy_name, rds_fdw_proxy_auth),
+        "errors": {
+            stage: {username: error for username, error in errors.items() if error is not None}
+            for stage, errors in (("iam", iam_errors), ("database", database_errors))
+        },
+    }
+
+
+# Run by the deployment after every change to the proxy, which resets its authentication list
+def register_proxy_logins_handler(_event: dict[str, Any], _context: LambdaContext) -> dict[str, Any]:
+    report = register_proxy_logins(os.environ["RDS_FDW_PROXY_NAME"])
+    if any(report["errors"].values()):
+        # Fails the deployment, rather than leave analysts locked out unnoticed
+        raise RuntimeError(f"Could not move every analyst to the proxy: {json.dumps(report['errors'])}")
+    return report
+
+
+def restore_iam_logins() -> dict[str, Any]:
+    """Move every analyst on a proxy password back to IAM auth on the instance, after rds_proxy is turned off.
+
+    Safe to repeat: analysts already on IAM auth are skipped.
+    """
+    conn = rds_connection.get()
+    with conn.cursor() as cur:
+        usernames = list_proxy_analyst_roles(cur)
+    conn.rollback()
+
+    database_errors = provision_rds_users(restore_rds_user_iam_auth, usernames) if usernames else {}
+
+    # The instance is in every analyst policy already; this drops the proxy and records the instance as the endpoint
+    restored = [username for username, error in database_errors.items() if error is None]
+    create_iam_clients()
+    with ThreadPoolExecutor(max_workers=IAM_MAX_WORKERS) as executor:
+        iam_errors = dict(zip(restored, executor.map(update_iam_user_policy, restored)))
+
+    return {
+        "restored": restored,
+        "errors": {
+            stage: {username: error for username, error in errors.items() if error is not None}
+            for stage, errors in (("database", database_errors), ("iam", iam_errors))
+        },
+    }
+
+
+# Run by the deployment when the stack has no proxy, so analysts moved to one can log in to the instance again
+def restore_iam_logins_handler(_event: dict[str, Any], _context: LambdaContext) -> dict[str, Any]:
+    report = restore_iam_logins()
+    if any(report["errors"].values()):
+        # Fails the deployment, rather than leave analysts locked out unnoticed
+        raise RuntimeError(f"Could not move every analyst back to IAM auth: {json.dumps(report['errors'])}")
+    return report
+
+
+# Accepts {"username": "jdoe"} or {"usernames": ["jdoe", "asmith", ...]} and returns a result per user.
+# {"action": "apply_resource_profile"} re-applies the resource profile to all analyst roles instead, or only to
+# those in "usernames" when given. {"action": "register_proxy_logins"} moves analysts on IAM auth to the proxy and
+# adds any analyst missing from it; {"action": "restore_iam_logins"} moves them back once the proxy is gone.
+# {"action": "reconcile"} reports drift between tagged IAM users and analyst roles; add "dry_run": false to fix it,
+# and "revoke_orphans": true to also take the login away from roles without a tagged IAM user.
+def handler(event: dict[str, Any], _context: LambdaContext) -> dict[str, Any]:
+    if event.get("action") == "reconcile":
+        return reconcile_analysts(event.get("dry_run", True), event.get("revoke_orphans", False))
+    if event.get("action") == "apply_resource_profile":
+        return apply_resource_profiles(event.get("usernames"))
+    if event.get("action") == "register_proxy_logins":
+        if not rds_fdw_proxy_name:
+            return {"status": "failed", "error": "There is no RDS Proxy to register logins with; add rds_proxy to cdk.json"}
+        return register_proxy_logins(rds_fdw_proxy_name)
+    if event.get("action") == "restore_iam_logins":
+        if rds_fdw_proxy_name:
+            return {"status": "failed", "error": "Analysts log in through the RDS Proxy; remove rds_proxy from cdk.json first"}
+        return restore_iam_logins()
+
+    usernames: list[str] = list(dict.fromkeys(event.get("usernames") or [event["username"]]))
+
+    # IAM calls are network bound; the IAM client retries throttled calls with adaptive backoff
+    create_iam_clients()
+    with ThreadPoolExecutor(max_workers=IAM_MAX_WORKERS) as executor:
+        iam_errors = dict(zip(usernames, executor.map(provision_iam_user, usernames)))
+
+    iam_users = [username for username in usernames if iam_errors[username] is None]
+    database_errors = provision_rds_users(create_rds_user_from_iam, iam_users) if iam_users else {}
+
+    # One update of the proxy's authentication list for the whole batch
+    proxy_error = None
+    if rds_fdw_proxy_name and any(error is None for error in database_errors.values()):
+        try:
+            register_proxy_secrets(rds_fdw_proxy_name, rds_fdw_proxy_auth)
+        except ClientError as error:
+            proxy_error = str(error)
+
+    report: dict[str, dict[str, str]] = {}
+    for username in usernames:
+        iam_error = iam_errors[username]
+        database_error = database_errors.get(username)
+        if iam_error is not None:
+            report[username] = {"status": "failed", "stage": "iam", "error": iam_error}
+        elif database_error is not None:
+            report[username] = {"status": "failed", "stage": "database", "error": database_error}
+        elif proxy_error is not None:
+            report[username] = {"status": "failed", "stage": "proxy", "error": proxy_error}
+        else:
+            report[username] = {"status": "created", "endpoint": analyst_endpoint}
 
-    create_rds_user_from_iam(username=event["username"])
+    return report
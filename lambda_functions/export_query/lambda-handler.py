@@ -0,0 +1,35 @@
+import os
+import time
+import uuid
+from typing import Any
+
+from aws_lambda_powertools.utilities.typing import LambdaContext
+from shared.bulk_export import export_query, load_export_queries
+from shared.credentials import SecretCredentials, connect
+
+# ----- FDW Analytics -----
+rds_fdw_host = os.environ["RDS_FDW_HOST"]
+rds_fdw_db = os.environ["RDS_FDW_DB"]
+rds_fdw_root_credentials = SecretCredentials("RDS_FDW_ROOT")
+
+EXPORT_BUCKET = os.environ["EXPORT_BUCKET"]
+# Queries by name, from export_queries in cdk.json; only these can be exported
+EXPORT_QUERIES = load_export_queries(os.environ.get("EXPORT_QUERIES"))
+
+
+# Accepts {"query": "parcels"} and uploads its result to exports/parcels/<UTC timestamp>-<random suffix>.csv.gz in the export
+# bucket; the suffix keeps exports started in the same second from overwriting each other.
+# The report has a presigned URL to download it with, valid for an hour.
+def handler(event: dict[str, str], _context: LambdaContext) -> dict[str, Any]:
+    name = event["query"]
+    if name not in EXPORT_QUERIES:
+        raise ValueError(f"Unknown export query: {name}")
+
+    key = f"exports/{name}/{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())}-{uuid.uuid4().hex[:8]}.csv.gz"
+    conn = connect(rds_fdw_root_credentials, host=rds_fdw_host, database=rds_fdw_db)
+
+    try:
+        return export_query(conn, EXPORT_QUERIES[name], EXPORT_BUCKET, key)
+
+    finally:
+        conn.close()
@@ -1,78 +1,196 @@
 import json
 import os
+from pathlib import Path
+from typing import Any
 
 import psycopg2
-from aws_lambda_powertools.utilities import parameters
 from aws_lambda_powertools.utilities.typing import LambdaContext
+from psycopg2 import sql
+from psycopg2.extensions import cursor
+from shared.credentials import SecretCredentials, connect
+from shared.fdw_tuning import apply_server_tuning, apply_table_tuning, load_fdw_tuning_profile
+from shared.foreign_schema import FOREIGN_SERVER, import_foreign_schemas
+from shared.table_cache import CACHE_SCHEMA, create_cached_table, fetch_value, load_cached_tables
 
 # ----- Production BDE -----
 bde_host_name = os.environ["BDE_HOST_NAME"]
-bde_analytics_user_secret = parameters.get_secret(os.environ["BDE_ANALYTICS_USER_SECRET"])
+bde_analytics_user_credentials = SecretCredentials("BDE_ANALYTICS_USER_SECRET")
 
-bde_analytics_user_secret = json.loads(bde_analytics_user_secret)  # type: ignore
-bde_analytics_user_name = bde_analytics_user_secret["username"]  # type: ignore
-bde_analytics_user_pw = bde_analytics_user_secret["password"]  # type: ignore
+# Read replicas of production BDE by foreign server name, and the schemas imported from each, from bde_replicas and
+# bde_schema_servers in cdk.json. Replicas share the primary's users, so the same read-only user logs in to all.
+BDE_REPLICA_HOSTS: dict[str, str] = json.loads(os.environ.get("BDE_REPLICA_HOSTS") or "{}")
+BDE_SCHEMA_SERVERS: dict[str, str] = json.loads(os.environ.get("BDE_SCHEMA_SERVERS") or "{}")
 
 
 # ----- FDW Analytics -----
 rds_fdw_host = os.environ["RDS_FDW_HOST"]
 rds_fdw_db = os.environ["RDS_FDW_DB"]
+rds_fdw_root_credentials = SecretCredentials("RDS_FDW_ROOT")
+rds_fdw_provisioner = os.environ.get("RDS_FDW_PROVISIONER")
 
-rds_fdw_root_secret = parameters.get_secret(os.environ["RDS_FDW_ROOT"])
+# Comma separated, from bde_foreign_schemas in cdk.json
+BDE_FOREIGN_SCHEMAS = os.environ.get("BDE_FOREIGN_SCHEMAS", "bde,table_version,lds,bde_ext,bde_control").split(",")
 
-rds_fdw_root_secret_key_value = json.loads(rds_fdw_root_secret)  # type: ignore
-rds_fdw_root_user = rds_fdw_root_secret_key_value["username"]
-rds_fdw_root_pw = rds_fdw_root_secret_key_value["password"]
+# Server and per foreign table FDW options, from fdw_tuning in cdk.json
+FDW_TUNING_PROFILE = load_fdw_tuning_profile(os.environ.get("FDW_TUNING"))
 
+# Opt-in local copies of hot foreign tables, from bde_cached_tables in cdk.json
+BDE_CACHED_TABLES = load_cached_tables(os.environ.get("BDE_CACHED_TABLES"))
 
-# This lambda function is only meant to be run once during cdk initialization,
-# as post-db creation initialization script
-def handler(_event: dict[str, str], _context: LambdaContext) -> None:
-    conn = psycopg2.connect(
-        host=rds_fdw_host,
-        database=rds_fdw_db,
-        user=rds_fdw_root_user,
-        password=rds_fdw_root_pw,
+# Functions behind the pushdown analyser (src/pushdown.py), bundled alongside this handler
+PUSHDOWN_SQL = Path(__file__).with_name("pushdown.sql")
+
+# From PostgreSQL 16 a CREATEROLE role can only alter, grant and drop the roles it has ADMIN on
+MIN_ROLE_ADMIN_SERVER_VERSION = 160000
+
+# Analyst roles, revoked ones included, that the provisioner has no ADMIN on; it has ADMIN on the ones it created
+SQL_ANALYST_ROLES_WITHOUT_ADMIN = """
+    SELECT r.rolname
+    FROM pg_roles r
+    JOIN pg_namespace n ON n.nspname = r.rolname
+    WHERE r.rolname <> %(provisioner)s AND NOT EXISTS (
+        SELECT 1 FROM pg_auth_members m
+        WHERE m.roleid = r.oid AND m.admin_option AND m.member = (SELECT oid FROM pg_roles WHERE rolname = %(provisioner)s)
+    )
+    ORDER BY r.rolname
+"""
+
+
+# Role the user provisioning lambda logs in as with an IAM auth token, instead of using the root credentials
+def create_provisioner_role(cur: cursor, provisioner: str) -> None:
+    cur.execute("SELECT 1 FROM pg_roles WHERE rolname = %s", (provisioner,))
+    if cur.fetchone() is None:
+        cur.execute(sql.SQL("CREATE ROLE {provisioner} WITH LOGIN CREATEROLE").format(provisioner=sql.Identifier(provisioner)))
+
+    cur.execute(sql.SQL("GRANT rds_iam TO {provisioner} WITH ADMIN OPTION").format(provisioner=sql.Identifier(provisioner)))
+    cur.execute(
+        sql.SQL("GRANT CREATE ON DATABASE {database} TO {provisioner}").format(
+            database=sql.Identifier(rds_fdw_db), provisioner=sql.Identifier(provisioner)
+        )
+    )
+    # Only superusers may set temp_file_limit otherwise, and the analyst resource profile sets it on every analyst role
+    cur.execute(
+        sql.SQL("GRANT SET ON PARAMETER temp_file_limit TO {provisioner}").format(provisioner=sql.Identifier(provisioner))
+    )
+
+    cur.execute("SHOW server_version_num")
+    if int(fetch_value(cur)) >= MIN_ROLE_ADMIN_SERVER_VERSION:
+        grant_analyst_role_admin(cur, provisioner)
+
+
+# Analysts created by root, before the provisioner existed or while it was not configured, need ADMIN granted so the
+# provisioner can apply resource profiles and revoke or restore their logins. Without INHERIT and SET, the
+# provisioner gets no access to what the analysts own.
+def grant_analyst_role_admin(cur: cursor, provisioner: str) -> None:
+    cur.execute(SQL_ANALYST_ROLES_WITHOUT_ADMIN, {"provisioner": provisioner})
+    for (role,) in cur.fetchall():
+        cur.execute(
+            sql.SQL("GRANT {role} TO {provisioner} WITH ADMIN OPTION, INHERIT FALSE, SET FALSE").format(
+                role=sql.Identifier(role), provisioner=sql.Identifier(provisioner)
+            )
+        )
+
+
+def create_foreign_server(cur: cursor, server: str, host: str, bde_analytics_user: dict[str, str]) -> dict[str, str]:
+    cur.execute(
+        sql.SQL(
+            "CREATE SERVER IF NOT EXISTS {server} FOREIGN DATA WRAPPER postgres_fdw OPTIONS (host %s, "
+            "port '5432', dbname 'bde', extensions 'postgis')"
+        ).format(server=sql.Identifier(server)),
+        (host,),
     )
 
+    server_tuning = apply_server_tuning(cur, FDW_TUNING_PROFILE, server, host)
+
+    cur.execute(
+        sql.SQL("CREATE USER MAPPING IF NOT EXISTS FOR postgres SERVER {server} OPTIONS (user %s, password %s)").format(
+            server=sql.Identifier(server)
+        ),
+        (bde_analytics_user["username"], bde_analytics_user["password"]),
+    )
+    # Keep an existing mapping in step with the (possibly rotated) read-only user secret
+    cur.execute(
+        sql.SQL("ALTER USER MAPPING FOR postgres SERVER {server} OPTIONS (SET user %s, SET password %s)").format(
+            server=sql.Identifier(server)
+        ),
+        (bde_analytics_user["username"], bde_analytics_user["password"]),
+    )
+
+    return server_tuning
+
+
+# Re-applied on every run, so tables added by a sync are tuned too and the options follow changes to the profile
+def tune_foreign_tables() -> dict[str, dict[str, dict[str, str]]]:
+    conn = connect(rds_fdw_root_credentials, host=rds_fdw_host, database=rds_fdw_db)
+
     try:
         with conn.cursor() as cur:
             try:
-                cur.execute("CREATE EXTENSION IF NOT EXISTS postgis")
-                cur.execute("CREATE EXTENSION IF NOT EXISTS postgres_fdw")
+                changes = {schema: apply_table_tuning(cur, FDW_TUNING_PROFILE, schema) for schema in BDE_FOREIGN_SCHEMAS}
+            except psycopg2.Error:
+                conn.rollback()
+                raise
+
+            conn.commit()
 
-                cur.execute(
-                    "CREATE SERVER IF NOT EXISTS bde_processor FOREIGN DATA WRAPPER postgres_fdw OPTIONS (host %s, "
-                    "port '5432', dbname 'bde', extensions 'postgis')",
-                    (bde_host_name,),
-                )
+    finally:
+        conn.close()
+
+    return changes
 
-                cur.execute("ALTER SERVER bde_processor OPTIONS (ADD fetch_size '100000')")
 
-                cur.execute(
-                    "CREATE USER MAPPING IF NOT EXISTS FOR postgres SERVER bde_processor OPTIONS (user %s, password %s)",
-                    (bde_analytics_user_name, bde_analytics_user_pw),
-                )
+# Tables already cached are kept as they are and brought up to date by the scheduled refresh_table_cache lambda
+def create_cached_tables() -> list[str]:
+    conn = connect(rds_fdw_root_credentials, host=rds_fdw_host, database=rds_fdw_db)
+    created = []
+
+    try:
+        with conn.cursor() as cur:
+            for cached_table in BDE_CACHED_TABLES:
+                try:
+                    if create_cached_table(cur, cached_table):
+                        created.append(cached_table.name)
+                except psycopg2.Error:
+                    conn.rollback()
+                    raise
+
+                conn.commit()
 
-                cur.execute("DROP SCHEMA IF EXISTS bde cascade")
-                cur.execute("CREATE SCHEMA bde")
-                cur.execute("IMPORT FOREIGN SCHEMA bde FROM SERVER bde_processor INTO bde")
+    finally:
+        conn.close()
 
-                cur.execute("DROP SCHEMA IF EXISTS table_version cascade")
-                cur.execute("CREATE SCHEMA table_version")
-                cur.execute("IMPORT FOREIGN SCHEMA table_version FROM SERVER bde_processor INTO table_version")
+    return created
 
-                cur.execute("DROP SCHEMA IF EXISTS lds cascade")
-                cur.execute("CREATE SCHEMA lds")
-                cur.execute("IMPORT FOREIGN SCHEMA lds FROM SERVER bde_processor INTO lds")
 
-                cur.execute("DROP SCHEMA IF EXISTS bde_ext cascade")
-                cur.execute("CREATE SCHEMA bde_ext")
-                cur.execute("IMPORT FOREIGN SCHEMA bde_ext FROM SERVER bde_processor INTO bde_ext")
+# This lambda function is run during cdk initialization, as post-db creation initialization script.
+# Re-running it syncs the foreign schemas with production BDE, changing only the tables and columns that changed
+# upstream; invoke it with {"mode": "rebuild"} to drop and re-import them instead. A schema moved to another server
+# in bde_schema_servers has its foreign tables re-created on that server; other schemas are left alone.
+def handler(event: dict[str, str], _context: LambdaContext) -> dict[str, dict[str, Any]]:
+    unknown_servers = set(BDE_SCHEMA_SERVERS.values()) - {FOREIGN_SERVER, *BDE_REPLICA_HOSTS}
+    if unknown_servers:
+        raise ValueError(f"bde_schema_servers refers to servers not in bde_replicas: {', '.join(sorted(unknown_servers))}")
 
-                cur.execute("DROP SCHEMA IF EXISTS bde_control cascade")
-                cur.execute("CREATE SCHEMA bde_control")
-                cur.execute("IMPORT FOREIGN SCHEMA bde_control FROM SERVER bde_processor INTO bde_control")
+    conn = connect(rds_fdw_root_credentials, host=rds_fdw_host, database=rds_fdw_db)
+    bde_analytics_user = bde_analytics_user_credentials.get()
+
+    try:
+        with conn.cursor() as cur:
+            try:
+                cur.execute("CREATE EXTENSION IF NOT EXISTS postgis")
+                cur.execute("CREATE EXTENSION IF NOT EXISTS postgres_fdw")
+                # Per role and statement counters read by the collect_statement_telemetry lambda; RDS preloads the library
+                cur.execute("CREATE EXTENSION IF NOT EXISTS pg_stat_statements")
+
+                server_tuning = {
+                    server: create_foreign_server(cur, server, host, bde_analytics_user)
+                    for server, host in {FOREIGN_SERVER: bde_host_name, **BDE_REPLICA_HOSTS}.items()
+                }
+
+                cur.execute(PUSHDOWN_SQL.read_text())
+
+                if rds_fdw_provisioner:
+                    create_provisioner_role(cur, rds_fdw_provisioner)
 
             except psycopg2.Error:
                 conn.rollback()
@@ -82,3 +200,18 @@ def handler(_event: dict[str, str], _context: LambdaContext) -> None:
 
     finally:
         conn.close()
+
+    # The schemas are imported concurrently, each over its own connection, once the server and user mapping exist
+    report = import_foreign_schemas(
+        lambda: connect(rds_fdw_root_credentials, host=rds_fdw_host, database=rds_fdw_db),
+        BDE_FOREIGN_SCHEMAS,
+        rebuild=event.get("mode") == "rebuild",
+        schema_servers=BDE_SCHEMA_SERVERS,
+    )
+
+    report["fdw_tuning"] = {"servers": server_tuning, "tables": tune_foreign_tables()}
+
+    if BDE_CACHED_TABLES:
+        report[CACHE_SCHEMA] = {"created": create_cached_tables()}
+
+    return report
@@ -0,0 +1,87 @@
+-- Helpers for analysts to see which parts of a query against the BDE foreign schemas run on production BDE,
+-- used by src/pushdown.py. Installed, and replaced, by every run of the RDS Init lambda.
+CREATE SCHEMA IF NOT EXISTS fdw_pushdown;
+GRANT USAGE ON SCHEMA fdw_pushdown TO PUBLIC;
+
+-- The plan of a query as EXPLAIN (VERBOSE, FORMAT JSON) returns it; with analyze the query is run too
+CREATE OR REPLACE FUNCTION fdw_pushdown.explain(query text, analyze_query boolean DEFAULT false)
+RETURNS jsonb
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    plan jsonb;
+BEGIN
+    EXECUTE format('EXPLAIN (VERBOSE, FORMAT JSON%s) %s', CASE WHEN analyze_query THEN ', ANALYZE' ELSE '' END, query)
+    INTO plan;
+    RETURN plan -> 0 -> 'Plan';
+END
+$$;
+
+-- One row per Foreign Scan: the SQL sent to production BDE, any filter applied locally, and the estimated rows
+CREATE OR REPLACE FUNCTION fdw_pushdown.foreign_scans(query text)
+RETURNS TABLE (relations text, remote_sql text, local_filter text, plan_rows numeric, plan_width integer)
+LANGUAGE sql
+AS $$
+    SELECT coalesce(node ->> 'Relations', (node ->> 'Schema') || '.' || (node ->> 'Relation Name')),
+           node ->> 'Remote SQL',
+           node ->> 'Filter',
+           (node ->> 'Plan Rows')::numeric,
+           (node ->> 'Plan Width')::integer
+    FROM jsonb_path_query(fdw_pushdown.explain(query), 'strict $.** ? (@."Node Type" == "Foreign Scan")') AS node
+$$;
+
+-- Earlier versions only checked bde_processor; servers for read replicas may list other extensions
+DROP FUNCTION IF EXISTS fdw_pushdown.function_shippability(text[]);
+DROP FUNCTION IF EXISTS fdw_pushdown.operator_shippability(text[]);
+
+-- postgres_fdw only ships immutable functions that are built in or belong to an extension listed in the
+-- extensions option of the foreign table's server; names may be schema qualified, as EXPLAIN VERBOSE prints them
+CREATE OR REPLACE FUNCTION fdw_pushdown.function_shippability(function_names text[], server_name name)
+RETURNS TABLE (function_name text, volatility "char", extension name, shippable boolean)
+LANGUAGE sql
+STABLE
+AS $$
+    WITH server_extensions AS (
+        SELECT string_to_array(replace(substr(option, length('extensions=') + 1), ' ', ''), ',') AS names
+        FROM pg_foreign_server s, unnest(s.srvoptions) AS option
+        WHERE s.srvname = server_name AND option LIKE 'extensions=%'
+    )
+    SELECT n.nspname || '.' || p.proname || '(' || pg_get_function_identity_arguments(p.oid) || ')',
+           p.provolatile,
+           e.extname,
+           p.provolatile = 'i'
+               AND (p.oid < 16384 OR e.extname = ANY(coalesce((SELECT names FROM server_extensions), '{}')))
+    FROM pg_proc p
+    JOIN pg_namespace n ON n.oid = p.pronamespace
+    LEFT JOIN pg_depend d ON d.classid = 'pg_proc'::regclass AND d.objid = p.oid AND d.deptype = 'e'
+    LEFT JOIN pg_extension e ON e.oid = d.refobjid
+    WHERE p.proname = ANY(function_names) OR n.nspname || '.' || p.proname = ANY(function_names)
+    ORDER BY 1
+$$;
+
+-- The same rule applies to operators, which are shippable or not per overload: && is built in for arrays, but
+-- belongs to PostGIS for geometries
+CREATE OR REPLACE FUNCTION fdw_pushdown.operator_shippability(operator_names text[], server_name name)
+RETURNS TABLE (operator_name text, left_type text, right_type text, volatility "char", extension name, shippable boolean)
+LANGUAGE sql
+STABLE
+AS $$
+    WITH server_extensions AS (
+        SELECT string_to_array(replace(substr(option, length('extensions=') + 1), ' ', ''), ',') AS names
+        FROM pg_foreign_server s, unnest(s.srvoptions) AS option
+        WHERE s.srvname = server_name AND option LIKE 'extensions=%'
+    )
+    SELECT o.oprname::text,
+           format_type(o.oprleft, NULL),
+           format_type(o.oprright, NULL),
+           p.provolatile,
+           e.extname,
+           p.provolatile = 'i'
+               AND (o.oid < 16384 OR e.extname = ANY(coalesce((SELECT names FROM server_extensions), '{}')))
+    FROM pg_operator o
+    JOIN pg_proc p ON p.oid = o.oprcode
+    LEFT JOIN pg_depend d ON d.classid = 'pg_operator'::regclass AND d.objid = o.oid AND d.deptype = 'e'
+    LEFT JOIN pg_extension e ON e.oid = d.refobjid
+    WHERE o.oprname = ANY(operator_names)
+    ORDER BY 1, 2, 3
+$$;
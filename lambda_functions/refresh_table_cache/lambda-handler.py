@@ -0,0 +1,40 @@
+import os
+from typing import Any
+
+import psycopg2
+from aws_lambda_powertools.utilities.typing import LambdaContext
+from shared.credentials import SecretCredentials, connect
+from shared.table_cache import load_cached_tables, refresh_cached_table
+
+# ----- FDW Analytics -----
+rds_fdw_host = os.environ["RDS_FDW_HOST"]
+rds_fdw_db = os.environ["RDS_FDW_DB"]
+rds_fdw_root_credentials = SecretCredentials("RDS_FDW_ROOT")
+
+BDE_CACHED_TABLES = load_cached_tables(os.environ.get("BDE_CACHED_TABLES"))
+
+
+# Runs on a schedule and applies the rows changed upstream since the last refresh to each cached table,
+# in its own transaction so one failing table does not hold back the others. Tables added to bde_cached_tables are
+# reported as not initialised until the init script has copied them.
+def handler(_event: dict[str, Any], _context: LambdaContext) -> dict[str, dict[str, Any]]:
+    conn = connect(rds_fdw_root_credentials, host=rds_fdw_host, database=rds_fdw_db)
+    report: dict[str, dict[str, Any]] = {}
+
+    try:
+        with conn.cursor() as cur:
+            for cached_table in BDE_CACHED_TABLES:
+                try:
+                    refresh = refresh_cached_table(cur, cached_table)
+                    conn.commit()
+                    report[cached_table.name] = (
+                        {"status": "not initialised"} if refresh is None else {"status": "refreshed", **refresh}
+                    )
+                except psycopg2.Error as error:
+                    conn.rollback()
+                    report[cached_table.name] = {"status": "failed", "error": str(error).strip()}
+
+    finally:
+        conn.close()
+
+    return report
@@ -0,0 +1,117 @@
+import gzip
+import io
+import json
+import time
+from typing import TYPE_CHECKING, Any, Optional
+
+import psycopg2
+from botocore.exceptions import ClientError
+from psycopg2 import sql
+from psycopg2.extensions import connection
+
+from .clients import s3_client
+
+if TYPE_CHECKING:
+    from mypy_boto3_s3.type_defs import CompletedPartTypeDef
+else:
+    CompletedPartTypeDef = dict
+
+# S3 takes at least 5 MiB in every part but the last. Memory use stays around one part, however many rows there are.
+EXPORT_PART_BYTES = 16 * 1024 * 1024
+EXPORT_URL_EXPIRY_SECONDS = 3600
+
+
+def load_export_queries(export_queries_json: Optional[str]) -> dict[str, str]:
+    # e.g. {"parcels": "SELECT id, status, ST_AsText(shape) FROM bde.crs_parcel"}
+    queries: dict[str, str] = json.loads(export_queries_json or "{}")
+    return queries
+
+
+class MultipartUploadWriter:
+    """File-like target for COPY ... TO STDOUT that gzips what is written to it and uploads it to S3 a part at a time."""
+
+    def __init__(self, bucket: str, key: str, part_bytes: int = EXPORT_PART_BYTES) -> None:
+        self.bucket = bucket
+        self.key = key
+        self.part_bytes = part_bytes
+        # Stored as a .gz file rather than with Content-Encoding: gzip, which HTTP clients would decompress on download
+        self.upload_id = s3_client().create_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            ContentType="application/gzip",
+            ContentDisposition=f'attachment; filename="{key.rsplit("/", 1)[-1]}"',
+        )["UploadId"]
+        self.parts: list[CompletedPartTypeDef] = []
+        self.buffer = io.BytesIO()
+        self.compressor = gzip.GzipFile(fileobj=self.buffer, mode="wb")
+        self.bytes_written = 0
+        self.bytes_uploaded = 0
+
+    def write(self, data: bytes) -> int:
+        self.compressor.write(data)
+        self.bytes_written += len(data)
+        if self.buffer.tell() >= self.part_bytes:
+            self.upload_part()
+        return len(data)
+
+    def upload_part(self) -> None:
+        body = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+        part_number = len(self.parts) + 1
+        response = s3_client().upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=part_number, Body=body
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+        self.bytes_uploaded += len(body)
+
+    def complete(self) -> None:
+        # Closing the compressor writes the gzip trailer, which goes out with the last part
+        self.compressor.close()
+        self.upload_part()
+        s3_client().complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={"Parts": self.parts}
+        )
+
+    def abort(self) -> None:
+        # Parts of an unfinished upload are stored, and billed, until the upload is aborted
+        self.compressor.close()
+        s3_client().abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+
+def export_query(conn: connection, query: str, bucket: str, key: str, part_bytes: int = EXPORT_PART_BYTES) -> dict[str, Any]:
+    """Upload the result of `query` to s3://`bucket`/`key` as gzipped CSV with a header row, and report on it.
+
+    COPY sends rows as the server produces them, so neither the database nor the lambda holds the whole result.
+    The query runs in a read-only transaction.
+    """
+    start = time.perf_counter()
+    writer = MultipartUploadWriter(bucket, key, part_bytes)
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET TRANSACTION READ ONLY")
+            cur.copy_expert(sql.SQL("COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)").format(query=sql.SQL(query)), writer)
+            rows = cur.rowcount
+        writer.complete()
+
+    except (psycopg2.Error, ClientError):
+        conn.rollback()
+        writer.abort()
+        raise
+
+    conn.commit()
+
+    return {
+        "bucket": bucket,
+        "key": key,
+        "rows": rows,
+        "bytes": writer.bytes_written,
+        "compressed_bytes": writer.bytes_uploaded,
+        "parts": len(writer.parts),
+        "duration": round(time.perf_counter() - start, 3),
+        "url": s3_client().generate_presigned_url(
+            "get_object", Params={"Bucket": bucket, "Key": key}, ExpiresIn=EXPORT_URL_EXPIRY_SECONDS
+        ),
+    }
@@ -0,0 +1,52 @@
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+import boto3
+from botocore.config import Config
+
+if TYPE_CHECKING:
+    from mypy_boto3_iam import IAMClient
+    from mypy_boto3_rds import RDSClient
+    from mypy_boto3_s3 import S3Client
+    from mypy_boto3_secretsmanager import SecretsManagerClient
+    from mypy_boto3_sts import STSClient
+
+else:
+    IAMClient = RDSClient = S3Client = SecretsManagerClient = STSClient = dict
+
+
+# Clients are created on first use and then reused for the lifetime of the container
+
+# IAM has low per-account request quotas; adaptive mode backs off and rate limits on throttling errors,
+# which matters when several users are provisioned concurrently
+IAM_CLIENT_CONFIG = Config(retries={"max_attempts": 10, "mode": "adaptive"})
+
+
+@lru_cache(maxsize=None)
+def iam_client() -> IAMClient:
+    return boto3.client("iam", config=IAM_CLIENT_CONFIG)
+
+
+@lru_cache(maxsize=None)
+def rds_client() -> RDSClient:
+    return boto3.client("rds")
+
+
+@lru_cache(maxsize=None)
+def s3_client() -> S3Client:
+    return boto3.client("s3")
+
+
+@lru_cache(maxsize=None)
+def secretsmanager_client() -> SecretsManagerClient:
+    return boto3.client("secretsmanager")
+
+
+@lru_cache(maxsize=None)
+def sts_client() -> STSClient:
+    return boto3.client("sts")
+
+
+@lru_cache(maxsize=None)
+def aws_account_id() -> str:
+    return sts_client().get_caller_identity()["Account"]
@@ -0,0 +1,39 @@
+from typing import Any, Optional
+
+import psycopg2
+from psycopg2.extensions import STATUS_READY, connection
+
+from .credentials import Credentials, connect
+
+CONNECT_TIMEOUT_SECONDS = 10
+
+# Detect sockets silently dropped while the Lambda container was frozen, instead of hanging on them
+KEEPALIVE_OPTIONS = {"keepalives": 1, "keepalives_idle": 30, "keepalives_interval": 10, "keepalives_count": 3}
+
+
+class WarmConnection:
+    # Kept in module scope so warm invocations reuse the connection and skip the TCP, TLS and auth round trips
+    def __init__(self, credentials: Credentials, **connect_kwargs: Any) -> None:
+        self.credentials = credentials
+        self.connect_kwargs = {"connect_timeout": CONNECT_TIMEOUT_SECONDS, **KEEPALIVE_OPTIONS, **connect_kwargs}
+        self.conn: Optional[connection] = None
+
+    def get(self) -> connection:
+        if self.conn is not None and not self.conn.closed:
+            try:
+                if self.conn.status != STATUS_READY:
+                    self.conn.rollback()
+                with self.conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                self.conn.rollback()
+                return self.conn
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                self.close()
+
+        self.conn = connect(self.credentials, **self.connect_kwargs)
+        return self.conn
+
+    def close(self) -> None:
+        if self.conn is not None and not self.conn.closed:
+            self.conn.close()
+        self.conn = None
@@ -0,0 +1,86 @@
+import os
+import time
+from typing import Any, Protocol
+
+import psycopg2
+from aws_lambda_powertools.utilities import parameters
+from psycopg2.extensions import connection
+
+from .clients import rds_client
+
+# Secrets are cached in memory by powertools; once this expires a warm container picks up a rotated password
+SECRET_MAX_AGE_SECONDS = int(os.environ.get("SECRET_MAX_AGE_SECONDS", "300"))
+
+AUTHENTICATION_FAILURE_SQLSTATES = ("28000", "28P01")
+
+# RDS IAM auth tokens are valid for 15 minutes; regenerate well before that
+# https://docs.aws.amazon.com/AmazonRDS/latest/UserGuide/UsingWithRDS.IAMDBAuth.Connecting.html
+IAM_AUTH_TOKEN_MAX_AGE_SECONDS = 600
+
+
+class Credentials(Protocol):
+    def get(self) -> dict[str, str]: ...
+
+    def invalidate(self) -> None: ...
+
+
+class SecretCredentials:
+    def __init__(self, secret_name_environment_variable: str, max_age: int = SECRET_MAX_AGE_SECONDS) -> None:
+        self.secret_name_environment_variable = secret_name_environment_variable
+        self.max_age = max_age
+        self.force_fetch = False
+
+    def get(self) -> dict[str, str]:
+        # Nothing is fetched until first use, so importing a handler never calls Secrets Manager
+        secret: dict[str, str] = parameters.get_secret(  # type: ignore[assignment]
+            os.environ[self.secret_name_environment_variable],
+            transform="json",
+            max_age=self.max_age,
+            force_fetch=self.force_fetch,
+        )
+        self.force_fetch = False
+        return secret
+
+    def invalidate(self) -> None:
+        self.force_fetch = True
+
+
+class IamAuthTokenCredentials:
+    def __init__(self, host: str, port: int, username: str, max_age: int = IAM_AUTH_TOKEN_MAX_AGE_SECONDS) -> None:
+        self.host = host
+        self.port = port
+        self.username = username
+        self.max_age = max_age
+        self.token = ""
+        self.expires_at = 0.0
+
+    def get(self) -> dict[str, str]:
+        if time.monotonic() >= self.expires_at:
+            # Token generation signs the request locally; no AWS API call is made
+            self.token = rds_client().generate_db_auth_token(DBHostname=self.host, Port=self.port, DBUsername=self.username)
+            self.expires_at = time.monotonic() + self.max_age
+        return {"username": self.username, "password": self.token}
+
+    def invalidate(self) -> None:
+        self.expires_at = 0.0
+
+
+def is_authentication_failure(error: psycopg2.OperationalError) -> bool:
+    return error.pgcode in AUTHENTICATION_FAILURE_SQLSTATES or "authentication failed" in str(error)
+
+
+def connect(credentials: Credentials, **connect_kwargs: Any) -> connection:
+    secret = credentials.get()
+    try:
+        conn: connection = psycopg2.connect(user=secret["username"], password=secret["password"], **connect_kwargs)
+        return conn
+    except psycopg2.OperationalError as error:
+        if not is_authentication_failure(error):
+            raise
+
+    # The cached password may have been rotated, or the token expired, since it was fetched; fetch it again once
+    # before giving up
+    credentials.invalidate()
+    secret = credentials.get()
+    conn = psycopg2.connect(user=secret["username"], password=secret["password"], **connect_kwargs)
+    return conn
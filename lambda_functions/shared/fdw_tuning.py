@@ -0,0 +1,178 @@
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from psycopg2 import sql
+from psycopg2.extensions import cursor
+
+from .foreign_schema import FOREIGN_SERVER
+from .foreign_statistics import MIN_SAMPLING_SERVER_VERSION
+from .table_cache import fetch_value
+
+# Widths, in bytes, assumed for columns with neither local statistics nor a fixed length
+GEOMETRY_WIDTH_ESTIMATE = 1024
+VARIABLE_WIDTH_ESTIMATE = 32
+ROW_OVERHEAD_BYTES = 24
+
+SQL_SERVER_OPTIONS = "SELECT srvoptions FROM pg_foreign_server WHERE srvname = %s"
+
+SQL_FOREIGN_TABLE_OPTIONS = """
+    SELECT c.relname, ft.ftoptions
+    FROM pg_foreign_table ft
+    JOIN pg_class c ON c.oid = ft.ftrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = %s
+    ORDER BY c.relname
+"""
+
+SQL_FOREIGN_TABLE_COLUMN_WIDTHS = """
+    SELECT c.relname, format_type(a.atttypid, a.atttypmod), t.typlen, s.avg_width
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    JOIN pg_type t ON t.oid = a.atttypid
+    LEFT JOIN pg_stats s ON s.schemaname = n.nspname AND s.tablename = c.relname AND s.attname = a.attname
+    WHERE n.nspname = %s AND c.relkind = 'f'
+"""
+
+
+def option_value(value: Any) -> str:
+    # FDW options are strings; JSON booleans become the "true" / "false" that postgres_fdw expects
+    if isinstance(value, bool):
+        return str(value).lower()
+    return str(value)
+
+
+@dataclass(frozen=True)
+class FdwTuningProfile:
+    # Costs feed the planner's choice between pushing work to production BDE and pulling rows across;
+    # async_capable lets Append nodes (UNION ALL, partitions) scan several foreign tables at once, and
+    # analyze_sampling (PostgreSQL 16 and later) has BDE sample pages for ANALYZE instead of sending every row
+    server_options: dict[str, str] = field(
+        default_factory=lambda: {
+            "fetch_size": "10000",
+            "async_capable": "true",
+            "fdw_startup_cost": "100",
+            "fdw_tuple_cost": "0.2",
+            "analyze_sampling": "system",
+        }
+    )
+    # Each foreign table fetches as many rows per round trip as fit in this budget, within the bounds below
+    fetch_batch_bytes: int = 16 * 1024 * 1024
+    min_fetch_size: int = 1000
+    max_fetch_size: int = 100000
+    # Explicit options per table, e.g. {"bde.crs_parcel": {"fetch_size": "2000"}}, win over computed ones
+    tables: dict[str, dict[str, str]] = field(default_factory=dict)
+
+    @classmethod
+    def from_config(cls, config: dict[str, Any]) -> "FdwTuningProfile":
+        # Configured server options are merged over the defaults, so overriding one keeps the others, analyze_sampling
+        # in particular
+        defaults = cls()
+        return cls(
+            server_options={
+                key: option_value(value)
+                for key, value in {**defaults.server_options, **config.get("server_options", {})}.items()
+            },
+            fetch_batch_bytes=config.get("fetch_batch_bytes", defaults.fetch_batch_bytes),
+            min_fetch_size=config.get("min_fetch_size", defaults.min_fetch_size),
+            max_fetch_size=config.get("max_fetch_size", defaults.max_fetch_size),
+            tables={
+                table: {key: option_value(value) for key, value in options.items()}
+                for table, options in config.get("tables", {}).items()
+            },
+        )
+
+    def fetch_size(self, row_width: int) -> int:
+        return max(self.min_fetch_size, min(self.max_fetch_size, self.fetch_batch_bytes // row_width))
+
+
+def load_fdw_tuning_profile(fdw_tuning_json: Optional[str]) -> FdwTuningProfile:
+    return FdwTuningProfile.from_config(json.loads(fdw_tuning_json or "{}"))
+
+
+def estimate_column_width(column_type: str, type_length: int, average_width: Optional[int]) -> int:
+    if average_width is not None:
+        return average_width
+    if type_length > 0:
+        return type_length
+    declared_length = re.search(r"^(?:character varying|character|bit varying|bit)\((\d+)\)", column_type)
+    if declared_length:
+        return int(declared_length.group(1))
+    if "geometry" in column_type or "geography" in column_type:
+        return GEOMETRY_WIDTH_ESTIMATE
+    return VARIABLE_WIDTH_ESTIMATE
+
+
+def parse_options(options: Optional[list[str]]) -> dict[str, str]:
+    return dict(option.split("=", 1) for option in options or [])
+
+
+def alter_options(
+    cur: cursor, object_type: sql.Composable, object_name: sql.Composable, current: dict[str, str], desired: dict[str, str]
+) -> dict[str, str]:
+    """Set the desired FDW options on a server or foreign table, leaving alone those that already match."""
+    changed = {key: value for key, value in desired.items() if current.get(key) != value}
+    if changed:
+        actions = [
+            sql.SQL("{action} {key} {value}").format(
+                action=sql.SQL("SET" if key in current else "ADD"), key=sql.Identifier(key), value=sql.Literal(value)
+            )
+            for key, value in changed.items()
+        ]
+        cur.execute(
+            sql.SQL("ALTER {object_type} {object_name} OPTIONS ({actions})").format(
+                object_type=object_type, object_name=object_name, actions=sql.SQL(", ").join(actions)
+            )
+        )
+    return changed
+
+
+def apply_server_tuning(
+    cur: cursor, profile: FdwTuningProfile, server: str = FOREIGN_SERVER, host: Optional[str] = None
+) -> dict[str, str]:
+    # With a host, a server created earlier follows a change of host in cdk.json too
+    desired = {**profile.server_options, **({"host": host} if host else {})}
+    # postgres_fdw rejects analyze_sampling before PostgreSQL 16
+    cur.execute("SHOW server_version_num")
+    if int(fetch_value(cur)) < MIN_SAMPLING_SERVER_VERSION:
+        desired.pop("analyze_sampling", None)
+
+    cur.execute(SQL_SERVER_OPTIONS, (server,))
+    (server_options,) = cur.fetchone() or (None,)
+    return alter_options(cur, sql.SQL("SERVER"), sql.Identifier(server), parse_options(server_options), desired)
+
+
+def apply_table_tuning(cur: cursor, profile: FdwTuningProfile, schema: str) -> dict[str, dict[str, str]]:
+    """Set fetch_size and use_remote_estimate on every foreign table in `schema` and return what changed.
+
+    fetch_size is sized from the estimated row width, so wide geometry tables fetch small batches and narrow
+    lookup tables large ones. Tables without local statistics use remote estimates, as the planner's defaults
+    for them are guesses; once ANALYZE has run on a table, re-applying the profile turns remote estimates off.
+    """
+    cur.execute(SQL_FOREIGN_TABLE_COLUMN_WIDTHS, (schema,))
+    row_widths: dict[str, int] = {}
+    analyzed: set[str] = set()
+    for table, column_type, type_length, average_width in cur.fetchall():
+        row_widths[table] = row_widths.get(table, ROW_OVERHEAD_BYTES) + estimate_column_width(
+            column_type, type_length, average_width
+        )
+        if average_width is not None:
+            analyzed.add(table)
+
+    cur.execute(SQL_FOREIGN_TABLE_OPTIONS, (schema,))
+    changes: dict[str, dict[str, str]] = {}
+    for table, table_options in cur.fetchall():
+        desired = {
+            "fetch_size": str(profile.fetch_size(row_widths.get(table, ROW_OVERHEAD_BYTES))),
+            "use_remote_estimate": "false" if table in analyzed else "true",
+            **profile.tables.get(f"{schema}.{table}", {}),
+        }
+        changed = alter_options(
+            cur, sql.SQL("FOREIGN TABLE"), sql.Identifier(schema, table), parse_options(table_options), desired
+        )
+        if changed:
+            changes[table] = changed
+
+    return changes
@@ -0,0 +1,254 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extensions import connection, cursor
+
+# Production BDE primary; schemas can instead be imported from a replica server, see import_foreign_schemas
+FOREIGN_SERVER = "bde_processor"
+
+# Each import is a catalog round trip to production BDE; a few at a time keeps the load there modest
+IMPORT_MAX_WORKERS = int(os.environ.get("IMPORT_MAX_WORKERS", "3"))
+IMPORT_ATTEMPTS = 3
+IMPORT_RETRY_DELAY_SECONDS = 5.0
+
+# Foreign table columns and their formatted types, e.g. {"crs_parcel": {"id": "integer", "shape": "geometry"}}
+ForeignTables = dict[str, dict[str, str]]
+
+SQL_FOREIGN_TABLE_COLUMNS = """
+    SELECT c.relname, a.attname, format_type(a.atttypid, a.atttypmod)
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    WHERE n.nspname = %s AND c.relkind = 'f'
+    ORDER BY c.relname, a.attnum
+"""
+
+SQL_FOREIGN_TABLE_SERVERS = """
+    SELECT c.relname, s.srvname
+    FROM pg_foreign_table ft
+    JOIN pg_foreign_server s ON s.oid = ft.ftserver
+    JOIN pg_class c ON c.oid = ft.ftrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = %s
+"""
+
+
+@dataclass
+class ForeignSchemaChanges:
+    added_tables: list[str] = field(default_factory=list)
+    moved_tables: list[str] = field(default_factory=list)
+    dropped_tables: list[str] = field(default_factory=list)
+    added_columns: dict[str, dict[str, str]] = field(default_factory=dict)
+    dropped_columns: dict[str, list[str]] = field(default_factory=dict)
+    altered_columns: dict[str, dict[str, str]] = field(default_factory=dict)
+
+    def report(self) -> dict[str, list[str]]:
+        return {
+            "added_tables": self.added_tables,
+            "moved_tables": self.moved_tables,
+            "dropped_tables": self.dropped_tables,
+            "added_columns": [f"{table}.{column}" for table, columns in self.added_columns.items() for column in columns],
+            "dropped_columns": [f"{table}.{column}" for table, columns in self.dropped_columns.items() for column in columns],
+            "altered_columns": [f"{table}.{column}" for table, columns in self.altered_columns.items() for column in columns],
+        }
+
+
+def read_foreign_tables(cur: cursor, schema: str) -> ForeignTables:
+    cur.execute(SQL_FOREIGN_TABLE_COLUMNS, (schema,))
+    foreign_tables: ForeignTables = {}
+    for table, column, column_type in cur.fetchall():
+        foreign_tables.setdefault(table, {})[column] = column_type
+    return foreign_tables
+
+
+def read_foreign_table_servers(cur: cursor, schema: str) -> dict[str, str]:
+    cur.execute(SQL_FOREIGN_TABLE_SERVERS, (schema,))
+    return dict(cur.fetchall())
+
+
+def diff_foreign_tables(local: ForeignTables, remote: ForeignTables) -> ForeignSchemaChanges:
+    changes = ForeignSchemaChanges(
+        added_tables=sorted(remote.keys() - local.keys()),
+        dropped_tables=sorted(local.keys() - remote.keys()),
+    )
+
+    for table in sorted(local.keys() & remote.keys()):
+        local_columns, remote_columns = local[table], remote[table]
+        added = {column: column_type for column, column_type in remote_columns.items() if column not in local_columns}
+        dropped = [column for column in local_columns if column not in remote_columns]
+        altered = {
+            column: column_type
+            for column, column_type in remote_columns.items()
+            if column in local_columns and local_columns[column] != column_type
+        }
+        if added:
+            changes.added_columns[table] = added
+        if dropped:
+            changes.dropped_columns[table] = dropped
+        if altered:
+            changes.altered_columns[table] = altered
+
+    return changes
+
+
+def execute_in_savepoint(cur: cursor, statement: sql.Composable, errors: list[str]) -> bool:
+    # A drop blocked by an analyst's view (or similar) is reported and skipped, without aborting the whole sync
+    cur.execute("SAVEPOINT sync_foreign_schema")
+    try:
+        cur.execute(statement)
+    except psycopg2.Error as error:
+        cur.execute("ROLLBACK TO SAVEPOINT sync_foreign_schema")
+        errors.append(str(error).strip())
+        return False
+
+    cur.execute("RELEASE SAVEPOINT sync_foreign_schema")
+    return True
+
+
+def sync_foreign_schema(cur: cursor, schema: str, server: str = FOREIGN_SERVER) -> dict[str, list[str]]:
+    """Bring the foreign tables in `schema` in line with the remote schema of the same name on `server`.
+
+    The remote catalog is imported into a throwaway staging schema and diffed against the local foreign tables,
+    so only tables and columns that changed upstream are added, altered or dropped. A foreign table cannot change
+    server, so tables still on another server are dropped and replaced by their staging copy. Dependent objects
+    such as analyst views are never dropped: a change they block is skipped and reported instead.
+    """
+    staging_schema = f"{schema}_sync"
+    schema_identifier, staging_identifier = sql.Identifier(schema), sql.Identifier(staging_schema)
+
+    cur.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {schema}").format(schema=schema_identifier))
+    cur.execute(sql.SQL("DROP SCHEMA IF EXISTS {staging} CASCADE").format(staging=staging_identifier))
+    cur.execute(sql.SQL("CREATE SCHEMA {staging}").format(staging=staging_identifier))
+    cur.execute(
+        sql.SQL("IMPORT FOREIGN SCHEMA {schema} FROM SERVER {server} INTO {staging}").format(
+            schema=schema_identifier, server=sql.Identifier(server), staging=staging_identifier
+        )
+    )
+
+    local, remote = read_foreign_tables(cur, schema), read_foreign_tables(cur, staging_schema)
+    errors: list[str] = []
+
+    # Dropped tables are re-added from staging by the diff below; those a view holds on to stay where they are
+    moved_tables = []
+    for table, table_server in sorted(read_foreign_table_servers(cur, schema).items()):
+        if table_server != server and table in remote:
+            drop_table = sql.SQL("DROP FOREIGN TABLE {table}").format(table=sql.Identifier(schema, table))
+            if execute_in_savepoint(cur, drop_table, errors):
+                moved_tables.append(table)
+                del local[table]
+
+    changes = diff_foreign_tables(local, remote)
+    changes.added_tables = [table for table in changes.added_tables if table not in moved_tables]
+    changes.moved_tables = moved_tables
+
+    for table in changes.added_tables + changes.moved_tables:
+        cur.execute(
+            sql.SQL("ALTER FOREIGN TABLE {staging_table} SET SCHEMA {schema}").format(
+                staging_table=sql.Identifier(staging_schema, table), schema=schema_identifier
+            )
+        )
+
+    for table in changes.dropped_tables:
+        execute_in_savepoint(cur, sql.SQL("DROP FOREIGN TABLE {table}").format(table=sql.Identifier(schema, table)), errors)
+
+    for table, columns in changes.added_columns.items():
+        for column, column_type in columns.items():
+            cur.execute(
+                sql.SQL("ALTER FOREIGN TABLE {table} ADD COLUMN {column} {column_type}").format(
+                    table=sql.Identifier(schema, table), column=sql.Identifier(column), column_type=sql.SQL(column_type)
+                )
+            )
+
+    for table, dropped_columns in changes.dropped_columns.items():
+        for column in dropped_columns:
+            execute_in_savepoint(
+                cur,
+                sql.SQL("ALTER FOREIGN TABLE {table} DROP COLUMN {column}").format(
+                    table=sql.Identifier(schema, table), column=sql.Identifier(column)
+                ),
+                errors,
+            )
+
+    for table, columns in changes.altered_columns.items():
+        for column, column_type in columns.items():
+            execute_in_savepoint(
+                cur,
+                sql.SQL("ALTER FOREIGN TABLE {table} ALTER COLUMN {column} TYPE {column_type}").format(
+                    table=sql.Identifier(schema, table), column=sql.Identifier(column), column_type=sql.SQL(column_type)
+                ),
+                errors,
+            )
+
+    cur.execute(sql.SQL("DROP SCHEMA {staging} CASCADE").format(staging=staging_identifier))
+
+    return {**changes.report(), "errors": errors}
+
+
+# Drops every foreign table, and with CASCADE every view built on them, then imports the schema again
+def rebuild_foreign_schema(cur: cursor, schema: str, server: str = FOREIGN_SERVER) -> None:
+    cur.execute(sql.SQL("DROP SCHEMA IF EXISTS {schema} CASCADE").format(schema=sql.Identifier(schema)))
+    cur.execute(sql.SQL("CREATE SCHEMA {schema}").format(schema=sql.Identifier(schema)))
+    cur.execute(
+        sql.SQL("IMPORT FOREIGN SCHEMA {schema} FROM SERVER {server} INTO {schema}").format(
+            schema=sql.Identifier(schema), server=sql.Identifier(server)
+        )
+    )
+
+
+def import_foreign_schema(
+    open_connection: Callable[[], connection],
+    schema: str,
+    rebuild: bool = False,
+    attempts: int = IMPORT_ATTEMPTS,
+    retry_delay: float = IMPORT_RETRY_DELAY_SECONDS,
+    server: str = FOREIGN_SERVER,
+) -> dict[str, Any]:
+    # Every schema is imported in its own connection and transaction, so one schema can be retried on its own
+    start = time.perf_counter()
+    attempt = 1
+    while True:
+        conn: Optional[connection] = None
+        try:
+            conn = open_connection()
+            report: dict[str, Any] = {}
+            with conn.cursor() as cur:
+                if rebuild:
+                    rebuild_foreign_schema(cur, schema, server)
+                else:
+                    report = sync_foreign_schema(cur, schema, server)
+            conn.commit()
+            return {**report, "server": server, "attempts": attempt, "duration": round(time.perf_counter() - start, 3)}
+
+        except psycopg2.OperationalError:
+            # Dropped connections and statement timeouts are worth another go; errors in the SQL itself are not.
+            # Closing the connection discards the uncommitted import.
+            if attempt >= attempts:
+                raise
+
+        finally:
+            if conn is not None:
+                conn.close()
+
+        time.sleep(retry_delay * attempt)
+        attempt += 1
+
+
+def import_foreign_schemas(
+    open_connection: Callable[[], connection],
+    schemas: list[str],
+    rebuild: bool = False,
+    max_workers: int = IMPORT_MAX_WORKERS,
+    schema_servers: Optional[dict[str, str]] = None,
+) -> dict[str, dict[str, Any]]:
+    # Schemas missing from schema_servers, e.g. bde_control, are imported from the primary
+    def import_schema(schema: str) -> dict[str, Any]:
+        server = (schema_servers or {}).get(schema, FOREIGN_SERVER)
+        return import_foreign_schema(open_connection, schema, rebuild, server=server)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(schemas, executor.map(import_schema, schemas)))
@@ -0,0 +1,148 @@
+import time
+from datetime import datetime
+from typing import Any, Optional
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.errors import QueryCanceled
+from psycopg2.extensions import connection, cursor
+
+from .table_cache import fetch_value
+
+STATISTICS_SCHEMA = "fdw_stats"
+
+# Before PostgreSQL 16, postgres_fdw has no analyze_sampling: ANALYZE fetches every row of a foreign table from
+# production BDE and samples it locally, whatever the statistics target
+MIN_SAMPLING_SERVER_VERSION = 160000
+
+SQL_CREATE_ANALYZE_LOG = sql.SQL(
+    "CREATE TABLE IF NOT EXISTS {schema}.analyze_log "
+    "(table_name text PRIMARY KEY, analyzed_at timestamptz NOT NULL, duration_seconds real NOT NULL)"
+).format(schema=sql.Identifier(STATISTICS_SCHEMA))
+
+# Failed attempts are logged as well, with no analyzed_at when the table was never analyzed. Logs written before
+# attempts were recorded have no attempted_at, and only successes.
+SQL_MIGRATE_ANALYZE_LOG = sql.SQL(
+    "ALTER TABLE {schema}.analyze_log "
+    "ALTER COLUMN analyzed_at DROP NOT NULL, ALTER COLUMN duration_seconds DROP NOT NULL, "
+    "ADD COLUMN IF NOT EXISTS attempted_at timestamptz, "
+    "ADD COLUMN IF NOT EXISTS outcome text NOT NULL DEFAULT 'analyzed'"
+).format(schema=sql.Identifier(STATISTICS_SCHEMA))
+
+# Query counts come from pg_stat_statements when it is installed; without it every table counts as unqueried
+SQL_FOREIGN_TABLES = """
+    SELECT n.nspname || '.' || c.relname, coalesce(l.attempted_at, l.analyzed_at),
+           coalesce(l.outcome, 'analyzed') <> 'analyzed', {calls}
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    LEFT JOIN {schema}.analyze_log l ON l.table_name = n.nspname || '.' || c.relname
+    {join_statements}
+    WHERE c.relkind = 'f' AND n.nspname = ANY(%s)
+    GROUP BY 1, 2, 3
+"""
+SQL_STATEMENT_CALLS = "coalesce(sum(s.calls), 0)"
+SQL_JOIN_STATEMENTS = "LEFT JOIN pg_stat_statements s ON s.query ILIKE '%%' || c.relname || '%%'"
+
+SQL_RECORD_ANALYZE = sql.SQL(
+    "INSERT INTO {schema}.analyze_log (table_name, analyzed_at, duration_seconds, attempted_at, outcome) "
+    "VALUES (%s, now(), %s, now(), 'analyzed') "
+    "ON CONFLICT (table_name) DO UPDATE SET analyzed_at = excluded.analyzed_at, duration_seconds = excluded.duration_seconds, "
+    "attempted_at = excluded.attempted_at, outcome = excluded.outcome"
+).format(schema=sql.Identifier(STATISTICS_SCHEMA))
+
+# Keeps the time and duration of the last successful analyze
+SQL_RECORD_FAILED_ANALYZE = sql.SQL(
+    "INSERT INTO {schema}.analyze_log (table_name, attempted_at, outcome) VALUES (%s, now(), %s) "
+    "ON CONFLICT (table_name) DO UPDATE SET attempted_at = excluded.attempted_at, outcome = excluded.outcome"
+).format(schema=sql.Identifier(STATISTICS_SCHEMA))
+
+
+def prioritise_foreign_tables(
+    foreign_tables: list[tuple[str, Optional[datetime], bool, int]], priority_tables: list[str]
+) -> list[str]:
+    """Order tables for analysis: configured priority tables, then never attempted ones, then the most queried,
+    and within each group the longest since they were last attempted.
+
+    Tables whose last attempt failed, e.g. by hitting the statement timeout, come after all the others, the oldest
+    attempt first, so a table too large for the budget does not take every run.
+    """
+
+    def priority(foreign_table: tuple[str, Optional[datetime], bool, int]) -> tuple[bool, bool, bool, int, float]:
+        name, attempted_at, failed, calls = foreign_table
+        return (
+            failed,
+            name not in priority_tables,
+            attempted_at is not None,
+            -calls,
+            attempted_at.timestamp() if attempted_at is not None else 0,
+        )
+
+    return [name for name, _attempted_at, _failed, _calls in sorted(foreign_tables, key=priority)]
+
+
+def list_foreign_tables(cur: cursor, schemas: list[str], priority_tables: list[str]) -> list[str]:
+    cur.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {schema}").format(schema=sql.Identifier(STATISTICS_SCHEMA)))
+    cur.execute(SQL_CREATE_ANALYZE_LOG)
+    cur.execute(SQL_MIGRATE_ANALYZE_LOG)
+
+    cur.execute("SELECT to_regclass('pg_stat_statements')")
+    (statements_view,) = cur.fetchone() or (None,)
+    cur.execute(
+        sql.SQL(SQL_FOREIGN_TABLES).format(
+            calls=sql.SQL(SQL_STATEMENT_CALLS if statements_view else "0"),
+            schema=sql.Identifier(STATISTICS_SCHEMA),
+            join_statements=sql.SQL(SQL_JOIN_STATEMENTS if statements_view else ""),
+        ),
+        (schemas,),
+    )
+    return prioritise_foreign_tables(cur.fetchall(), priority_tables)
+
+
+def analyze_foreign_tables(
+    conn: connection, schemas: list[str], priority_tables: list[str], time_budget: float, statistics_target: int
+) -> dict[str, Any]:
+    """ANALYZE foreign tables in priority order until the time budget is spent.
+
+    BDE samples each table with the servers' analyze_sampling option, and the statistics target sets the size of
+    the sample (300 rows per unit) sent back. Every table is analyzed and recorded in its own transaction, and the
+    statement timeout stops a single large table from overrunning the budget; tables left over are picked up first
+    by a later run, being the longest unanalyzed. A failed attempt is recorded with its outcome after the rollback,
+    so later runs try the other tables first.
+    """
+    start = time.monotonic()
+    with conn.cursor() as cur:
+        cur.execute("SHOW server_version_num")
+        server_version = int(fetch_value(cur))
+        if server_version < MIN_SAMPLING_SERVER_VERSION:
+            raise RuntimeError(
+                f"Refusing to analyze foreign tables on server version {server_version}: before PostgreSQL 16 "
+                "ANALYZE reads whole tables from production BDE"
+            )
+
+        foreign_tables = list_foreign_tables(cur, schemas, priority_tables)
+        conn.commit()
+
+        analyzed: dict[str, float] = {}
+        errors: dict[str, str] = {}
+        for table in foreign_tables:
+            remaining = time_budget - (time.monotonic() - start)
+            if remaining <= 0:
+                break
+
+            table_start = time.monotonic()
+            try:
+                cur.execute("SET LOCAL statement_timeout = %s", (int(remaining * 1000),))
+                cur.execute("SET LOCAL default_statistics_target = %s", (statistics_target,))
+                cur.execute(sql.SQL("ANALYZE {table}").format(table=sql.Identifier(*table.split(".", 1))))
+                duration = round(time.monotonic() - table_start, 3)
+                cur.execute(SQL_RECORD_ANALYZE, (table, duration))
+                conn.commit()
+                analyzed[table] = duration
+            except psycopg2.Error as error:
+                conn.rollback()
+                errors[table] = str(error).strip()
+                outcome = "timed out" if isinstance(error, QueryCanceled) else "failed"
+                cur.execute(SQL_RECORD_FAILED_ANALYZE, (table, outcome))
+                conn.commit()
+
+    return {"analyzed": analyzed, "errors": errors, "remaining": len(foreign_tables) - len(analyzed) - len(errors)}
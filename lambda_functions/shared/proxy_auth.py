@@ -0,0 +1,142 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+from typing import TYPE_CHECKING, Optional
+
+from psycopg2.extensions import cursor
+
+from .clients import rds_client, secretsmanager_client
+
+if TYPE_CHECKING:
+    from mypy_boto3_rds.type_defs import UserAuthConfigTypeDef
+else:
+    UserAuthConfigTypeDef = dict
+
+# RDS Proxy logs in to the database with a password it reads from Secrets Manager, one secret per database user;
+# the proxy's role may only read secrets under this prefix
+PROXY_SECRET_PREFIX = "bde-analytics/proxy/"
+PROXY_PASSWORD_LENGTH = 30
+# Same as the root secret, so passwords need no quoting in a connection string
+PROXY_PASSWORD_EXCLUDE_CHARACTERS = "\"@/\\ '"
+
+# Analyst roles, with a schema of their own name, that still log in to the instance with IAM auth tokens. Roles
+# revoked with NOLOGIN are included, so a re-tagged analyst can log in through the proxy.
+SQL_RDS_IAM_ANALYST_ROLES = """
+    SELECT r.rolname
+    FROM pg_roles r
+    JOIN pg_namespace n ON n.nspname = r.rolname
+    JOIN pg_auth_members m ON m.member = r.oid
+    JOIN pg_roles g ON g.oid = m.roleid
+    WHERE g.rolname = 'rds_iam'
+    ORDER BY r.rolname
+"""
+
+# Analyst roles, with a schema of their own name, that log in through the proxy with a password instead of IAM auth
+SQL_PROXY_ANALYST_ROLES = """
+    SELECT r.rolname
+    FROM pg_roles r
+    JOIN pg_namespace n ON n.nspname = r.rolname
+    WHERE NOT pg_has_role(r.oid, 'rds_iam', 'MEMBER')
+    ORDER BY r.rolname
+"""
+
+# As Postgres computes them for password_encryption = scram-sha-256
+SCRAM_ITERATIONS = 4096
+SCRAM_SALT_BYTES = 16
+
+
+def proxy_secret_name(username: str) -> str:
+    return f"{PROXY_SECRET_PREFIX}{username}"
+
+
+def generate_proxy_password() -> str:
+    return secretsmanager_client().get_random_password(
+        PasswordLength=PROXY_PASSWORD_LENGTH, ExcludeCharacters=PROXY_PASSWORD_EXCLUDE_CHARACTERS
+    )["RandomPassword"]
+
+
+def scram_sha_256_verifier(password: str, salt: Optional[bytes] = None, iterations: int = SCRAM_ITERATIONS) -> str:
+    """Return the SCRAM-SHA-256 verifier Postgres stores for `password`, for CREATE ROLE ... PASSWORD.
+
+    Postgres stores a verifier as it is given, so the password itself never appears in the statement, where
+    pg_stat_statements and statement logging would keep it.
+    """
+    salt = salt if salt is not None else os.urandom(SCRAM_SALT_BYTES)
+    salted_password = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    stored_key = hashlib.sha256(hmac.new(salted_password, b"Client Key", "sha256").digest()).digest()
+    server_key = hmac.new(salted_password, b"Server Key", "sha256").digest()
+
+    def encode(value: bytes) -> str:
+        return base64.b64encode(value).decode()
+
+    return f"SCRAM-SHA-256${iterations}:{encode(salt)}${encode(stored_key)}:{encode(server_key)}"
+
+
+def store_proxy_password(username: str, password: str) -> str:
+    """Save the password of `username`'s database role where the proxy reads it, and return the secret's ARN."""
+    secret_string = json.dumps({"username": username, "password": password})
+    try:
+        return secretsmanager_client().create_secret(
+            Name=proxy_secret_name(username),
+            SecretString=secret_string,
+            Description="Database password RDS Proxy logs in with for a BDE analytics user.",
+            Tags=[{"Key": "BDE_Analytics_User", "Value": "True"}],
+        )["ARN"]
+    except secretsmanager_client().exceptions.ResourceExistsException:
+        return secretsmanager_client().put_secret_value(SecretId=proxy_secret_name(username), SecretString=secret_string)[
+            "ARN"
+        ]
+
+
+def delete_proxy_password(username: str) -> None:
+    # Without a recovery window, so the secret can be created again if the proxy comes back
+    try:
+        secretsmanager_client().delete_secret(SecretId=proxy_secret_name(username), ForceDeleteWithoutRecovery=True)
+    except secretsmanager_client().exceptions.ResourceNotFoundException:
+        pass
+
+
+def list_rds_iam_analyst_roles(cur: cursor) -> list[str]:
+    cur.execute(SQL_RDS_IAM_ANALYST_ROLES)
+    return [rolname for (rolname,) in cur.fetchall()]
+
+
+def list_proxy_analyst_roles(cur: cursor) -> list[str]:
+    cur.execute(SQL_PROXY_ANALYST_ROLES)
+    return [rolname for (rolname,) in cur.fetchall()]
+
+
+def load_declared_proxy_auth(proxy_auth_json: Optional[str]) -> list[UserAuthConfigTypeDef]:
+    # The proxy's authentication list as the stack declares it, e.g. [{"AuthScheme": "SECRETS", "SecretArn": ...}]
+    declared: list[UserAuthConfigTypeDef] = json.loads(proxy_auth_json or "[]")
+    return declared
+
+
+def register_proxy_secrets(proxy_name: str, declared_auth: list[UserAuthConfigTypeDef]) -> list[str]:
+    """Set the proxy's authentication list to the entries the stack declares plus one per analyst secret, and return
+    the ARNs of the analyst secrets that were not in it.
+
+    CloudFormation puts the declared entries back whenever it updates the proxy, so they always come first and are
+    never changed here. Listing all secrets under the prefix, not just new ones, restores the analysts such an update
+    drops, and entries for secrets that no longer exist are dropped.
+    """
+    paginator = secretsmanager_client().get_paginator("list_secrets")
+    declared_arns = {entry.get("SecretArn") for entry in declared_auth}
+    secret_arns = [
+        secret["ARN"]
+        for page in paginator.paginate(Filters=[{"Key": "name", "Values": [PROXY_SECRET_PREFIX]}])
+        for secret in page["SecretList"]
+        if secret["ARN"] not in declared_arns
+    ]
+    auth = declared_auth + [
+        {"AuthScheme": "SECRETS", "SecretArn": secret_arn, "IAMAuth": "REQUIRED"} for secret_arn in secret_arns
+    ]
+
+    (proxy,) = rds_client().describe_db_proxies(DBProxyName=proxy_name)["DBProxies"]
+    registered = [entry.get("SecretArn") for entry in proxy["Auth"]]
+    if sorted(registered, key=str) != sorted((entry.get("SecretArn") for entry in auth), key=str):
+        rds_client().modify_db_proxy(DBProxyName=proxy_name, Auth=auth)
+
+    return [secret_arn for secret_arn in secret_arns if secret_arn not in registered]
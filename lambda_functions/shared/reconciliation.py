@@ -0,0 +1,83 @@
+from dataclasses import asdict, dataclass, field
+from typing import TYPE_CHECKING
+
+from psycopg2.extensions import cursor
+
+from .clients import iam_client
+
+if TYPE_CHECKING:
+    from mypy_boto3_iam.type_defs import TagTypeDef
+else:
+    TagTypeDef = dict
+
+ANALYST_USER_TAG: TagTypeDef = {"Key": "BDE_Analytics_User", "Value": "True"}
+ANALYST_POLICY_PATH = "/bde-analytics-policies/"
+
+# Roles with a schema of their own name, which is what create_rds_user_from_iam leaves behind, plus the roles of the
+# given IAM users whether they have a schema or not. Roles revoked with NOLOGIN are included, so that they are not
+# taken for missing when their IAM user is tagged again.
+SQL_ANALYST_ROLE_SCHEMAS = """
+    SELECT r.rolname, n.oid IS NOT NULL, r.rolcanlogin
+    FROM pg_roles r
+    LEFT JOIN pg_namespace n ON n.nspname = r.rolname
+    WHERE (n.oid IS NOT NULL AND r.rolcanlogin) OR r.rolname = ANY(%s)
+    ORDER BY r.rolname
+"""
+
+
+def analyst_policy_name(username: str) -> str:
+    return f"bde-analytics-iam-policy-{username}"
+
+
+@dataclass(frozen=True)
+class AnalystRole:
+    has_schema: bool
+    can_login: bool
+
+
+@dataclass
+class AnalystDrift:
+    missing_roles: list[str] = field(default_factory=list)
+    missing_schemas: list[str] = field(default_factory=list)
+    missing_policies: list[str] = field(default_factory=list)
+    revoked_roles: list[str] = field(default_factory=list)
+    orphaned_roles: list[str] = field(default_factory=list)
+
+    def report(self) -> dict[str, list[str]]:
+        return asdict(self)
+
+
+def list_analyst_iam_users() -> dict[str, set[str]]:
+    """Return the IAM users tagged as BDE analytics users, with the names of the managed policies attached to each.
+
+    The account authorization details include tags and attached policies, so hundreds of users take a few pages
+    rather than a call per user.
+    """
+    paginator = iam_client().get_paginator("get_account_authorization_details")
+    return {
+        user["UserName"]: {policy["PolicyName"] for policy in user.get("AttachedManagedPolicies", [])}
+        for page in paginator.paginate(Filter=["User"])
+        for user in page["UserDetailList"]
+        if ANALYST_USER_TAG in user.get("Tags", [])
+    }
+
+
+def read_analyst_roles(cur: cursor, usernames: list[str]) -> dict[str, AnalystRole]:
+    cur.execute(SQL_ANALYST_ROLE_SCHEMAS, (usernames,))
+    return {rolname: AnalystRole(has_schema, can_login) for rolname, has_schema, can_login in cur.fetchall()}
+
+
+def diff_analysts(iam_users: dict[str, set[str]], roles: dict[str, AnalystRole]) -> AnalystDrift:
+    # Orphaned roles are analyst roles, i.e. with a schema of their own, whose IAM user is gone or no longer tagged.
+    # Revoked roles are roles without a login whose IAM user is tagged again.
+    return AnalystDrift(
+        missing_roles=sorted(iam_users.keys() - roles.keys()),
+        missing_schemas=sorted(name for name, role in roles.items() if name in iam_users and not role.has_schema),
+        missing_policies=sorted(
+            username for username, policies in iam_users.items() if analyst_policy_name(username) not in policies
+        ),
+        revoked_roles=sorted(name for name, role in roles.items() if name in iam_users and not role.can_login),
+        orphaned_roles=sorted(
+            name for name, role in roles.items() if name not in iam_users and role.has_schema and role.can_login
+        ),
+    )
@@ -0,0 +1,71 @@
+import json
+from dataclasses import dataclass, fields
+from typing import Any, Optional
+
+from psycopg2 import sql
+from psycopg2.extensions import cursor
+
+# Analyst roles are the login roles with a schema of the same name, as create_rds_user_from_iam sets them up;
+# this leaves out the root and provisioning roles. Analysts behind an RDS Proxy are not rds_iam members.
+SQL_ANALYST_ROLES = """
+    SELECT r.rolname
+    FROM pg_roles r
+    JOIN pg_namespace n ON n.nspname = r.rolname
+    WHERE r.rolcanlogin
+    ORDER BY r.rolname
+"""
+
+
+@dataclass(frozen=True)
+class AnalystResourceProfile:
+    # Session settings stored on each analyst role; None resets the setting to the instance default.
+    # These bound what one analyst's query can take from the shared instance and pull from production BDE
+    statement_timeout: Optional[str] = "15min"
+    work_mem: Optional[str] = "64MB"
+    temp_file_limit: Optional[str] = "5GB"
+    idle_in_transaction_session_timeout: Optional[str] = "10min"
+    # -1 means no limit
+    connection_limit: int = 5
+
+    @classmethod
+    def from_config(cls, config: dict[str, Any]) -> "AnalystResourceProfile":
+        return cls(**{key: value for key, value in config.items() if key in {field.name for field in fields(cls)}})
+
+    @property
+    def settings(self) -> dict[str, Optional[str]]:
+        return {
+            "statement_timeout": self.statement_timeout,
+            "work_mem": self.work_mem,
+            "temp_file_limit": self.temp_file_limit,
+            "idle_in_transaction_session_timeout": self.idle_in_transaction_session_timeout,
+        }
+
+
+def load_analyst_resource_profile(analyst_resource_profile_json: Optional[str]) -> AnalystResourceProfile:
+    return AnalystResourceProfile.from_config(json.loads(analyst_resource_profile_json or "{}"))
+
+
+def list_analyst_roles(cur: cursor) -> list[str]:
+    cur.execute(SQL_ANALYST_ROLES)
+    return [rolname for (rolname,) in cur.fetchall()]
+
+
+def apply_resource_profile(cur: cursor, role: str, profile: AnalystResourceProfile) -> None:
+    """Store the profile's limits on `role`; they take effect from the role's next session."""
+    role_identifier = sql.Identifier(role)
+    cur.execute(
+        sql.SQL("ALTER ROLE {role} CONNECTION LIMIT {connection_limit}").format(
+            role=role_identifier, connection_limit=sql.Literal(profile.connection_limit)
+        )
+    )
+    for setting, value in profile.settings.items():
+        if value is None:
+            cur.execute(
+                sql.SQL("ALTER ROLE {role} RESET {setting}").format(role=role_identifier, setting=sql.Identifier(setting))
+            )
+        else:
+            cur.execute(
+                sql.SQL("ALTER ROLE {role} SET {setting} = {value}").format(
+                    role=role_identifier, setting=sql.Identifier(setting), value=sql.Literal(value)
+                )
+            )
@@ -0,0 +1,183 @@
+import re
+from dataclasses import dataclass, replace
+from typing import Optional
+
+import psycopg2
+from aws_lambda_powertools.metrics import MetricUnit, single_metric
+from psycopg2 import sql
+from psycopg2.extensions import connection, cursor
+
+from .foreign_statistics import STATISTICS_SCHEMA
+
+METRICS_NAMESPACE = "BdeFdwRds"
+
+SQL_CREATE_STATEMENT_SNAPSHOT = sql.SQL(
+    "CREATE TABLE IF NOT EXISTS {schema}.statement_snapshot (role name, queryid bigint, calls bigint, "
+    "total_time double precision, rows bigint, temp_bytes bigint, PRIMARY KEY (role, queryid))"
+).format(schema=sql.Identifier(STATISTICS_SCHEMA))
+
+SQL_STATEMENTS = """
+    SELECT r.rolname, s.queryid, min(s.query), sum(s.calls), sum(s.total_exec_time), sum(s.rows),
+           sum(s.temp_blks_written) * current_setting('block_size')::bigint
+    FROM pg_stat_statements s
+    JOIN pg_roles r ON r.oid = s.userid
+    WHERE s.dbid = (SELECT oid FROM pg_database WHERE datname = current_database()) AND s.queryid IS NOT NULL
+    GROUP BY r.rolname, s.queryid
+"""
+
+SQL_FOREIGN_TABLES = """
+    SELECT n.nspname, c.relname
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind = 'f' AND n.nspname = ANY(%s)
+"""
+
+SQL_SNAPSHOT = sql.SQL("SELECT role, queryid, calls, total_time, rows, temp_bytes FROM {schema}.statement_snapshot").format(
+    schema=sql.Identifier(STATISTICS_SCHEMA)
+)
+
+SQL_SAVE_SNAPSHOT = sql.SQL(
+    "INSERT INTO {schema}.statement_snapshot (role, queryid, calls, total_time, rows, temp_bytes) "
+    "SELECT * FROM unnest(%s::name[], %s::bigint[], %s::bigint[], %s::double precision[], %s::bigint[], %s::bigint[])"
+).format(schema=sql.Identifier(STATISTICS_SCHEMA))
+
+
+@dataclass(frozen=True)
+class StatementStats:
+    role: str
+    queryid: int
+    query: str
+    calls: int
+    total_time: float  # milliseconds
+    rows: int
+    temp_bytes: int
+    foreign_scan: bool
+
+    def minus(self, previous: Optional[tuple[int, float, int, int]]) -> "StatementStats":
+        # Counters that went down were reset, or the statement was evicted and came back: count them from zero
+        if previous is None or self.calls < previous[0]:
+            return self
+        calls, total_time, rows, temp_bytes = previous
+        return replace(
+            self,
+            calls=self.calls - calls,
+            total_time=self.total_time - total_time,
+            rows=self.rows - rows,
+            temp_bytes=self.temp_bytes - temp_bytes,
+        )
+
+
+def foreign_table_pattern(foreign_tables: list[tuple[str, str]]) -> Optional[re.Pattern[str]]:
+    """Match schema-qualified references to the foreign tables, e.g. bde.crs_parcel or "bde"."crs_parcel".
+
+    pg_stat_statements keeps no plans, and its normalised text with $n placeholders cannot be EXPLAINed, so
+    statements are matched on their text. Names must be qualified, so local copies such as bde_cache.crs_parcel,
+    analysts' own tables and columns like parcel_id are not mistaken for the foreign tables.
+    """
+    if not foreign_tables:
+        return None
+    names = "|".join(rf'"?{re.escape(schema)}"?\s*\.\s*"?{re.escape(table)}"?' for schema, table in sorted(foreign_tables))
+    return re.compile(rf'(?<![\w$"])(?:{names})(?![\w$"])', re.IGNORECASE)
+
+
+def read_statement_stats(cur: cursor, schemas: list[str]) -> list[StatementStats]:
+    cur.execute(SQL_FOREIGN_TABLES, (schemas,))
+    pattern = foreign_table_pattern(cur.fetchall())
+    cur.execute(SQL_STATEMENTS)
+    return [
+        StatementStats(
+            role, queryid, query, calls, total_time, rows, temp_bytes, pattern is not None and bool(pattern.search(query))
+        )
+        for role, queryid, query, calls, total_time, rows, temp_bytes in cur.fetchall()
+    ]
+
+
+def read_snapshot(cur: cursor) -> dict[tuple[str, int], tuple[int, float, int, int]]:
+    cur.execute(SQL_SNAPSHOT)
+    return {
+        (role, queryid): (calls, total_time, rows, temp_bytes)
+        for role, queryid, calls, total_time, rows, temp_bytes in cur.fetchall()
+    }
+
+
+def save_snapshot(cur: cursor, statements: list[StatementStats]) -> None:
+    cur.execute(sql.SQL("TRUNCATE {schema}.statement_snapshot").format(schema=sql.Identifier(STATISTICS_SCHEMA)))
+    cur.execute(
+        SQL_SAVE_SNAPSHOT,
+        (
+            [statement.role for statement in statements],
+            [statement.queryid for statement in statements],
+            [statement.calls for statement in statements],
+            [statement.total_time for statement in statements],
+            [statement.rows for statement in statements],
+            [statement.temp_bytes for statement in statements],
+        ),
+    )
+
+
+def collect_statement_deltas(conn: connection, schemas: list[str]) -> list[StatementStats]:
+    """Return what each statement did, per role, since the previous collection.
+
+    The cumulative pg_stat_statements counters are read and the snapshot they are diffed against is replaced in
+    one transaction, so overlapping runs cannot count the same calls twice.
+    """
+    with conn.cursor() as cur:
+        try:
+            cur.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {schema}").format(schema=sql.Identifier(STATISTICS_SCHEMA)))
+            cur.execute(SQL_CREATE_STATEMENT_SNAPSHOT)
+            cur.execute(sql.SQL("LOCK TABLE {schema}.statement_snapshot").format(schema=sql.Identifier(STATISTICS_SCHEMA)))
+
+            statements = read_statement_stats(cur, schemas)
+            snapshot = read_snapshot(cur)
+            save_snapshot(cur, statements)
+
+        except psycopg2.Error:
+            conn.rollback()
+            raise
+
+        conn.commit()
+
+    deltas = [statement.minus(snapshot.get((statement.role, statement.queryid))) for statement in statements]
+    return [delta for delta in deltas if delta.calls > 0]
+
+
+def publish_metric(name: str, unit: MetricUnit, value: float, dimensions: dict[str, str], metadata: dict[str, str]) -> None:
+    # Each role and statement needs its own dimensions, which an EMF record can only hold for one metric set
+    with single_metric(name=name, unit=unit, value=value, namespace=METRICS_NAMESPACE) as metric:
+        for dimension, dimension_value in dimensions.items():
+            metric.add_dimension(name=dimension, value=dimension_value)
+        for key, metadata_value in metadata.items():
+            metric.add_metadata(key=key, value=metadata_value)
+
+
+def publish_statement_metrics(deltas: list[StatementStats], top_statements: int) -> dict[str, dict[str, float]]:
+    """Publish calls, total time, temp bytes and the rows returned by foreign scan statements per role, and the same
+    for the `top_statements` foreign scan statements with the most total time, and return the per role totals."""
+    roles: dict[str, dict[str, float]] = {}
+    for delta in deltas:
+        totals = roles.setdefault(
+            delta.role, {"calls": 0, "total_time": 0, "temp_bytes": 0, "foreign_statement_rows_returned": 0}
+        )
+        totals["calls"] += delta.calls
+        totals["total_time"] += delta.total_time
+        totals["temp_bytes"] += delta.temp_bytes
+        totals["foreign_statement_rows_returned"] += delta.rows if delta.foreign_scan else 0
+
+    for role, totals in roles.items():
+        publish_metric("Calls", MetricUnit.Count, totals["calls"], {"Role": role}, {})
+        publish_metric("TotalTime", MetricUnit.Milliseconds, totals["total_time"], {"Role": role}, {})
+        publish_metric("TempBytes", MetricUnit.Bytes, totals["temp_bytes"], {"Role": role}, {})
+        publish_metric(
+            "ForeignStatementRowsReturned", MetricUnit.Count, totals["foreign_statement_rows_returned"], {"Role": role}, {}
+        )
+
+    foreign_scans = sorted((delta for delta in deltas if delta.foreign_scan), key=lambda delta: -delta.total_time)
+    for delta in foreign_scans[:top_statements]:
+        dimensions = {"Role": delta.role, "QueryId": str(delta.queryid)}
+        metadata = {"Query": delta.query}
+        publish_metric("StatementCalls", MetricUnit.Count, delta.calls, dimensions, metadata)
+        publish_metric("StatementTotalTime", MetricUnit.Milliseconds, delta.total_time, dimensions, metadata)
+        publish_metric("StatementTempBytes", MetricUnit.Bytes, delta.temp_bytes, dimensions, metadata)
+        publish_metric("StatementRowsReturned", MetricUnit.Count, delta.rows, dimensions, metadata)
+
+    return roles
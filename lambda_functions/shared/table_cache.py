@@ -0,0 +1,177 @@
+import json
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from psycopg2 import sql
+from psycopg2.extensions import cursor
+
+CACHE_SCHEMA = "bde_cache"
+
+# Keys of changed rows are fetched from production BDE in batches, as `key = ANY(...)` is pushed down to the remote
+REFRESH_BATCH_SIZE = 10000
+
+SQL_CREATE_REFRESH_STATE = sql.SQL(
+    "CREATE TABLE IF NOT EXISTS {schema}.refresh_state "
+    "(table_name text PRIMARY KEY, revision integer NOT NULL, refreshed_at timestamptz NOT NULL DEFAULT now())"
+).format(schema=sql.Identifier(CACHE_SCHEMA))
+
+SQL_LATEST_REVISION = "SELECT max(id) FROM table_version.revision"
+
+SQL_GEOMETRY_COLUMNS = """
+    SELECT column_name FROM information_schema.columns
+    WHERE table_schema = %s AND table_name = %s AND udt_name = 'geometry'
+    ORDER BY ordinal_position
+"""
+
+
+@dataclass(frozen=True)
+class CachedTable:
+    schema: str
+    table: str
+    key: str
+    indexes: tuple[str, ...] = ()
+
+    @classmethod
+    def from_config(cls, config: dict[str, Any]) -> "CachedTable":
+        # e.g. {"table": "bde.crs_parcel", "key": "id", "indexes": ["status"]}
+        schema, table = config["table"].split(".")
+        return cls(schema=schema, table=table, key=config["key"], indexes=tuple(config.get("indexes", [])))
+
+    @property
+    def name(self) -> str:
+        return f"{self.schema}.{self.table}"
+
+    @property
+    def source(self) -> sql.Identifier:
+        return sql.Identifier(self.schema, self.table)
+
+    @property
+    def cache(self) -> sql.Identifier:
+        return sql.Identifier(CACHE_SCHEMA, self.table)
+
+    @property
+    def revision_table(self) -> sql.Identifier:
+        # table_version keeps every revision of a versioned table in table_version.<schema>_<table>_revision
+        return sql.Identifier("table_version", f"{self.schema}_{self.table}_revision")
+
+
+def load_cached_tables(cached_tables_json: Optional[str]) -> list[CachedTable]:
+    cached_tables = [CachedTable.from_config(config) for config in json.loads(cached_tables_json or "[]")]
+
+    # Copies are named after the table alone, so tables with the same name in two schemas would share one copy
+    tables: dict[str, list[str]] = {}
+    for cached_table in cached_tables:
+        tables.setdefault(cached_table.table, []).append(cached_table.name)
+    duplicates = sorted(name for names in tables.values() if len(names) > 1 for name in names)
+    if duplicates:
+        raise ValueError(f"bde_cached_tables has tables with the same name in different schemas: {', '.join(duplicates)}")
+
+    return cached_tables
+
+
+def fetch_value(cur: cursor) -> Any:
+    row = cur.fetchone()
+    if row is None:
+        raise RuntimeError("Expected the query to return a row, but it returned none")
+    return row[0]
+
+
+def latest_revision(cur: cursor) -> int:
+    cur.execute(SQL_LATEST_REVISION)
+    revision: int = fetch_value(cur)
+    return revision
+
+
+def create_cached_table(cur: cursor, cached_table: CachedTable) -> bool:
+    """Copy a foreign table into the cache schema and index it, unless it is cached already.
+
+    The revision is read before the copy, so rows changed while copying are applied again by the next refresh.
+    """
+    cur.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {schema}").format(schema=sql.Identifier(CACHE_SCHEMA)))
+    cur.execute(SQL_CREATE_REFRESH_STATE)
+
+    cur.execute("SELECT to_regclass(%s)", (f"{CACHE_SCHEMA}.{cached_table.table}",))
+    if fetch_value(cur) is not None:
+        return False
+
+    revision = latest_revision(cur)
+    cur.execute(
+        sql.SQL("CREATE TABLE {cache} AS SELECT * FROM {source}").format(cache=cached_table.cache, source=cached_table.source)
+    )
+    cur.execute(
+        sql.SQL("ALTER TABLE {cache} ADD PRIMARY KEY ({key})").format(
+            cache=cached_table.cache, key=sql.Identifier(cached_table.key)
+        )
+    )
+    for column in cached_table.indexes:
+        cur.execute(
+            sql.SQL("CREATE INDEX ON {cache} ({column})").format(cache=cached_table.cache, column=sql.Identifier(column))
+        )
+
+    cur.execute(SQL_GEOMETRY_COLUMNS, (CACHE_SCHEMA, cached_table.table))
+    for (column,) in cur.fetchall():
+        cur.execute(
+            sql.SQL("CREATE INDEX ON {cache} USING gist ({column})").format(
+                cache=cached_table.cache, column=sql.Identifier(column)
+            )
+        )
+
+    cur.execute(sql.SQL("ANALYZE {cache}").format(cache=cached_table.cache))
+    cur.execute(
+        sql.SQL("INSERT INTO {schema}.refresh_state (table_name, revision) VALUES (%s, %s)").format(
+            schema=sql.Identifier(CACHE_SCHEMA)
+        ),
+        (cached_table.name, revision),
+    )
+    return True
+
+
+def refresh_cached_table(cur: cursor, cached_table: CachedTable) -> Optional[dict[str, int]]:
+    """Apply the rows of a cached table that changed upstream since its last refresh.
+
+    Changed keys come from the table_version revision table; only those rows are deleted from the cache and
+    fetched again from production BDE, so rows deleted upstream disappear from the cache as well. Returns None for
+    a table the init script has not copied yet.
+    """
+    cur.execute(
+        sql.SQL("SELECT revision FROM {schema}.refresh_state WHERE table_name = %s FOR UPDATE").format(
+            schema=sql.Identifier(CACHE_SCHEMA)
+        ),
+        (cached_table.name,),
+    )
+    row = cur.fetchone()
+    if row is None:
+        return None
+    refreshed_revision: int = row[0]
+    revision = latest_revision(cur)
+    if revision == refreshed_revision:
+        return {"revision": revision, "changed_rows": 0}
+
+    cur.execute(
+        sql.SQL(
+            "SELECT DISTINCT {key} FROM {revision_table} "
+            "WHERE (_revision_created > %(refreshed)s AND _revision_created <= %(revision)s) "
+            "OR (_revision_expired > %(refreshed)s AND _revision_expired <= %(revision)s)"
+        ).format(key=sql.Identifier(cached_table.key), revision_table=cached_table.revision_table),
+        {"refreshed": refreshed_revision, "revision": revision},
+    )
+    changed_keys = [key for (key,) in cur.fetchall()]
+
+    for start in range(0, len(changed_keys), REFRESH_BATCH_SIZE):
+        batch = changed_keys[start : start + REFRESH_BATCH_SIZE]
+        key = sql.Identifier(cached_table.key)
+        cur.execute(sql.SQL("DELETE FROM {cache} WHERE {key} = ANY(%s)").format(cache=cached_table.cache, key=key), (batch,))
+        cur.execute(
+            sql.SQL("INSERT INTO {cache} SELECT * FROM {source} WHERE {key} = ANY(%s)").format(
+                cache=cached_table.cache, source=cached_table.source, key=key
+            ),
+            (batch,),
+        )
+
+    cur.execute(
+        sql.SQL("UPDATE {schema}.refresh_state SET revision = %s, refreshed_at = now() WHERE table_name = %s").format(
+            schema=sql.Identifier(CACHE_SCHEMA)
+        ),
+        (revision, cached_table.name),
+    )
+    return {"revision": revision, "changed_rows": len(changed_keys)}
@@ -0,0 +1,310 @@
+import json
+import re
+import sys
+from dataclasses import asdict, dataclass, field
+from typing import Any, Optional
+
+import psycopg2
+from typer import Argument, Exit, Option, Typer, echo
+
+app = Typer()
+
+JOIN_NODE_TYPES = ("Hash Join", "Merge Join", "Nested Loop")
+SORT_NODE_TYPES = ("Sort", "Incremental Sort")
+AGGREGATE_NODE_TYPES = ("Aggregate", "WindowAgg")
+
+# Plan node keys holding expressions that were evaluated locally rather than on the remote server
+LOCAL_EXPRESSION_KEYS = ("Filter", "Join Filter", "Hash Cond", "Merge Cond", "Sort Key", "Group Key")
+
+FUNCTION_CALL = re.compile(r"([A-Za-z_][\w]*(?:\.[A-Za-z_][\w]*)?)\(")
+OPERATOR = re.compile(r"(?<=[\s)])([~!@#%^&|`?<>=+\-*/]+)(?=[\s(])")
+NOT_FUNCTIONS = {"ANY", "ALL", "ARRAY", "ROW", "IN", "AND", "OR", "NOT", "CASE", "WHEN", "THEN", "ELSE", "COALESCE"}
+# Schema qualified table names in a Foreign Scan's relations, e.g. "(bde.crs_title t) INNER JOIN (bde.crs_title_estate e)"
+RELATION_NAME = re.compile(r'((?:"[^"]+"|[\w$]+)\.(?:"[^"]+"|[\w$]+))')
+
+SQL_EXPLAIN = "SELECT fdw_pushdown.explain(%s, %s)"
+SQL_FOREIGN_TABLE_SERVERS = """
+    SELECT DISTINCT s.srvname
+    FROM pg_foreign_table ft
+    JOIN pg_foreign_server s ON s.oid = ft.ftserver
+    WHERE ft.ftrelid = ANY(ARRAY(SELECT to_regclass(name) FROM unnest(%s::text[]) AS name))
+    ORDER BY 1
+"""
+SQL_FUNCTION_SHIPPABILITY = (
+    "SELECT function_name, volatility, extension, shippable FROM fdw_pushdown.function_shippability(%s, %s)"
+)
+SQL_OPERATOR_SHIPPABILITY = (
+    "SELECT operator_name, left_type, right_type, volatility, extension, shippable "
+    "FROM fdw_pushdown.operator_shippability(%s, %s)"
+)
+OPERATOR_BLOCKER_PREFIX = "operator "
+
+
+@dataclass
+class ForeignScan:
+    relations: str
+    remote_sql: str
+    pushed_down: list[str]
+    local_filter: Optional[str]
+    rows: float
+    width: int
+    # Without EXPLAIN ANALYZE, rows is the planner's estimate of the rows left after the local filter, which is
+    # fewer than the scan fetches from the remote server when there is one
+    rows_estimated: bool = False
+
+    @property
+    def bytes(self) -> float:
+        return self.rows * self.width
+
+
+@dataclass
+class PushdownReport:
+    foreign_scans: list[ForeignScan] = field(default_factory=list)
+    local_operations: list[str] = field(default_factory=list)
+    blockers: list[str] = field(default_factory=list)
+
+    @property
+    def rows_transferred(self) -> float:
+        return sum(foreign_scan.rows for foreign_scan in self.foreign_scans)
+
+    @property
+    def bytes_transferred(self) -> float:
+        return sum(foreign_scan.bytes for foreign_scan in self.foreign_scans)
+
+    @property
+    def rows_estimated(self) -> bool:
+        return any(foreign_scan.rows_estimated for foreign_scan in self.foreign_scans)
+
+    @property
+    def foreign_tables(self) -> list[str]:
+        names = (RELATION_NAME.findall(foreign_scan.relations) for foreign_scan in self.foreign_scans)
+        return list(dict.fromkeys(name for relation_names in names for name in relation_names))
+
+
+def pushed_down_operations(remote_sql: str) -> list[str]:
+    checks = {
+        "filter": r"\sWHERE\s",
+        "join": r"\sJOIN\s",
+        "aggregate": r"\sGROUP BY\s|^SELECT\s+(count|sum|avg|min|max)\(",
+        "sort": r"\sORDER BY\s",
+        "limit": r"\sLIMIT\s",
+    }
+    return [operation for operation, pattern in checks.items() if re.search(pattern, remote_sql)]
+
+
+def expression_blockers(expression: str) -> list[str]:
+    # Candidates only: whether an operator is shipped depends on its argument types, so operators are checked
+    # against pg_operator before being reported
+    functions = [name for name in FUNCTION_CALL.findall(expression) if name.upper() not in NOT_FUNCTIONS]
+    return functions + [f"{OPERATOR_BLOCKER_PREFIX}{operator}" for operator in OPERATOR.findall(expression)]
+
+
+def foreign_scan_rows(plan: dict[str, Any]) -> tuple[float, bool]:
+    """Return the rows a Foreign Scan node fetched from the remote server, and whether that is an estimate."""
+    if "Actual Rows" not in plan:
+        return plan["Plan Rows"], True
+    # Actual Rows only counts the rows that passed the local filter; both counts are averages per loop
+    return (plan["Actual Rows"] + plan.get("Rows Removed by Filter", 0)) * plan.get("Actual Loops", 1), False
+
+
+def contains_foreign_scan(node: dict[str, Any]) -> bool:
+    return node["Node Type"] == "Foreign Scan" or any(contains_foreign_scan(child) for child in node.get("Plans", []))
+
+
+def analyse_plan(plan: dict[str, Any], report: Optional[PushdownReport] = None) -> PushdownReport:
+    """Walk an EXPLAIN (VERBOSE, FORMAT JSON) plan and split the work on foreign tables into what ran remotely,
+    as shown by each Foreign Scan's Remote SQL, and what ran locally on rows fetched across the link."""
+    report = report or PushdownReport()
+    node_type = plan["Node Type"]
+
+    if node_type == "Foreign Scan":
+        relations = plan.get("Relations") or f"{plan.get('Schema')}.{plan.get('Relation Name')}"
+        rows, rows_estimated = foreign_scan_rows(plan)
+        report.foreign_scans.append(
+            ForeignScan(
+                relations=relations,
+                remote_sql=plan.get("Remote SQL", ""),
+                pushed_down=pushed_down_operations(plan.get("Remote SQL", "")),
+                local_filter=plan.get("Filter"),
+                rows=rows,
+                width=plan["Plan Width"],
+                rows_estimated=rows_estimated,
+            )
+        )
+        if "Filter" in plan:
+            report.local_operations.append(f"filter on {relations}: {plan['Filter']}")
+            report.blockers.extend(expression_blockers(plan["Filter"]))
+
+    elif contains_foreign_scan(plan):
+        local_expressions = [plan[key] for key in LOCAL_EXPRESSION_KEYS if key in plan]
+        if node_type in JOIN_NODE_TYPES:
+            report.local_operations.append(f"{node_type.lower()} join")
+        elif node_type in SORT_NODE_TYPES:
+            report.local_operations.append("sort")
+        elif node_type in AGGREGATE_NODE_TYPES:
+            report.local_operations.append("aggregate")
+        elif node_type == "Limit":
+            report.local_operations.append("limit")
+        elif "Filter" in plan:
+            report.local_operations.append(f"filter: {plan['Filter']}")
+
+        for expression in local_expressions:
+            for text in expression if isinstance(expression, list) else [expression]:
+                report.blockers.extend(expression_blockers(text))
+
+    for child in plan.get("Plans", []):
+        analyse_plan(child, report)
+
+    report.blockers = list(dict.fromkeys(report.blockers))
+    return report
+
+
+def rows_label(rows_estimated: bool) -> str:
+    return "estimated rows out of the scan, after any local filter" if rows_estimated else "rows transferred"
+
+
+def format_report(report: PushdownReport, shippability: dict[str, str]) -> str:
+    lines = []
+    for foreign_scan in report.foreign_scans:
+        pushed_down = ", ".join(foreign_scan.pushed_down) or "nothing"
+        lines.append(f"Foreign scan on {foreign_scan.relations}")
+        lines.append(f"  pushed down: {pushed_down}")
+        lines.append(
+            f"  {rows_label(foreign_scan.rows_estimated)}: {foreign_scan.rows:,.0f} (~{foreign_scan.bytes / 1048576:,.1f} MiB)"
+        )
+        lines.append(f"  remote SQL: {foreign_scan.remote_sql}")
+
+    lines.append("Run locally: " + ("; ".join(report.local_operations) or "nothing"))
+    for blocker in report.blockers:
+        lines.append(f"Not shipped: {blocker}" + (f" ({shippability[blocker]})" if blocker in shippability else ""))
+    lines.append(
+        f"Total {rows_label(report.rows_estimated)}: {report.rows_transferred:,.0f}"
+        f" (~{report.bytes_transferred / 1048576:,.1f} MiB)"
+    )
+    if report.rows_estimated:
+        lines.append("Add --analyze for the rows actually transferred.")
+    return "\n".join(lines)
+
+
+def describe_shippability(rows: list[tuple[str, str, Optional[str], bool]]) -> dict[str, str]:
+    # postgres_fdw only ships immutable functions that are built in or belong to an extension in the server's
+    # extensions option
+    reasons = {}
+    for function_name, volatility, extension, shippable in rows:
+        name = function_name.split("(", 1)[0]
+        if shippable:
+            reason = "shippable on its own; check the argument types and operators around it"
+        elif volatility != "i":
+            reason = "not immutable"
+        elif extension:
+            reason = f"extension {extension} is not listed in the server's extensions option"
+        else:
+            reason = "not built in and not part of an extension"
+        reasons[name] = reason
+        reasons[name.rsplit(".", 1)[-1]] = reason
+    return reasons
+
+
+def describe_operator_shippability(rows: list[tuple[str, str, str, str, Optional[str], bool]]) -> dict[str, str]:
+    """Return why each operator with an overload postgres_fdw cannot ship might be kept local.
+
+    EXPLAIN does not print argument types, so an operator is left out when every overload of it is shippable, as
+    the comparison and pattern operators of built-in types are, and reported with its unshippable overloads otherwise.
+    """
+    unshippable: dict[str, list[str]] = {}
+    for operator_name, left_type, right_type, volatility, extension, shippable in rows:
+        overloads = unshippable.setdefault(f"{OPERATOR_BLOCKER_PREFIX}{operator_name}", [])
+        if shippable:
+            continue
+        if volatility != "i":
+            reason = "not immutable"
+        elif extension:
+            reason = f"extension {extension} is not listed in the server's extensions option"
+        else:
+            reason = "not built in and not part of an extension"
+        overloads.append(f"{left_type} {operator_name} {right_type}: {reason}")
+    return {operator: "; ".join(overloads) for operator, overloads in unshippable.items() if overloads}
+
+
+def merge_shippability(reasons_by_server: dict[str, dict[str, str]]) -> dict[str, str]:
+    # With foreign tables on several servers, each with its own extensions option, a reason names its server
+    if len(reasons_by_server) == 1:
+        return next(iter(reasons_by_server.values()))
+    merged: dict[str, list[str]] = {}
+    for server, reasons in reasons_by_server.items():
+        for blocker, reason in reasons.items():
+            merged.setdefault(blocker, []).append(f"{server}: {reason}")
+    return {blocker: "; ".join(reasons) for blocker, reasons in merged.items()}
+
+
+@app.command()
+def main(
+    query: str = Argument(..., help="Query to analyse, or - to read it from standard input."),
+    dsn: str = Option("", help="libpq connection string; PG* environment variables are used when empty."),
+    analyze: bool = Option(
+        False, help="Run the query with EXPLAIN ANALYZE to report actual rows transferred, instead of estimates."
+    ),
+    json_output: bool = Option(False, "--json", help="Print the report as JSON."),
+) -> None:
+    if query == "-":
+        query = sys.stdin.read()
+
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            try:
+                cur.execute(SQL_EXPLAIN, (query, analyze))
+            except psycopg2.errors.UndefinedFunction:
+                echo("fdw_pushdown.explain() is missing; it is installed by the RDS Init lambda.", err=True)
+                raise Exit(code=1) from None
+
+            (plan,) = cur.fetchone() or (None,)
+            report = analyse_plan(plan)
+
+            operators = [blocker for blocker in report.blockers if blocker.startswith(OPERATOR_BLOCKER_PREFIX)]
+            functions = [blocker for blocker in report.blockers if blocker not in operators]
+
+            # Shippability depends on the extensions option of the server the foreign tables are on
+            servers = []
+            if report.blockers:
+                cur.execute(SQL_FOREIGN_TABLE_SERVERS, (report.foreign_tables,))
+                servers = [server for (server,) in cur.fetchall()]
+
+            function_shippability: dict[str, dict[str, str]] = {}
+            operator_shippability: dict[str, dict[str, str]] = {}
+            for server in servers:
+                if functions:
+                    cur.execute(SQL_FUNCTION_SHIPPABILITY, (functions, server))
+                    function_shippability[server] = describe_shippability(cur.fetchall())
+                if operators:
+                    operator_names = [operator[len(OPERATOR_BLOCKER_PREFIX) :] for operator in operators]
+                    cur.execute(SQL_OPERATOR_SHIPPABILITY, (operator_names, server))
+                    operator_shippability[server] = describe_operator_shippability(cur.fetchall())
+
+            shippability = {**merge_shippability(function_shippability), **merge_shippability(operator_shippability)}
+            report.blockers = [blocker for blocker in report.blockers if blocker not in operators or blocker in shippability]
+
+        conn.rollback()
+
+    finally:
+        conn.close()
+
+    if json_output:
+        echo(
+            json.dumps(
+                {
+                    **asdict(report),
+                    "shippability": shippability,
+                    "rows_transferred": report.rows_transferred,
+                    "rows_estimated": report.rows_estimated,
+                    "bytes_transferred": report.bytes_transferred,
+                },
+                indent=2,
+            )
+        )
+    else:
+        echo(format_report(report, shippability))
+
+
+if __name__ == "__main__":
+    app()
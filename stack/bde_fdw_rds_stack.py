@@ -1,18 +1,25 @@
+import json
+from typing import Any, Optional, cast
+
 from aws_cdk import (
     Duration,
     RemovalPolicy,
     Stack,
     aws_ec2,
+    aws_events,
+    aws_events_targets,
     aws_iam,
     aws_lambda,
     aws_rds,
+    aws_s3,
     aws_secretsmanager,
     custom_resources,
     triggers,
 )
 from constructs import Construct
 
-from stack.lambda_bundling import lambda_pip_install_requirements, zip_lambda_assets
+from stack.lambda_bundling import bundle_lambda_functions
+from stack.parameter_group import create_parameter_group
 
 
 class Application(Stack):
@@ -28,10 +35,32 @@ class Application(Stack):
         bde_analytics_user_secret: str,
         bde_rds_security_group: str,
         bastion_host_security_group: str,
+        bde_foreign_schemas: list[str],
+        fdw_tuning: Optional[dict[str, Any]] = None,
+        bde_replicas: Optional[dict[str, str]] = None,
+        bde_schema_servers: Optional[dict[str, str]] = None,
+        rds_fdw_engine_version: str = "15",
+        rds_fdw_parameters: Optional[dict[str, str]] = None,
+        slim_lambda_packages: bool = False,
+        provisioning_iam_auth_user: Optional[str] = None,
+        analyst_resource_profile: Optional[dict[str, Any]] = None,
+        rds_proxy: Optional[dict[str, Any]] = None,
+        bde_cached_tables: Optional[list[dict[str, Any]]] = None,
+        table_cache_refresh_minutes: int = 15,
+        analyze_priority_tables: Optional[list[str]] = None,
+        analyze_schedule_minutes: int = 60,
+        statement_telemetry_minutes: int = 15,
+        export_queries: Optional[dict[str, str]] = None,
+        export_retention_days: int = 7,
         **kwargs,
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        # Bundle every function under lambda_functions/ up front, in parallel. Slim packages leave out what the
+        # Lambda runtime already provides (boto3, botocore, ...) to cut package size and cold start import time.
+        lambda_bundles = bundle_lambda_functions(slim=slim_lambda_packages)
+        self.lambda_bundles = list(lambda_bundles.values())
+
         # ----- Networking -----
 
         vpc = aws_ec2.Vpc.from_lookup(self, "BDEHostVPC", vpc_id=vpc_id)
@@ -71,18 +100,34 @@ class Application(Stack):
             self, "Bastion Host Security Group", bastion_host_security_group
         )
 
+        postgres_fdw_rds_instance_type = aws_ec2.InstanceType.of(
+            getattr(aws_ec2.InstanceClass, rds_fdw_instance_type["class"]),
+            getattr(aws_ec2.InstanceSize, rds_fdw_instance_type["size"]),
+        )
+        # A parameter group needs the engine's major version to know its parameter family
+        postgres_fdw_rds_engine = aws_rds.DatabaseInstanceEngine.postgres(
+            version=aws_rds.PostgresEngineVersion.of(rds_fdw_engine_version, rds_fdw_engine_version.split(".")[0])
+        )
+
+        # Memory and parallelism sized to the instance type, with overrides from rds_fdw_parameters in cdk.json
+        postgres_fdw_rds_parameter_group = create_parameter_group(
+            self,
+            "PostgresRDS_with_FDW_Parameter_Group",
+            postgres_fdw_rds_engine,
+            postgres_fdw_rds_instance_type.to_string(),
+            rds_fdw_parameters,
+        )
+
         # Create postgres rds instance with fdw
         postgres_fdw_rds_instance = aws_rds.DatabaseInstance(
             self,
             "PostgresRDS_with_FDW_for_BDE_query",
             database_name=postgres_fdw_rds_db_name,
-            instance_type=aws_ec2.InstanceType.of(
-                getattr(aws_ec2.InstanceClass, rds_fdw_instance_type["class"]),
-                getattr(aws_ec2.InstanceSize, rds_fdw_instance_type["size"]),
-            ),
+            instance_type=postgres_fdw_rds_instance_type,
             allocated_storage=100,
             max_allocated_storage=300,
-            engine=aws_rds.DatabaseInstanceEngine.POSTGRES,
+            engine=postgres_fdw_rds_engine,
+            parameter_group=postgres_fdw_rds_parameter_group,
             credentials=aws_rds.Credentials.from_secret(postgres_fdw_rds_root_cred_secret, "postgres"),
             vpc=vpc,
             vpc_subnets=vpc_subnets,
@@ -122,12 +167,6 @@ class Application(Stack):
 
         # ----- Run rds init script from lambda -----
 
-        lambda_ref = "rds_init_script"
-        lambda_working_dir = f"lambda_functions/.out/{lambda_ref}"
-
-        lambda_pip_install_requirements(f"{lambda_working_dir}/packages", f"lambda_functions/{lambda_ref}/requirements.txt")
-        lambda_assets = zip_lambda_assets(lambda_working_dir, lambda_ref)
-
         lambda_rds_init = triggers.TriggerFunction(
             self,
             "RDS Init",
@@ -136,13 +175,19 @@ class Application(Stack):
             runtime=aws_lambda.Runtime.PYTHON_3_9,
             handler="lambda-handler.handler",
             timeout=Duration.minutes(10),  # Might take some time to connect to rds
-            code=aws_lambda.Code.from_asset(lambda_assets),
+            code=aws_lambda.Code.from_asset(lambda_bundles["rds_init_script"].assets),
             environment={
                 "BDE_HOST_NAME": bde_host_name,
                 "BDE_ANALYTICS_USER_SECRET": production_bde_rds_ro_user_cred.secret_name,
+                "BDE_FOREIGN_SCHEMAS": ",".join(bde_foreign_schemas),
+                **({"BDE_REPLICA_HOSTS": json.dumps(bde_replicas)} if bde_replicas else {}),
+                **({"BDE_SCHEMA_SERVERS": json.dumps(bde_schema_servers)} if bde_schema_servers else {}),
+                **({"FDW_TUNING": json.dumps(fdw_tuning)} if fdw_tuning else {}),
                 "RDS_FDW_HOST": postgres_fdw_rds_instance.db_instance_endpoint_address,
                 "RDS_FDW_DB": postgres_fdw_rds_db_name,
                 "RDS_FDW_ROOT": postgres_fdw_rds_root_cred_secret.secret_name,
+                **({"RDS_FDW_PROVISIONER": provisioning_iam_auth_user} if provisioning_iam_auth_user else {}),
+                **({"BDE_CACHED_TABLES": json.dumps(bde_cached_tables)} if bde_cached_tables else {}),
             },
         )
 
@@ -153,18 +198,217 @@ class Application(Stack):
 
         postgres_fdw_rds_instance.connections.allow_from(lambda_rds_init, port_range=aws_ec2.Port.tcp(5432))
 
-        # ----- Lambda to create IAM user with rds access -----
+        # ----- Scheduled refresh of locally cached BDE tables -----
+
+        if bde_cached_tables:
+            lambda_refresh_table_cache = aws_lambda.Function(
+                self,
+                "Refresh Table Cache",
+                vpc=vpc,
+                vpc_subnets=vpc_subnets,
+                runtime=aws_lambda.Runtime.PYTHON_3_9,
+                handler="lambda-handler.handler",
+                timeout=Duration.minutes(10),
+                code=aws_lambda.Code.from_asset(lambda_bundles["refresh_table_cache"].assets),
+                environment={
+                    "RDS_FDW_HOST": postgres_fdw_rds_instance.db_instance_endpoint_address,
+                    "RDS_FDW_DB": postgres_fdw_rds_db_name,
+                    "RDS_FDW_ROOT": postgres_fdw_rds_root_cred_secret.secret_name,
+                    "BDE_CACHED_TABLES": json.dumps(bde_cached_tables),
+                },
+            )
+
+            postgres_fdw_rds_root_cred_secret.grant_read(lambda_refresh_table_cache.role)  # type: ignore[arg-type]
+            postgres_fdw_rds_instance.connections.allow_from(lambda_refresh_table_cache, port_range=aws_ec2.Port.tcp(5432))
+
+            aws_events.Rule(
+                self,
+                "Refresh Table Cache Schedule",
+                schedule=aws_events.Schedule.rate(Duration.minutes(table_cache_refresh_minutes)),
+                targets=[aws_events_targets.LambdaFunction(lambda_refresh_table_cache)],
+            )
+
+        # ----- Scheduled ANALYZE of foreign tables -----
+
+        lambda_analyze_foreign_tables = aws_lambda.Function(
+            self,
+            "Analyze Foreign Tables",
+            vpc=vpc,
+            vpc_subnets=vpc_subnets,
+            runtime=aws_lambda.Runtime.PYTHON_3_9,
+            handler="lambda-handler.handler",
+            timeout=Duration.minutes(15),  # The handler stops starting new tables after ANALYZE_TIME_BUDGET_SECONDS
+            code=aws_lambda.Code.from_asset(lambda_bundles["analyze_foreign_tables"].assets),
+            environment={
+                "RDS_FDW_HOST": postgres_fdw_rds_instance.db_instance_endpoint_address,
+                "RDS_FDW_DB": postgres_fdw_rds_db_name,
+                "RDS_FDW_ROOT": postgres_fdw_rds_root_cred_secret.secret_name,
+                "BDE_FOREIGN_SCHEMAS": ",".join(bde_foreign_schemas),
+                "ANALYZE_PRIORITY_TABLES": ",".join(analyze_priority_tables or []),
+                "ANALYZE_TIME_BUDGET_SECONDS": "720",
+            },
+        )
+
+        postgres_fdw_rds_root_cred_secret.grant_read(lambda_analyze_foreign_tables.role)  # type: ignore[arg-type]
+        postgres_fdw_rds_instance.connections.allow_from(lambda_analyze_foreign_tables, port_range=aws_ec2.Port.tcp(5432))
+
+        aws_events.Rule(
+            self,
+            "Analyze Foreign Tables Schedule",
+            schedule=aws_events.Schedule.rate(Duration.minutes(analyze_schedule_minutes)),
+            targets=[aws_events_targets.LambdaFunction(lambda_analyze_foreign_tables)],
+        )
+
+        lambda_collect_statement_telemetry = aws_lambda.Function(
+            self,
+            "Collect Statement Telemetry",
+            vpc=vpc,
+            vpc_subnets=vpc_subnets,
+            runtime=aws_lambda.Runtime.PYTHON_3_9,
+            handler="lambda-handler.handler",
+            timeout=Duration.minutes(5),
+            code=aws_lambda.Code.from_asset(lambda_bundles["collect_statement_telemetry"].assets),
+            environment={
+                "RDS_FDW_HOST": postgres_fdw_rds_instance.db_instance_endpoint_address,
+                "RDS_FDW_DB": postgres_fdw_rds_db_name,
+                "RDS_FDW_ROOT": postgres_fdw_rds_root_cred_secret.secret_name,
+                "BDE_FOREIGN_SCHEMAS": ",".join(bde_foreign_schemas),
+            },
+        )
 
-        lambda_ref = "create_rds_iam_user"
-        lambda_working_dir = f"lambda_functions/.out/{lambda_ref}"
+        postgres_fdw_rds_root_cred_secret.grant_read(lambda_collect_statement_telemetry.role)  # type: ignore[arg-type]
+        postgres_fdw_rds_instance.connections.allow_from(lambda_collect_statement_telemetry, port_range=aws_ec2.Port.tcp(5432))
+
+        aws_events.Rule(
+            self,
+            "Collect Statement Telemetry Schedule",
+            schedule=aws_events.Schedule.rate(Duration.minutes(statement_telemetry_minutes)),
+            targets=[aws_events_targets.LambdaFunction(lambda_collect_statement_telemetry)],
+        )
 
-        lambda_pip_install_requirements(f"{lambda_working_dir}/packages", f"lambda_functions/{lambda_ref}/requirements.txt")
-        lambda_assets = zip_lambda_assets(lambda_working_dir, lambda_ref)
+        # ----- Optional bulk export of named queries to S3 -----
+
+        # Large extracts go to S3 as gzipped CSV instead of through analysts' SQL clients over the VPN
+        if export_queries:
+            export_bucket = aws_s3.Bucket(
+                self,
+                "Export Bucket",
+                block_public_access=aws_s3.BlockPublicAccess.BLOCK_ALL,
+                encryption=aws_s3.BucketEncryption.S3_MANAGED,
+                enforce_ssl=True,
+                lifecycle_rules=[
+                    aws_s3.LifecycleRule(
+                        expiration=Duration.days(export_retention_days),
+                        abort_incomplete_multipart_upload_after=Duration.days(1),
+                    )
+                ],
+            )
+
+            lambda_export_query = aws_lambda.Function(
+                self,
+                "Export Query",
+                vpc=vpc,
+                vpc_subnets=vpc_subnets,
+                runtime=aws_lambda.Runtime.PYTHON_3_9,
+                handler="lambda-handler.handler",
+                timeout=Duration.minutes(15),
+                # Lambda CPU scales with memory, and compression is CPU bound
+                memory_size=1024,
+                code=aws_lambda.Code.from_asset(lambda_bundles["export_query"].assets),
+                environment={
+                    "RDS_FDW_HOST": postgres_fdw_rds_instance.db_instance_endpoint_address,
+                    "RDS_FDW_DB": postgres_fdw_rds_db_name,
+                    "RDS_FDW_ROOT": postgres_fdw_rds_root_cred_secret.secret_name,
+                    "EXPORT_BUCKET": export_bucket.bucket_name,
+                    "EXPORT_QUERIES": json.dumps(export_queries),
+                },
+            )
+
+            postgres_fdw_rds_root_cred_secret.grant_read(lambda_export_query.role)  # type: ignore[arg-type]
+            # Read access lets the presigned download URLs in the lambda's report work
+            export_bucket.grant_read_write(lambda_export_query)
+            postgres_fdw_rds_instance.connections.allow_from(lambda_export_query, port_range=aws_ec2.Port.tcp(5432))
+
+        # ----- Optional RDS Proxy in front of the instance for analyst sessions -----
+
+        # Pools connections from short lived BI tool sessions, so each does not start a new backend, and with it a
+        # new postgres_fdw connection to production BDE. Analysts authenticate to the proxy with IAM auth tokens;
+        # the proxy logs in to the instance with passwords it reads from the bde-analytics/proxy/ secrets.
+        postgres_fdw_rds_proxy = None
+        if rds_proxy is not None:
+            postgres_fdw_rds_proxy_role = aws_iam.Role(
+                self, "Analyst Proxy Role", assumed_by=aws_iam.ServicePrincipal("rds.amazonaws.com")
+            )
+            postgres_fdw_rds_proxy_role.add_to_policy(
+                aws_iam.PolicyStatement(
+                    effect=aws_iam.Effect.ALLOW,
+                    actions=["secretsmanager:GetSecretValue"],
+                    resources=[f"arn:aws:secretsmanager:{self.region}:{aws_account}:secret:bde-analytics/proxy/*"],
+                )
+            )
+
+            postgres_fdw_rds_proxy = postgres_fdw_rds_instance.add_proxy(
+                "Analyst Proxy",
+                secrets=[postgres_fdw_rds_root_cred_secret],
+                vpc=vpc,
+                vpc_subnets=vpc_subnets,
+                security_groups=[bde_rds_security_group_by_id, bastion_host_security_group_by_id],
+                role=postgres_fdw_rds_proxy_role,
+                iam_auth=True,
+                require_tls=True,
+                max_connections_percent=rds_proxy.get("max_connections_percent", 80),
+                max_idle_connections_percent=rds_proxy.get("max_idle_connections_percent", 20),
+                idle_client_timeout=Duration.minutes(rds_proxy.get("idle_client_timeout_minutes", 30)),
+                borrow_timeout=Duration.seconds(rds_proxy.get("borrow_timeout_seconds", 120)),
+            )
+            postgres_fdw_rds_instance.connections.allow_from(postgres_fdw_rds_proxy, port_range=aws_ec2.Port.tcp(5432))
+
+            # The authentication list CloudFormation sets on the proxy; the lambda keeps these entries when it adds
+            # the analysts' secrets, so a deployment and the lambda do not undo each other
+            postgres_fdw_rds_proxy_auth = [
+                {
+                    key: value
+                    for key, value in (
+                        ("AuthScheme", auth.auth_scheme),
+                        ("IAMAuth", auth.iam_auth),
+                        ("SecretArn", auth.secret_arn),
+                        ("ClientPasswordAuthType", auth.client_password_auth_type),
+                        ("Description", auth.description),
+                    )
+                    if value is not None
+                }
+                for auth in cast(
+                    list[aws_rds.CfnDBProxy.AuthFormatProperty],
+                    cast(aws_rds.CfnDBProxy, postgres_fdw_rds_proxy.node.default_child).auth,
+                )
+            ]
+
+        # ----- Lambda to create IAM user with rds access -----
 
         lambda_create_iam_user_role = aws_iam.Role(
             self, "Create IAM User Role", assumed_by=aws_iam.ServicePrincipal("lambda.amazonaws.com")
         )
 
+        lambda_create_iam_user_environment = {
+            "RDS_FDW_HOST": postgres_fdw_rds_instance.db_instance_endpoint_address,
+            "RDS_FDW_DB": postgres_fdw_rds_db_name,
+            "RDS_FDW_ROOT": postgres_fdw_rds_root_cred_secret.secret_name,
+            "RDS_FDW_RESOURCE_ID": postgres_fdw_rds_resource_id.get_response_field("DBInstances.0.DbiResourceId"),
+            # When set, the lambda logs in as this role with an IAM auth token instead of the root secret
+            **({"RDS_FDW_IAM_AUTH_USER": provisioning_iam_auth_user} if provisioning_iam_auth_user else {}),
+            **({"ANALYST_RESOURCE_PROFILE": json.dumps(analyst_resource_profile)} if analyst_resource_profile else {}),
+            **(
+                {
+                    "RDS_FDW_PROXY_NAME": postgres_fdw_rds_proxy.db_proxy_name,
+                    "RDS_FDW_PROXY_ARN": postgres_fdw_rds_proxy.db_proxy_arn,
+                    "RDS_FDW_PROXY_ENDPOINT": postgres_fdw_rds_proxy.endpoint,
+                    "RDS_FDW_PROXY_AUTH": self.to_json_string(postgres_fdw_rds_proxy_auth),
+                }
+                if postgres_fdw_rds_proxy
+                else {}
+            ),
+        }
+
         lambda_create_iam_user = aws_lambda.Function(
             self,
             "Create RDS User",
@@ -173,18 +417,13 @@ class Application(Stack):
             runtime=aws_lambda.Runtime.PYTHON_3_9,
             handler="lambda-handler.handler",
             timeout=Duration.minutes(10),  # Might take some time to connect to rds
-            code=aws_lambda.Code.from_asset(lambda_assets),
+            code=aws_lambda.Code.from_asset(lambda_bundles["create_rds_iam_user"].assets),
             role=lambda_create_iam_user_role,
-            environment={
-                "RDS_FDW_HOST": postgres_fdw_rds_instance.db_instance_endpoint_address,
-                "RDS_FDW_DB": postgres_fdw_rds_db_name,
-                "RDS_FDW_ROOT": postgres_fdw_rds_root_cred_secret.secret_name,
-                "RDS_FDW_RESOURCE_ID": postgres_fdw_rds_resource_id.get_response_field("DBInstances.0.DbiResourceId"),
-            },
+            environment=lambda_create_iam_user_environment,
         )
 
         postgres_fdw_rds_root_cred_secret.grant_read(lambda_create_iam_user_role)
-        postgres_fdw_rds_instance.grant_connect(lambda_create_iam_user)
+        postgres_fdw_rds_instance.grant_connect(lambda_create_iam_user, provisioning_iam_auth_user)
         postgres_fdw_rds_instance.connections.allow_from(lambda_create_iam_user, port_range=aws_ec2.Port.tcp(5432))
 
         # https://docs.aws.amazon.com/lambda/latest/dg/configuration-vpc.html
@@ -197,21 +436,116 @@ class Application(Stack):
                 managed_policy_arn="arn:aws:iam::aws:policy/service-role/AWSLambdaVPCAccessExecutionRole",
             )
         )
-        lambda_create_iam_user_role.attach_inline_policy(
-            aws_iam.Policy(
+        lambda_create_iam_user_policy = aws_iam.Policy(
+            self,
+            "Get and Add IAM User Policy",
+            statements=[
+                aws_iam.PolicyStatement(  # Broad iam resource needed since lambda needs to query all iam users.
+                    effect=aws_iam.Effect.ALLOW,
+                    actions=["iam:GetUser", "iam:CreateUser", "iam:TagUser"],
+                    resources=[f"arn:aws:iam::{aws_account}:user/*"],
+                ),
+                aws_iam.PolicyStatement(
+                    effect=aws_iam.Effect.ALLOW,
+                    actions=["iam:CreatePolicy", "iam:AttachUserPolicy"],
+                    resources=[f"arn:aws:iam::{aws_account}:*"],
+                ),
+                aws_iam.PolicyStatement(  # Lists every user with tags and policies, for {"action": "reconcile"}
+                    effect=aws_iam.Effect.ALLOW,
+                    actions=["iam:GetAccountAuthorizationDetails"],
+                    resources=["*"],
+                ),
+            ],
+        )
+        lambda_create_iam_user_role.attach_inline_policy(lambda_create_iam_user_policy)
+
+        if postgres_fdw_rds_proxy:
+            lambda_register_proxy_logins_policy = aws_iam.Policy(
                 self,
-                "Get and Add IAM User Policy",
+                "Register Analyst Proxy Logins Policy",
                 statements=[
-                    aws_iam.PolicyStatement(  # Broad iam resource needed since lambda needs to query all iam users.
+                    aws_iam.PolicyStatement(
+                        effect=aws_iam.Effect.ALLOW,
+                        actions=[
+                            "secretsmanager:CreateSecret",
+                            "secretsmanager:PutSecretValue",
+                            "secretsmanager:TagResource",
+                        ],
+                        resources=[f"arn:aws:secretsmanager:{self.region}:{aws_account}:secret:bde-analytics/proxy/*"],
+                    ),
+                    aws_iam.PolicyStatement(  # Neither action can be limited to a resource
                         effect=aws_iam.Effect.ALLOW,
-                        actions=["iam:GetUser", "iam:CreateUser", "iam:TagUser"],
-                        resources=[f"arn:aws:iam::{aws_account}:user/*"],
+                        actions=["secretsmanager:GetRandomPassword", "secretsmanager:ListSecrets"],
+                        resources=["*"],
                     ),
                     aws_iam.PolicyStatement(
                         effect=aws_iam.Effect.ALLOW,
-                        actions=["iam:CreatePolicy", "iam:AttachUserPolicy"],
-                        resources=[f"arn:aws:iam::{aws_account}:*"],
+                        actions=["rds:DescribeDBProxies", "rds:ModifyDBProxy"],
+                        resources=[postgres_fdw_rds_proxy.db_proxy_arn],
+                    ),
+                    aws_iam.PolicyStatement(  # Allows the proxy in the policies of analysts created before it
+                        effect=aws_iam.Effect.ALLOW,
+                        actions=["iam:ListPolicyVersions", "iam:CreatePolicyVersion", "iam:DeletePolicyVersion"],
+                        resources=[f"arn:aws:iam::{aws_account}:policy/bde-analytics-policies/*"],
                     ),
                 ],
             )
-        )
+            lambda_create_iam_user_role.attach_inline_policy(lambda_register_proxy_logins_policy)
+
+            # Moves analysts created before the proxy to it, and adds every analyst back to the proxy's authentication
+            # list, which a deployment that changes the proxy resets. The proxy settings are in the environment so
+            # that such a deployment runs the trigger again.
+            lambda_register_proxy_logins = triggers.TriggerFunction(
+                self,
+                "Register Analyst Proxy Logins",
+                vpc=vpc,
+                vpc_subnets=vpc_subnets,
+                runtime=aws_lambda.Runtime.PYTHON_3_9,
+                handler="lambda-handler.register_proxy_logins_handler",
+                timeout=Duration.minutes(10),
+                code=aws_lambda.Code.from_asset(lambda_bundles["create_rds_iam_user"].assets),
+                role=lambda_create_iam_user_role,
+                environment={**lambda_create_iam_user_environment, "RDS_PROXY": json.dumps(rds_proxy)},
+                execute_after=[
+                    postgres_fdw_rds_proxy,
+                    lambda_rds_init,
+                    lambda_create_iam_user_policy,
+                    lambda_register_proxy_logins_policy,
+                ],
+            )
+            postgres_fdw_rds_instance.connections.allow_from(lambda_register_proxy_logins, port_range=aws_ec2.Port.tcp(5432))
+        else:
+            lambda_restore_iam_logins_policy = aws_iam.Policy(
+                self,
+                "Restore Analyst IAM Logins Policy",
+                statements=[
+                    aws_iam.PolicyStatement(  # Removes the passwords the proxy logged in with
+                        effect=aws_iam.Effect.ALLOW,
+                        actions=["secretsmanager:DeleteSecret"],
+                        resources=[f"arn:aws:secretsmanager:{self.region}:{aws_account}:secret:bde-analytics/proxy/*"],
+                    ),
+                    aws_iam.PolicyStatement(  # Takes the proxy out of the policies of analysts moved back
+                        effect=aws_iam.Effect.ALLOW,
+                        actions=["iam:ListPolicyVersions", "iam:CreatePolicyVersion", "iam:DeletePolicyVersion"],
+                        resources=[f"arn:aws:iam::{aws_account}:policy/bde-analytics-policies/*"],
+                    ),
+                ],
+            )
+            lambda_create_iam_user_role.attach_inline_policy(lambda_restore_iam_logins_policy)
+
+            # Gives analysts moved to a proxy, since removed from cdk.json, IAM auth on the instance back. Does nothing
+            # when no analyst is on a proxy password.
+            lambda_restore_iam_logins = triggers.TriggerFunction(
+                self,
+                "Restore Analyst IAM Logins",
+                vpc=vpc,
+                vpc_subnets=vpc_subnets,
+                runtime=aws_lambda.Runtime.PYTHON_3_9,
+                handler="lambda-handler.restore_iam_logins_handler",
+                timeout=Duration.minutes(10),
+                code=aws_lambda.Code.from_asset(lambda_bundles["create_rds_iam_user"].assets),
+                role=lambda_create_iam_user_role,
+                environment=lambda_create_iam_user_environment,
+                execute_after=[lambda_rds_init, lambda_create_iam_user_policy, lambda_restore_iam_logins_policy],
+            )
+            postgres_fdw_rds_instance.connections.allow_from(lambda_restore_iam_logins, port_range=aws_ec2.Port.tcp(5432))
@@ -1,10 +1,89 @@
+import ast
+import hashlib
+import json
 import os
+import re
+import shutil
+import stat
+import sys
+import sysconfig
+import time
 import zipfile
-from subprocess import check_call
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from subprocess import check_call, check_output
 from sys import executable
+from typing import Optional
 
+LAMBDA_FUNCTIONS_DIR = "lambda_functions"
+LAMBDA_BUILD_DIR = f"{LAMBDA_FUNCTIONS_DIR}/.out"
+LAMBDA_HANDLER_FILE = "lambda-handler.py"
+# Code shared by every function, bundled as the top level "shared" package
+LAMBDA_SHARED_DIR = "shared"
+LAMBDA_RUNTIME_PYTHON_VERSION = "3.9"
 
-def lambda_pip_install_requirements(lambda_packaging_out_dir: str, requirements_file: str) -> None:
+# Distributions already provided by the Lambda Python runtime, dropped from slim packages
+# https://docs.aws.amazon.com/lambda/latest/dg/lambda-python.html
+RUNTIME_PROVIDED_DISTRIBUTIONS = frozenset(
+    {"boto3", "botocore", "jmespath", "python-dateutil", "s3transfer", "six", "urllib3"}
+)
+
+# Top level modules of those distributions, which the Lambda runtime makes importable alongside the bundle
+RUNTIME_PROVIDED_MODULES = frozenset({"boto3", "botocore", "dateutil", "jmespath", "s3transfer", "six", "urllib3"})
+
+# Measures how long the handler's imports take in a fresh interpreter, as on a cold start, and records the modules
+# that fail to import, e.g. because a dependency was dropped from a slim package. The interpreter's own site-packages
+# stand in for the runtime, but only for the modules the runtime provides.
+IMPORT_TIME_SCRIPT = """
+import importlib, importlib.machinery, json, site, sys, time
+modules, runtime_modules = json.loads(sys.argv[1]), frozenset(json.loads(sys.argv[2]))
+runtime_paths = site.getsitepackages()
+
+class RuntimeProvidedFinder:
+    @staticmethod
+    def find_spec(name, path=None, target=None):
+        if path is None and name in runtime_modules:
+            return importlib.machinery.PathFinder.find_spec(name, runtime_paths)
+        return None
+
+sys.meta_path.append(RuntimeProvidedFinder)
+import_errors = {}
+start = time.perf_counter()
+for module in modules:
+    try:
+        importlib.import_module(module)
+    except Exception as error:
+        import_errors[module] = f"{type(error).__name__}: {error}"
+print(json.dumps({"import_time": time.perf_counter() - start, "import_errors": import_errors}))
+"""
+
+# Fixed entry metadata so identical inputs always produce an identical zip, and therefore an identical asset hash
+ZIP_ENTRY_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+ZIP_ENTRY_FILE_MODE = 0o644
+ZIP_ENTRY_EXECUTABLE_MODE = 0o755
+ZIP_CREATE_SYSTEM_UNIX = 3
+ZIP_COMPRESS_LEVEL = 9
+
+# Changing how bundles are built, e.g. the zip layout or what is stripped from slim packages, invalidates every
+# cached bundle
+with open(__file__, "rb") as bundling_code:
+    BUNDLING_CODE_HASH = hashlib.sha256(bundling_code.read()).hexdigest()
+
+
+@dataclass(frozen=True)
+class LambdaBundle:
+    lambda_directory: str
+    assets: str
+    cache_hit: bool
+    duration: float
+    size: int
+    import_time: float
+    # Module name to the error importing it raised
+    import_errors: dict[str, str]
+
+
+def lambda_pip_install_requirements(lambda_packaging_out_dir: str, requirements_file: str, slim: bool = False) -> None:
     # Documentation recommend against calling pip internal api; rather, via command line
     # https://pip.pypa.io/en/latest/user_guide/#using-pip-from-your-program
 
@@ -16,27 +95,251 @@ def lambda_pip_install_requirements(lambda_packaging_out_dir: str, requirements_
             "install",
             "--quiet",
             "--disable-pip-version-check",
-            "--force-reinstall",
+            "--no-compile",
+            # Requirements files are fully pinned exports, so this only stops dropped distributions coming back
+            *(["--no-deps"] if slim else []),
             f"--target={lambda_packaging_out_dir}",
             f"--requirement={requirements_file}",
         ]
     )
 
 
-def zip_directory(directory: str, zipfile_handle: zipfile.ZipFile) -> None:
-    for path, _directories, files in os.walk(directory):
+def requirement_name(requirement: str) -> str:
+    match = re.match(r"\s*([A-Za-z0-9][A-Za-z0-9._-]*)", requirement)
+    return re.sub(r"[-_.]+", "-", match.group(1)).lower() if match else ""
+
+
+def write_slim_requirements(requirements_file: str, slim_requirements_file: str) -> None:
+    with open(requirements_file, encoding="utf-8") as file_handle:
+        requirements = file_handle.read().replace("\\\n", " ").splitlines()
+
+    with open(slim_requirements_file, "w", encoding="utf-8") as file_handle:
+        for requirement in requirements:
+            if requirement_name(requirement) not in RUNTIME_PROVIDED_DISTRIBUTIONS:
+                file_handle.write(f"{requirement}\n")
+
+
+def is_slim_noise(name: str) -> bool:
+    return name == "tests" or name.startswith("mypy_boto3_") or name.endswith(("-stubs", ".pyi"))
+
+
+def strip_slim_noise(packages_dir: str) -> None:
+    for path, directories, files in os.walk(packages_dir):
+        for directory in [directory for directory in directories if is_slim_noise(directory)]:
+            shutil.rmtree(os.path.join(path, directory))
+            directories.remove(directory)
         for filename in files:
-            zip_path = path.replace(directory, "")
-            zipfile_handle.write(os.path.join(path, filename), os.path.join(zip_path, filename))
+            if is_slim_noise(filename):
+                os.remove(os.path.join(path, filename))
+
+
+def precompile_packages(packages_dir: str, runtime_interpreter: str) -> None:
+    # Lambda's code directory is read-only, so without shipped bytecode every cold start compiles from source.
+    # Hash based bytecode does not embed source mtimes, which keeps the zip reproducible.
+    check_call(
+        [runtime_interpreter, "-m", "compileall", "-q", "-j", "0", "--invalidation-mode", "unchecked-hash", packages_dir]
+    )
+
+
+def handler_imports(handler_file: str) -> list[str]:
+    """Return the modules a handler imports at module level, in order, which is what a cold start pays for."""
+    with open(handler_file, encoding="utf-8") as file_handle:
+        tree = ast.parse(file_handle.read())
+    modules: list[str] = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+def measure_import_time(packages_dir: str, lambda_directory: str, interpreter: str) -> tuple[float, dict[str, str]]:
+    modules = handler_imports(f"{LAMBDA_FUNCTIONS_DIR}/{lambda_directory}/{LAMBDA_HANDLER_FILE}")
+    # The handler, its bundled packages and the shared code are importable as they are from the zip. -S keeps the
+    # local site-packages off the path, and -B stops the measurement itself leaving bytecode behind in the sources.
+    python_path = [packages_dir, f"{LAMBDA_FUNCTIONS_DIR}/{lambda_directory}", LAMBDA_FUNCTIONS_DIR]
+    output = check_output(
+        [
+            interpreter,
+            "-S",
+            "-B",
+            "-c",
+            IMPORT_TIME_SCRIPT,
+            json.dumps(modules),
+            json.dumps(sorted(RUNTIME_PROVIDED_MODULES)),
+        ],
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(os.path.abspath(path) for path in python_path)},
+    )
+    measurement = json.loads(output)
+    return measurement["import_time"], measurement["import_errors"]
+
+
+def is_zip_noise(name: str, include_bytecode: bool = False, source: bool = False) -> bool:
+    # Dot entries in the lambda sources are tool caches, e.g. .mypy_cache and .pytest_cache, or editor files. They
+    # would force a rebuild whenever a tool ran and ship with the code, so they are neither hashed nor zipped.
+    if source and name.startswith("."):
+        return True
+    if include_bytecode:
+        return name.endswith(".dist-info")
+    return name == "__pycache__" or name.endswith((".dist-info", ".pyc"))
+
+
+def zip_directory(
+    directory: str,
+    zipfile_handle: zipfile.ZipFile,
+    include_bytecode: bool = False,
+    archive_root: Optional[str] = None,
+    source: bool = False,
+) -> None:
+    for path, directories, files in os.walk(directory):
+        # Sorting in place also makes os.walk descend in a stable order
+        directories[:] = sorted(
+            directory for directory in directories if not is_zip_noise(directory, include_bytecode, source)
+        )
+        for filename in sorted(filename for filename in files if not is_zip_noise(filename, include_bytecode, source)):
+            file_path = os.path.join(path, filename)
+
+            zip_path = os.path.relpath(file_path, archive_root or directory).replace(os.sep, "/")
 
+            zip_info = zipfile.ZipInfo(zip_path, ZIP_ENTRY_DATE_TIME)
+            zip_info.compress_type = zipfile.ZIP_DEFLATED
+            zip_info.create_system = ZIP_CREATE_SYSTEM_UNIX
+            file_mode = ZIP_ENTRY_EXECUTABLE_MODE if os.access(file_path, os.X_OK) else ZIP_ENTRY_FILE_MODE
+            zip_info.external_attr = (stat.S_IFREG | file_mode) << 16
 
-def zip_lambda_assets(lambda_working_dir: str, lambda_directory: str) -> str:
+            with open(file_path, "rb") as file_handle:
+                zipfile_handle.writestr(zip_info, file_handle.read(), compresslevel=ZIP_COMPRESS_LEVEL)
+
+
+def zip_lambda_assets(lambda_working_dir: str, lambda_directory: str, include_bytecode: bool = False) -> str:
     packaged_lambda = f"{lambda_working_dir}/{lambda_directory}.zip"
 
-    with zipfile.ZipFile(packaged_lambda, "w", zipfile.ZIP_DEFLATED) as zipped_lambda_assets:
-        # python packages
-        zip_directory(f"{lambda_working_dir}/packages", zipped_lambda_assets)
+    # Write to a temporary file first so an interrupted build never leaves a zip that looks like a cache hit
+    with zipfile.ZipFile(f"{packaged_lambda}.tmp", "w", zipfile.ZIP_DEFLATED) as zipped_lambda_assets:
+        # python packages, including bytecode only when it was precompiled for the Lambda runtime
+        zip_directory(f"{lambda_working_dir}/packages", zipped_lambda_assets, include_bytecode)
         # lambda code
-        zip_directory(f"lambda_functions/{lambda_directory}", zipped_lambda_assets)
+        zip_directory(f"{LAMBDA_FUNCTIONS_DIR}/{lambda_directory}", zipped_lambda_assets, source=True)
+        # shared code, kept under its package directory
+        zip_directory(
+            f"{LAMBDA_FUNCTIONS_DIR}/{LAMBDA_SHARED_DIR}", zipped_lambda_assets, archive_root=LAMBDA_FUNCTIONS_DIR, source=True
+        )
+
+    os.replace(f"{packaged_lambda}.tmp", packaged_lambda)
 
     return packaged_lambda
+
+
+def lambda_build_hash(lambda_directory: str, slim: bool = False) -> str:
+    # The lambda directory holds both requirements.txt and the handler sources, so hashing it and the shared code
+    # together with the interpreter/platform tag, packaging mode and this module covers everything that can change
+    # the packages or the zip content.
+    digest = hashlib.sha256()
+    digest.update(BUNDLING_CODE_HASH.encode())
+    digest.update(f"{sys.implementation.cache_tag}:{sysconfig.get_platform()}".encode())
+    if slim:
+        digest.update(f"slim:{shutil.which(f'python{LAMBDA_RUNTIME_PYTHON_VERSION}') is not None}".encode())
+
+    for source_directory in (lambda_directory, LAMBDA_SHARED_DIR):
+        for path, directories, files in os.walk(f"{LAMBDA_FUNCTIONS_DIR}/{source_directory}"):
+            directories[:] = sorted(directory for directory in directories if not is_zip_noise(directory, source=True))
+            for filename in sorted(filename for filename in files if not is_zip_noise(filename, source=True)):
+                file_path = os.path.join(path, filename)
+                digest.update(os.path.relpath(file_path, LAMBDA_FUNCTIONS_DIR).encode())
+                with open(file_path, "rb") as file_handle:
+                    digest.update(hashlib.sha256(file_handle.read()).digest())
+
+    return digest.hexdigest()
+
+
+def prune_superseded_builds(lambda_directory: str, build_hash: str) -> None:
+    for entry in os.scandir(f"{LAMBDA_BUILD_DIR}/{lambda_directory}"):
+        if entry.name != build_hash:
+            shutil.rmtree(entry.path)
+
+
+def bundle_lambda(lambda_directory: str, slim: bool = False) -> LambdaBundle:
+    start = time.perf_counter()
+
+    # Every build lives in its own content-addressed directory; once it is complete, older builds are removed
+    build_hash = lambda_build_hash(lambda_directory, slim)
+    lambda_working_dir = f"{LAMBDA_BUILD_DIR}/{lambda_directory}/{build_hash}"
+    packaged_lambda = f"{lambda_working_dir}/{lambda_directory}.zip"
+    bundle_metrics_file = f"{lambda_working_dir}/bundle-metrics.json"
+    # A build from before bundle metrics were recorded is rebuilt rather than reported without them
+    cache_hit = os.path.isfile(packaged_lambda) and os.path.isfile(bundle_metrics_file)
+
+    if not cache_hit:
+        shutil.rmtree(lambda_working_dir, ignore_errors=True)
+        os.makedirs(lambda_working_dir)
+
+        requirements_file = f"{LAMBDA_FUNCTIONS_DIR}/{lambda_directory}/requirements.txt"
+        if slim:
+            write_slim_requirements(requirements_file, f"{lambda_working_dir}/requirements.txt")
+            requirements_file = f"{lambda_working_dir}/requirements.txt"
+
+        lambda_pip_install_requirements(f"{lambda_working_dir}/packages", requirements_file, slim)
+
+        # Bytecode is only usable by the exact Python version of the Lambda runtime; without that interpreter
+        # available the packages are shipped as source, as in the standard packaging mode.
+        runtime_interpreter = shutil.which(f"python{LAMBDA_RUNTIME_PYTHON_VERSION}") if slim else None
+        if slim:
+            strip_slim_noise(f"{lambda_working_dir}/packages")
+        if runtime_interpreter:
+            precompile_packages(f"{lambda_working_dir}/packages", runtime_interpreter)
+
+        import_time, import_errors = measure_import_time(
+            f"{lambda_working_dir}/packages", lambda_directory, runtime_interpreter or executable
+        )
+
+        zip_lambda_assets(lambda_working_dir, lambda_directory, include_bytecode=runtime_interpreter is not None)
+        # Written after the zip, so the metrics only exist for a complete build
+        with open(bundle_metrics_file, "w", encoding="utf-8") as file_handle:
+            json.dump({"import_time": import_time, "import_errors": import_errors}, file_handle)
+
+    with open(bundle_metrics_file, encoding="utf-8") as file_handle:
+        bundle_metrics = json.load(file_handle)
+
+    prune_superseded_builds(lambda_directory, build_hash)
+
+    return LambdaBundle(
+        lambda_directory=lambda_directory,
+        assets=packaged_lambda,
+        cache_hit=cache_hit,
+        duration=time.perf_counter() - start,
+        size=os.path.getsize(packaged_lambda),
+        import_time=bundle_metrics["import_time"],
+        import_errors=bundle_metrics["import_errors"],
+    )
+
+
+def discover_lambda_functions() -> list[str]:
+    return sorted(
+        entry.name
+        for entry in os.scandir(LAMBDA_FUNCTIONS_DIR)
+        if entry.is_dir() and os.path.isfile(os.path.join(entry.path, LAMBDA_HANDLER_FILE))
+    )
+
+
+def bundle_lambda_functions(slim: bool = False) -> dict[str, LambdaBundle]:
+    # Each function is pip installed and zipped in its own process, so the DEFLATE work of every archive runs on a
+    # separate core and total bundling time follows the slowest function rather than the sum of all of them.
+    lambda_directories = discover_lambda_functions()
+    with ProcessPoolExecutor(max_workers=max(1, min(len(lambda_directories), os.cpu_count() or 1))) as executor:
+        return dict(zip(lambda_directories, executor.map(partial(bundle_lambda, slim=slim), lambda_directories)))
+
+
+def format_bundling_report(bundles: list[LambdaBundle], synth_duration: float) -> str:
+    lines = []
+    for bundle in bundles:
+        lines.append(
+            f"{bundle.lambda_directory}: {'cache hit' if bundle.cache_hit else 'cache miss'} ({bundle.duration:.2f}s), "
+            f"{bundle.size / 1024 / 1024:.1f} MiB, "
+            f"handler imports in {bundle.import_time * 1000:.0f} ms"
+        )
+        lines.extend(f"  {module} failed to import: {error}" for module, error in sorted(bundle.import_errors.items()))
+    hits = sum(bundle.cache_hit for bundle in bundles)
+    lines.append(f"Lambda bundling: {hits} hit(s), {len(bundles) - hits} miss(es); synth took {synth_duration:.2f}s")
+
+    return "\n".join(lines)
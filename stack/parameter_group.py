@@ -0,0 +1,106 @@
+import re
+from typing import Optional
+
+from aws_cdk import aws_rds
+from constructs import Construct
+
+# vCPUs by instance size, the same for every family RDS offers for Postgres
+# https://docs.aws.amazon.com/AmazonRDS/latest/UserGuide/Concepts.DBInstanceClass.Summary.html
+INSTANCE_SIZE_VCPUS = {
+    "micro": 2,
+    "small": 2,
+    "medium": 2,
+    "large": 2,
+    "xlarge": 4,
+    "2xlarge": 8,
+    "4xlarge": 16,
+    "8xlarge": 32,
+    "12xlarge": 48,
+    "16xlarge": 64,
+    "24xlarge": 96,
+}
+# Burstable (t) instances have less memory per vCPU the smaller they are; other families a fixed ratio
+BURSTABLE_SIZE_MEMORY_GIB = {"micro": 1, "small": 2, "medium": 4, "large": 8, "xlarge": 16, "2xlarge": 32}
+FAMILY_MEMORY_GIB_PER_VCPU = {"m": 4, "r": 8, "x": 16}
+
+PAGE_KB = 8
+MAX_MAINTENANCE_WORK_MEM_KB = 2 * 1024 * 1024
+# The global work_mem is for every connection, which can each run a few sorts or hashes at once; analyst roles are
+# given more by analyst_resource_profile
+MIN_WORK_MEM_KB = 4096
+MAX_WORK_MEM_KB = 64 * 1024
+WORK_MEM_OPERATIONS_PER_CONNECTION = 4
+# RDS defaults max_connections to LEAST({DBInstanceClassMemory/9531392}, 5000)
+# https://docs.aws.amazon.com/AmazonRDS/latest/UserGuide/CHAP_Limits.html#RDS_Limits.MaxConnections
+RDS_MEMORY_BYTES_PER_CONNECTION = 9531392
+RDS_MAX_CONNECTIONS = 5000
+
+# Settings that do not depend on the instance size
+STATIC_PARAMETERS = {
+    # SSD (gp2) storage makes random reads barely dearer than sequential ones, and serves many at once
+    "random_page_cost": "1.1",
+    "effective_io_concurrency": "200",
+    # Statement statistics read by the collect_statement_telemetry lambda
+    "shared_preload_libraries": "pg_stat_statements",
+}
+
+
+def instance_resources(instance_type: str) -> tuple[int, int]:
+    """Return the vCPUs and memory, in GiB, of an instance type such as "t3.small" or "r6g.2xlarge"."""
+    match = re.fullmatch(r"(?:db\.)?([a-z]+)\d+[a-z-]*\.([0-9a-z]+)", instance_type)
+    if not match or match.group(2) not in INSTANCE_SIZE_VCPUS:
+        raise ValueError(f"Unsupported instance type: {instance_type}")
+    family, size = match.groups()
+
+    vcpus = INSTANCE_SIZE_VCPUS[size]
+    if family == "t" and size in BURSTABLE_SIZE_MEMORY_GIB:
+        return vcpus, BURSTABLE_SIZE_MEMORY_GIB[size]
+    if family in FAMILY_MEMORY_GIB_PER_VCPU:
+        return vcpus, vcpus * FAMILY_MEMORY_GIB_PER_VCPU[family]
+    raise ValueError(f"Unsupported instance type: {instance_type}")
+
+
+def compute_parameters(instance_type: str, max_connections: Optional[int] = None) -> dict[str, str]:
+    """Size memory and parallelism settings to the instance, in the units Postgres expects for each.
+
+    work_mem is shared out between `max_connections`, RDS's default for the instance unless given.
+    """
+    vcpus, memory_gib = instance_resources(instance_type)
+    memory_kb = memory_gib * 1024 * 1024
+    max_connections = max_connections or min(memory_kb * 1024 // RDS_MEMORY_BYTES_PER_CONNECTION, RDS_MAX_CONNECTIONS)
+    work_mem_kb = memory_kb // (WORK_MEM_OPERATIONS_PER_CONNECTION * max_connections)
+
+    return {
+        # A quarter of memory for Postgres' own cache; the rest is mostly the OS page cache the planner can count on
+        "shared_buffers": str(memory_kb // 4 // PAGE_KB),
+        "effective_cache_size": str(memory_kb * 3 // 4 // PAGE_KB),
+        # Per sort or hash in each query, so small enough for every connection to use at once
+        "work_mem": str(max(MIN_WORK_MEM_KB, min(MAX_WORK_MEM_KB, work_mem_kb))),
+        "maintenance_work_mem": str(min(MAX_MAINTENANCE_WORK_MEM_KB, max(65536, memory_kb // 16))),
+        "max_worker_processes": str(max(8, vcpus)),
+        "max_parallel_workers": str(vcpus),
+        "max_parallel_workers_per_gather": str(max(1, vcpus // 2)),
+        **STATIC_PARAMETERS,
+    }
+
+
+def create_parameter_group(
+    scope: Construct,
+    construct_id: str,
+    engine: aws_rds.IInstanceEngine,
+    instance_type: str,
+    overrides: Optional[dict[str, str]] = None,
+) -> aws_rds.ParameterGroup:
+    # Values from rds_fdw_parameters in cdk.json win over the computed ones
+    overrides = overrides or {}
+    max_connections = int(overrides["max_connections"]) if "max_connections" in overrides else None
+    return aws_rds.ParameterGroup(
+        scope,
+        construct_id,
+        engine=engine,
+        description=f"BDE FDW analytics, sized for {instance_type}",
+        parameters={
+            **compute_parameters(instance_type, max_connections),
+            **{key: str(value) for key, value in overrides.items()},
+        },
+    )
@@ -0,0 +1,11 @@
+import os
+
+import pytest
+
+TEST_POSTGRES_DSN = os.environ.get("TEST_POSTGRES_DSN", "")
+
+# Tests that need a real database, which CI provides as a PostGIS service container. They are only skipped outside
+# CI, so a CI run without the database fails rather than passing without them.
+requires_postgres = pytest.mark.skipif(
+    not TEST_POSTGRES_DSN and not os.environ.get("CI"), reason="TEST_POSTGRES_DSN is not set"
+)
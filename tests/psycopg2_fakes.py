@@ -0,0 +1,64 @@
+from typing import Any, Optional, Union
+
+from psycopg2 import sql
+
+
+# Renders psycopg2.sql statements without the database connection that Composable.as_string() needs
+def render(statement: Union[str, sql.Composable]) -> str:
+    if isinstance(statement, sql.Composed):
+        return "".join(render(part) for part in statement.seq)
+    if isinstance(statement, sql.Identifier):
+        return ".".join(statement.strings)
+    if isinstance(statement, sql.SQL):
+        return statement.string
+    if isinstance(statement, sql.Literal) and isinstance(statement.wrapped, str):
+        return "'" + statement.wrapped.replace("'", "''") + "'"
+    if isinstance(statement, sql.Literal):
+        return str(statement.wrapped)
+    return str(statement)
+
+
+class ScriptedCursor:
+    """Records statements and answers queries in order from a list of scripted results."""
+
+    def __init__(self, results: list[Any], errors: Optional[dict[str, Exception]] = None) -> None:
+        self.results = results
+        self.errors = errors or {}
+        self.statements: list[tuple[str, Any]] = []
+
+    def __enter__(self) -> "ScriptedCursor":
+        return self
+
+    def __exit__(self, *_args: Any) -> None:
+        pass
+
+    def execute(self, statement: Union[str, sql.Composable], params: Optional[Any] = None) -> None:
+        self.statements.append((render(statement), params))
+        if self.statements[-1][0] in self.errors:
+            raise self.errors[self.statements[-1][0]]
+
+    def fetchone(self) -> Any:
+        return self.results.pop(0)
+
+    def fetchall(self) -> Any:
+        return self.results.pop(0)
+
+
+class ScriptedConnection:
+    def __init__(self, cur: ScriptedCursor) -> None:
+        self.cur = cur
+        self.commits = 0
+        self.rollbacks = 0
+        self.closed = False
+
+    def cursor(self) -> ScriptedCursor:
+        return self.cur
+
+    def commit(self) -> None:
+        self.commits += 1
+
+    def rollback(self) -> None:
+        self.rollbacks += 1
+
+    def close(self) -> None:
+        self.closed = True
@@ -0,0 +1,517 @@
+import importlib.util
+import json
+import threading
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Optional
+
+import psycopg2
+import pytest
+from botocore.exceptions import ClientError
+
+from tests.psycopg2_fakes import ScriptedConnection, ScriptedCursor
+
+HANDLER_PATH = Path(__file__).parents[1] / "lambda_functions" / "create_rds_iam_user" / "lambda-handler.py"
+ACCOUNT_ID = "123456789012"
+DECLARED_AUTH = [{"AuthScheme": "SECRETS", "SecretArn": "arn:bde-analytics-root", "IAMAuth": "REQUIRED"}]
+
+
+def client_error(operation: str) -> ClientError:
+    return ClientError({"Error": {"Code": "LimitExceeded", "Message": f"{operation} failed"}}, operation)
+
+
+class NoSuchEntityException(Exception):
+    pass
+
+
+class FakeIamClient:
+    class exceptions:  # pylint: disable=invalid-name
+        NoSuchEntityException = NoSuchEntityException
+
+    def __init__(self, existing_users: set[str]) -> None:
+        self.users = existing_users
+        self.policies: set[str] = set()
+        self.failing_users: set[str] = set()
+        self.calls: list[tuple[str, dict[str, Any]]] = []
+
+    def get_user(self, **kwargs: Any) -> dict[str, Any]:
+        self.calls.append(("get_user", kwargs))
+        if kwargs["UserName"] not in self.users:
+            raise NoSuchEntityException()
+        return {"User": {"UserName": kwargs["UserName"]}}
+
+    def create_user(self, **kwargs: Any) -> None:
+        self.calls.append(("create_user", kwargs))
+        self.users.add(kwargs["UserName"])
+
+    def create_policy(self, **kwargs: Any) -> dict[str, Any]:
+        self.calls.append(("create_policy", kwargs))
+        if kwargs["PolicyName"].rsplit("-", 1)[-1] in self.failing_users:
+            raise client_error("CreatePolicy")
+        policy_arn = f"arn:aws:iam::{ACCOUNT_ID}:policy{kwargs['Path']}{kwargs['PolicyName']}"
+        self.policies.add(policy_arn)
+        return {"Policy": {"Arn": policy_arn}}
+
+    def attach_user_policy(self, **kwargs: Any) -> None:
+        self.calls.append(("attach_user_policy", kwargs))
+        if kwargs["UserName"] in self.failing_users:
+            raise client_error("AttachUserPolicy")
+        if kwargs["PolicyArn"] not in self.policies:
+            raise NoSuchEntityException()
+
+    def tag_user(self, **kwargs: Any) -> None:
+        self.calls.append(("tag_user", kwargs))
+
+    def list_policy_versions(self, **kwargs: Any) -> dict[str, Any]:
+        self.calls.append(("list_policy_versions", kwargs))
+        return {"Versions": [{"VersionId": "v2", "IsDefaultVersion": True}, {"VersionId": "v1", "IsDefaultVersion": False}]}
+
+    def delete_policy_version(self, **kwargs: Any) -> None:
+        self.calls.append(("delete_policy_version", kwargs))
+
+    def create_policy_version(self, **kwargs: Any) -> None:
+        self.calls.append(("create_policy_version", kwargs))
+        if kwargs["PolicyArn"].rsplit("-", 1)[-1] in self.failing_users:
+            raise client_error("CreatePolicyVersion")
+
+
+class FakeWarmConnection:
+    def __init__(self, cur: ScriptedCursor) -> None:
+        self.conn = ScriptedConnection(cur)
+
+    def get(self) -> ScriptedConnection:
+        return self.conn
+
+
+@pytest.fixture(name="iam")
+def fixture_iam() -> FakeIamClient:
+    return FakeIamClient({"asmith"})
+
+
+@pytest.fixture(name="handler_module")
+def fixture_handler_module(monkeypatch: pytest.MonkeyPatch, iam: FakeIamClient) -> ModuleType:
+    monkeypatch.setenv("RDS_FDW_HOST", "bde-analytics.example.com")
+    monkeypatch.setenv("RDS_FDW_DB", "bde_analytics")
+    monkeypatch.setenv("RDS_FDW_RESOURCE_ID", "db-INSTANCE")
+    monkeypatch.setenv("RDS_FDW_ROOT", "bde-analytics-root")
+
+    spec = importlib.util.spec_from_file_location("create_rds_iam_user_handler", HANDLER_PATH)
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    monkeypatch.setattr(module, "iam_client", lambda: iam)
+    monkeypatch.setattr(module, "aws_account_id", lambda: ACCOUNT_ID)
+    return module
+
+
+def use_cursor(monkeypatch: pytest.MonkeyPatch, handler_module: ModuleType, cur: ScriptedCursor) -> ScriptedConnection:
+    warm_connection = FakeWarmConnection(cur)
+    monkeypatch.setattr(handler_module, "rds_connection", warm_connection)
+    return warm_connection.conn
+
+
+def use_proxy(
+    monkeypatch: pytest.MonkeyPatch, handler_module: ModuleType, registered: Optional[Exception] = None
+) -> list[str]:
+    """Put the handler behind a proxy and return the usernames whose passwords it stores."""
+    stored: list[str] = []
+
+    def register_proxy_secrets(proxy_name: str, declared_auth: list[dict[str, str]]) -> list[str]:
+        assert (proxy_name, declared_auth) == ("analyst-proxy", DECLARED_AUTH)
+        if registered is not None:
+            raise registered
+        return [f"arn:bde-analytics/proxy/{username}" for username in stored]
+
+    monkeypatch.setattr(handler_module, "rds_fdw_proxy_name", "analyst-proxy")
+    monkeypatch.setattr(handler_module, "rds_fdw_proxy_resource_id", "prx-PROXY")
+    monkeypatch.setattr(handler_module, "rds_fdw_proxy_auth", DECLARED_AUTH)
+    monkeypatch.setattr(handler_module, "analyst_endpoint", "analyst-proxy.example.com")
+    monkeypatch.setattr(handler_module, "generate_proxy_password", lambda: "generated")
+    monkeypatch.setattr(handler_module, "store_proxy_password", lambda username, _password: stored.append(username))
+    monkeypatch.setattr(handler_module, "register_proxy_secrets", register_proxy_secrets)
+    return stored
+
+
+def test_should_create_iam_users_and_roles_in_one_transaction(
+    handler_module: ModuleType, iam: FakeIamClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    cur = ScriptedCursor([])
+    conn = use_cursor(monkeypatch, handler_module, cur)
+
+    report = handler_module.handler({"usernames": ["jdoe", "asmith", "jdoe"]}, None)
+
+    assert report == {
+        "jdoe": {"status": "created", "endpoint": "bde-analytics.example.com"},
+        "asmith": {"status": "created", "endpoint": "bde-analytics.example.com"},
+    }
+    assert [call["UserName"] for name, call in iam.calls if name == "create_user"] == ["jdoe"]
+    policy = next(call for name, call in iam.calls if name == "create_policy" and call["PolicyName"].endswith("jdoe"))
+    assert f"arn:aws:rds-db:ap-southeast-2:{ACCOUNT_ID}:dbuser:db-INSTANCE/jdoe" in policy["PolicyDocument"]
+    statements = [statement for statement, _params in cur.statements]
+    assert statements.count("SAVEPOINT provision_rds_user") == statements.count("RELEASE SAVEPOINT provision_rds_user") == 2
+    assert "CREATE ROLE jdoe WITH LOGIN" in statements
+    assert "GRANT rds_iam TO jdoe" in statements
+    assert "CREATE SCHEMA asmith" in statements
+    assert "ALTER ROLE asmith CONNECTION LIMIT 5" in statements
+    assert (conn.commits, conn.rollbacks) == (1, 0)
+
+
+def test_should_create_iam_clients_before_starting_workers(
+    handler_module: ModuleType, iam: FakeIamClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    first_calls: dict[str, str] = {}
+
+    def first_call(client: str, value: Any) -> Any:
+        first_calls.setdefault(client, threading.current_thread().name)
+        return value
+
+    monkeypatch.setattr(handler_module, "iam_client", lambda: first_call("iam", iam))
+    monkeypatch.setattr(handler_module, "aws_account_id", lambda: first_call("account", ACCOUNT_ID))
+    use_cursor(monkeypatch, handler_module, ScriptedCursor([]))
+
+    handler_module.handler({"usernames": ["jdoe", "asmith"]}, None)
+
+    assert first_calls == {"iam": threading.main_thread().name, "account": threading.main_thread().name}
+
+
+def test_should_report_failures_per_user_and_stage(
+    handler_module: ModuleType, iam: FakeIamClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    iam.failing_users = {"bfail"}
+    cur = ScriptedCursor([], errors={"CREATE ROLE asmith WITH LOGIN": psycopg2.errors.DuplicateObject('role "asmith" exists')})
+    conn = use_cursor(monkeypatch, handler_module, cur)
+
+    report = handler_module.handler({"usernames": ["jdoe", "asmith", "bfail"]}, None)
+
+    assert report["jdoe"] == {"status": "created", "endpoint": "bde-analytics.example.com"}
+    assert report["asmith"] == {"status": "failed", "stage": "database", "error": 'role "asmith" exists'}
+    assert report["bfail"]["stage"] == "iam"
+    assert "CreatePolicy failed" in report["bfail"]["error"]
+    # Only the failed user is rolled back, to its savepoint; the rest of the batch is committed
+    assert ("ROLLBACK TO SAVEPOINT provision_rds_user", None) in cur.statements
+    assert not any("bfail" in statement for statement, _params in cur.statements)
+    assert (conn.commits, conn.rollbacks) == (1, 0)
+
+
+def test_should_roll_back_batch_when_transaction_fails(handler_module: ModuleType, monkeypatch: pytest.MonkeyPatch) -> None:
+    cur = ScriptedCursor([], errors={"SAVEPOINT provision_rds_user": psycopg2.OperationalError("connection lost")})
+    conn = use_cursor(monkeypatch, handler_module, cur)
+
+    with pytest.raises(psycopg2.OperationalError):
+        handler_module.handler({"username": "jdoe"}, None)
+
+    assert (conn.commits, conn.rollbacks) == (0, 1)
+
+
+def test_should_skip_database_when_every_iam_user_fails(
+    handler_module: ModuleType, iam: FakeIamClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    iam.failing_users = {"jdoe"}
+    cur = ScriptedCursor([])
+    use_cursor(monkeypatch, handler_module, cur)
+
+    assert handler_module.handler({"username": "jdoe"}, None)["jdoe"]["stage"] == "iam"
+    assert not cur.statements
+
+
+def test_should_create_proxy_users_with_password_instead_of_rds_iam(
+    handler_module: ModuleType, iam: FakeIamClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    stored = use_proxy(monkeypatch, handler_module)
+    cur = ScriptedCursor([])
+    use_cursor(monkeypatch, handler_module, cur)
+
+    report = handler_module.handler({"username": "jdoe"}, None)
+
+    assert report == {"jdoe": {"status": "created", "endpoint": "analyst-proxy.example.com"}}
+    assert stored == ["jdoe"]
+    create_role = cur.statements[1][0]
+    assert create_role.startswith("CREATE ROLE jdoe WITH LOGIN PASSWORD 'SCRAM-SHA-256$4096:")
+    assert "generated" not in create_role
+    assert ("GRANT rds_iam TO jdoe", None) not in cur.statements
+    policy = next(call for name, call in iam.calls if name == "create_policy")
+    assert "dbuser:prx-PROXY/jdoe" in policy["PolicyDocument"]
+    tags = next(call for name, call in iam.calls if name == "tag_user")["Tags"]
+    assert {"Key": "BDE_Analytics_Endpoint", "Value": "analyst-proxy.example.com"} in tags
+
+
+def test_should_report_proxy_registration_failure(handler_module: ModuleType, monkeypatch: pytest.MonkeyPatch) -> None:
+    use_proxy(monkeypatch, handler_module, registered=client_error("ModifyDBProxy"))
+    use_cursor(monkeypatch, handler_module, ScriptedCursor([]))
+
+    report = handler_module.handler({"username": "jdoe"}, None)
+
+    assert report["jdoe"]["stage"] == "proxy"
+    assert "ModifyDBProxy failed" in report["jdoe"]["error"]
+
+
+def test_should_move_rds_iam_users_to_proxy(
+    handler_module: ModuleType, iam: FakeIamClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    iam.failing_users = {"bfail"}
+    stored = use_proxy(monkeypatch, handler_module)
+    cur = ScriptedCursor(
+        [[("asmith",), ("bfail",), ("cfail",)]],
+        errors={"REVOKE rds_iam FROM cfail": psycopg2.errors.InsufficientPrivilege("permission denied")},
+    )
+    conn = use_cursor(monkeypatch, handler_module, cur)
+
+    report = handler_module.handler({"action": "register_proxy_logins"}, None)
+
+    assert report["migrated"] == ["asmith"]
+    assert report["registered"] == ["arn:bde-analytics/proxy/asmith"]
+    assert "CreatePolicyVersion failed" in report["errors"]["iam"]["bfail"]
+    assert report["errors"]["database"] == {"cfail": "permission denied"}
+    assert stored == ["asmith"]
+    statements = [statement for statement, _params in cur.statements]
+    assert statements[2].startswith("ALTER ROLE asmith WITH PASSWORD 'SCRAM-SHA-256$4096:")
+    assert "REVOKE rds_iam FROM asmith" in statements
+    # The database login of a user whose policy could not be updated is left alone
+    assert not any("bfail" in statement for statement in statements)
+    assert (conn.commits, conn.rollbacks) == (1, 1)
+    # The new policy version allows the proxy as well as the instance, and replaces the old versions
+    policy_version = next(
+        call for name, call in iam.calls if name == "create_policy_version" and "asmith" in call["PolicyArn"]
+    )
+    assert "dbuser:db-INSTANCE/asmith" in policy_version["PolicyDocument"]
+    assert "dbuser:prx-PROXY/asmith" in policy_version["PolicyDocument"]
+    assert policy_version["SetAsDefault"] is True
+    assert ("delete_policy_version", {"PolicyArn": policy_version["PolicyArn"], "VersionId": "v1"}) in iam.calls
+
+
+def test_should_only_register_proxy_logins_when_every_user_is_moved(
+    handler_module: ModuleType, iam: FakeIamClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    use_proxy(monkeypatch, handler_module).append("jdoe")
+    cur = ScriptedCursor([[]])
+    use_cursor(monkeypatch, handler_module, cur)
+
+    assert handler_module.handler({"action": "register_proxy_logins"}, None) == {
+        "migrated": [],
+        "registered": ["arn:bde-analytics/proxy/jdoe"],
+        "errors": {"iam": {}, "database": {}},
+    }
+    assert len(cur.statements) == 1
+    assert not iam.calls
+
+
+def test_should_refuse_to_register_proxy_logins_without_proxy(handler_module: ModuleType) -> None:
+    assert handler_module.handler({"action": "register_proxy_logins"}, None) == {
+        "status": "failed",
+        "error": "There is no RDS Proxy to register logins with; add rds_proxy to cdk.json",
+    }
+
+
+def test_should_fail_deployment_when_users_cannot_be_moved_to_proxy(
+    handler_module: ModuleType, iam: FakeIamClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv("RDS_FDW_PROXY_NAME", "analyst-proxy")
+    use_proxy(monkeypatch, handler_module)
+    use_cursor(monkeypatch, handler_module, ScriptedCursor([[("asmith",)], [("bfail",)]]))
+
+    assert handler_module.register_proxy_logins_handler({}, None)["migrated"] == ["asmith"]
+
+    iam.failing_users = {"bfail"}
+    with pytest.raises(RuntimeError, match="CreatePolicyVersion failed"):
+        handler_module.register_proxy_logins_handler({}, None)
+
+
+def test_should_load_the_declared_proxy_auth(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("RDS_FDW_HOST", "bde-analytics.example.com")
+    monkeypatch.setenv("RDS_FDW_DB", "bde_analytics")
+    monkeypatch.setenv("RDS_FDW_RESOURCE_ID", "db-INSTANCE")
+    monkeypatch.setenv("RDS_FDW_ROOT", "bde-analytics-root")
+    monkeypatch.setenv("RDS_FDW_PROXY_AUTH", json.dumps(DECLARED_AUTH))
+
+    spec = importlib.util.spec_from_file_location("create_rds_iam_user_handler", HANDLER_PATH)
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    assert module.rds_fdw_proxy_auth == DECLARED_AUTH
+
+
+def test_should_move_proxy_users_back_to_rds_iam(
+    handler_module: ModuleType, iam: FakeIamClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    iam.failing_users = {"bfail"}
+    deleted: list[str] = []
+    monkeypatch.setattr(handler_module, "delete_proxy_password", deleted.append)
+    cur = ScriptedCursor(
+        [[("asmith",), ("bfail",), ("cfail",)]],
+        errors={"GRANT rds_iam TO cfail": psycopg2.errors.InsufficientPrivilege("permission denied")},
+    )
+    conn = use_cursor(monkeypatch, handler_module, cur)
+
+    report = handler_module.handler({"action": "restore_iam_logins"}, None)
+
+    assert report["restored"] == ["asmith", "bfail"]
+    assert report["errors"]["database"] == {"cfail": "permission denied"}
+    assert "CreatePolicyVersion failed" in report["errors"]["iam"]["bfail"]
+    assert deleted == ["asmith", "bfail"]
+    statements = [statement for statement, _params in cur.statements]
+    assert "GRANT rds_iam TO asmith" in statements
+    assert "ALTER ROLE asmith WITH PASSWORD NULL" in statements
+    assert (conn.commits, conn.rollbacks) == (1, 1)
+    # The new policy version only allows the instance, and the user is tagged with it as the endpoint
+    policy_version = next(
+        call for name, call in iam.calls if name == "create_policy_version" and "asmith" in call["PolicyArn"]
+    )
+    assert "dbuser:db-INSTANCE/asmith" in policy_version["PolicyDocument"]
+    assert "prx-" not in policy_version["PolicyDocument"]
+    tags = next(call["Tags"] for name, call in iam.calls if name == "tag_user" and call["UserName"] == "asmith")
+    assert {"Key": "BDE_Analytics_Endpoint", "Value": "bde-analytics.example.com"} in tags
+    assert not any(call["PolicyArn"].endswith("cfail") for name, call in iam.calls if name == "create_policy_version")
+
+
+def test_should_do_nothing_when_no_user_is_on_the_proxy(
+    handler_module: ModuleType, iam: FakeIamClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    cur = ScriptedCursor([[]])
+    use_cursor(monkeypatch, handler_module, cur)
+
+    assert handler_module.restore_iam_logins_handler({}, None) == {
+        "restored": [],
+        "errors": {"database": {}, "iam": {}},
+    }
+    assert len(cur.statements) == 1
+    assert not iam.calls
+
+
+def test_should_refuse_to_restore_iam_logins_behind_proxy(handler_module: ModuleType, monkeypatch: pytest.MonkeyPatch) -> None:
+    use_proxy(monkeypatch, handler_module)
+
+    assert handler_module.handler({"action": "restore_iam_logins"}, None) == {
+        "status": "failed",
+        "error": "Analysts log in through the RDS Proxy; remove rds_proxy from cdk.json first",
+    }
+
+
+def test_should_fail_deployment_when_users_cannot_be_moved_back_to_rds_iam(
+    handler_module: ModuleType, iam: FakeIamClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    iam.failing_users = {"bfail"}
+    monkeypatch.setattr(handler_module, "delete_proxy_password", lambda _username: None)
+    use_cursor(monkeypatch, handler_module, ScriptedCursor([[("bfail",)]]))
+
+    with pytest.raises(RuntimeError, match="CreatePolicyVersion failed"):
+        handler_module.restore_iam_logins_handler({}, None)
+
+
+def test_should_apply_resource_profile_to_every_analyst_role(
+    handler_module: ModuleType, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    cur = ScriptedCursor(
+        [[("asmith",), ("jdoe",)]],
+        errors={"ALTER ROLE jdoe SET temp_file_limit = '5GB'": psycopg2.errors.InsufficientPrivilege("permission denied")},
+    )
+    use_cursor(monkeypatch, handler_module, cur)
+
+    report = handler_module.handler({"action": "apply_resource_profile"}, None)
+
+    assert report == {
+        "asmith": {"status": "updated"},
+        "jdoe": {"status": "failed", "stage": "database", "error": "permission denied"},
+    }
+
+
+def test_should_report_drift_without_changing_anything_by_default(
+    handler_module: ModuleType, iam: FakeIamClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(handler_module, "list_analyst_iam_users", lambda: {"jdoe": set()})
+    cur = ScriptedCursor([[("asmith", True, True)]])
+    conn = use_cursor(monkeypatch, handler_module, cur)
+
+    report = handler_module.handler({"action": "reconcile"}, None)
+
+    assert report["dry_run"] is True
+    assert (report["missing_roles"], report["missing_policies"], report["orphaned_roles"]) == (["jdoe"], ["jdoe"], ["asmith"])
+    assert len(cur.statements) == 1
+    assert not iam.calls
+    assert (conn.commits, conn.rollbacks) == (0, 1)
+
+
+def test_should_fix_drift_and_revoke_orphans(
+    handler_module: ModuleType, iam: FakeIamClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    iam.policies.add(f"arn:aws:iam::{ACCOUNT_ID}:policy/bde-analytics-policies/bde-analytics-iam-policy-bnoschema")
+    iam_users = {"jdoe": set(), "bnoschema": set(), "cfail": {"bde-analytics-iam-policy-cfail"}}
+    monkeypatch.setattr(handler_module, "list_analyst_iam_users", lambda: iam_users)
+    cur = ScriptedCursor(
+        [[("asmith", True, True), ("bnoschema", False, True)]],
+        errors={"CREATE ROLE cfail WITH LOGIN": psycopg2.errors.DuplicateObject('role "cfail" exists')},
+    )
+    use_cursor(monkeypatch, handler_module, cur)
+
+    report = handler_module.handler({"action": "reconcile", "dry_run": False, "revoke_orphans": True}, None)
+
+    statements = [statement for statement, _params in cur.statements]
+    assert "CREATE ROLE jdoe WITH LOGIN" in statements
+    assert "CREATE SCHEMA bnoschema" in statements
+    assert "ALTER ROLE asmith NOLOGIN" in statements
+    # An existing but detached policy is attached again; a missing one is created first
+    attached = [call["UserName"] for name, call in iam.calls if name == "attach_user_policy"]
+    assert sorted(attached) == ["bnoschema", "jdoe", "jdoe"]
+    assert report["errors"] == {"iam": {}, "database": {"cfail": 'role "cfail" exists'}, "proxy": {}}
+
+
+def test_should_give_login_back_to_revoked_role_when_user_is_tagged_again(
+    handler_module: ModuleType, iam: FakeIamClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    iam_users: dict[str, set[str]] = {}
+    monkeypatch.setattr(handler_module, "list_analyst_iam_users", lambda: iam_users)
+    cur = ScriptedCursor(
+        [
+            [("asmith", True, True)],
+            # Revoked roles are read as NOLOGIN, no longer as missing; one has lost its schema since
+            [("asmith", True, False), ("bnoschema", False, False)],
+        ]
+    )
+    use_cursor(monkeypatch, handler_module, cur)
+
+    handler_module.handler({"action": "reconcile", "dry_run": False, "revoke_orphans": True}, None)
+    iam_users.update(
+        {
+            "asmith": {"bde-analytics-iam-policy-asmith"},
+            "bnoschema": {"bde-analytics-iam-policy-bnoschema"},
+        }
+    )
+    report = handler_module.handler({"action": "reconcile", "dry_run": False}, None)
+
+    assert (report["missing_roles"], report["revoked_roles"]) == ([], ["asmith", "bnoschema"])
+    statements = [statement for statement, _params in cur.statements]
+    assert "ALTER ROLE asmith NOLOGIN" in statements
+    assert "ALTER ROLE asmith LOGIN" in statements
+    assert statements.index("CREATE SCHEMA bnoschema") < statements.index("ALTER ROLE bnoschema LOGIN")
+    assert not any(statement.startswith("CREATE ROLE") for statement in statements)
+    assert report["errors"] == {"iam": {}, "database": {}, "proxy": {}}
+
+
+def test_should_report_iam_and_proxy_failures_when_reconciling(
+    handler_module: ModuleType, iam: FakeIamClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    iam.failing_users = {"bfail"}
+    use_proxy(monkeypatch, handler_module, registered=client_error("ModifyDBProxy"))
+    monkeypatch.setattr(handler_module, "list_analyst_iam_users", lambda: {"jdoe": set(), "bfail": set()})
+    use_cursor(monkeypatch, handler_module, ScriptedCursor([[("bfail", True, True)]]))
+
+    report = handler_module.handler({"action": "reconcile", "dry_run": False}, None)
+
+    assert "AttachUserPolicy failed" in report["errors"]["iam"]["bfail"]
+    assert "ModifyDBProxy failed" in report["errors"]["proxy"]["jdoe"]
+    assert not report["errors"]["database"]
+
+
+def test_should_leave_orphans_alone_unless_asked(
+    handler_module: ModuleType, iam: FakeIamClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(handler_module, "list_analyst_iam_users", dict)
+    cur = ScriptedCursor([[("asmith", True, True)]])
+    use_cursor(monkeypatch, handler_module, cur)
+
+    report = handler_module.handler({"action": "reconcile", "dry_run": False}, None)
+
+    assert report["orphaned_roles"] == ["asmith"]
+    assert len(cur.statements) == 1
+    assert not iam.calls
@@ -0,0 +1,60 @@
+import importlib.util
+import time
+from pathlib import Path
+from types import ModuleType
+from typing import Any
+
+import pytest
+
+from tests.psycopg2_fakes import ScriptedConnection, ScriptedCursor
+
+HANDLER_PATH = Path(__file__).parents[1] / "lambda_functions" / "export_query" / "lambda-handler.py"
+BUCKET = "bde-analytics-exports"
+
+
+@pytest.fixture(name="handler_module")
+def fixture_handler_module(monkeypatch: pytest.MonkeyPatch) -> ModuleType:
+    monkeypatch.setenv("RDS_FDW_HOST", "bde-analytics.example.com")
+    monkeypatch.setenv("RDS_FDW_DB", "bde_analytics")
+    monkeypatch.setenv("RDS_FDW_ROOT", "bde-analytics-root")
+    monkeypatch.setenv("EXPORT_BUCKET", BUCKET)
+    monkeypatch.setenv("EXPORT_QUERIES", '{"parcels": "SELECT id FROM bde.crs_parcel"}')
+
+    spec = importlib.util.spec_from_file_location("export_query_handler", HANDLER_PATH)
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_should_export_to_a_new_key_each_time(handler_module: ModuleType, monkeypatch: pytest.MonkeyPatch) -> None:
+    connections: list[ScriptedConnection] = []
+    exports: list[tuple[str, str, str]] = []
+
+    def connect(_credentials: Any, **_connect_kwargs: Any) -> ScriptedConnection:
+        connections.append(ScriptedConnection(ScriptedCursor([])))
+        return connections[-1]
+
+    def export_query(_conn: ScriptedConnection, query: str, bucket: str, key: str) -> dict[str, Any]:
+        exports.append((query, bucket, key))
+        return {"key": key}
+
+    monkeypatch.setattr(handler_module, "connect", connect)
+    monkeypatch.setattr(handler_module, "export_query", export_query)
+    # Both exports start in the same second
+    epoch = time.gmtime(0)
+    monkeypatch.setattr(time, "gmtime", lambda: epoch)
+
+    first = handler_module.handler({"query": "parcels"}, None)
+    second = handler_module.handler({"query": "parcels"}, None)
+
+    assert first["key"] != second["key"]
+    for query, bucket, key in exports:
+        assert (query, bucket) == ("SELECT id FROM bde.crs_parcel", BUCKET)
+        assert key.startswith("exports/parcels/19700101T000000Z-") and key.endswith(".csv.gz")
+    assert all(conn.closed for conn in connections)
+
+
+def test_should_refuse_unknown_queries(handler_module: ModuleType) -> None:
+    with pytest.raises(ValueError, match="Unknown export query: titles"):
+        handler_module.handler({"query": "titles"}, None)
@@ -0,0 +1,330 @@
+import os
+import shutil
+import sys
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from stack import lambda_bundling
+from stack.lambda_bundling import (
+    LambdaBundle,
+    bundle_lambda,
+    bundle_lambda_functions,
+    discover_lambda_functions,
+    format_bundling_report,
+    measure_import_time,
+    strip_slim_noise,
+    write_slim_requirements,
+    zip_lambda_assets,
+)
+
+
+@pytest.fixture(name="subprocess_calls")
+def fixture_lambda_function(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> list[list[str]]:
+    monkeypatch.chdir(tmp_path)
+    lambda_dir = tmp_path / "lambda_functions" / "example"
+    lambda_dir.mkdir(parents=True)
+    (lambda_dir / "lambda-handler.py").write_text("def handler(event, context):\n    return event\n")
+    (lambda_dir / "requirements.txt").write_text("example-package==1.0.0\n")
+
+    subprocess_calls: list[list[str]] = []
+
+    def fake_check_call(command: list[str]) -> None:
+        subprocess_calls.append(command)
+        if "compileall" in command:
+            (Path(command[-1]) / "example_package" / "__pycache__").mkdir()
+            (Path(command[-1]) / "example_package" / "__pycache__" / "__init__.cpython-39.pyc").write_bytes(b"")
+            return
+        target = next(argument for argument in command if argument.startswith("--target="))
+        package_dir = Path(target.removeprefix("--target=")) / "example_package"
+        package_dir.mkdir(parents=True)
+        (package_dir / "__init__.py").write_text("VALUE = 1\n")
+        (package_dir / "tests").mkdir()
+        (package_dir / "tests" / "test_example.py").write_text("")
+
+    def fake_check_output(command: list[str], env: dict[str, str]) -> bytes:
+        subprocess_calls.append(command)
+        return b'{"import_time": 0.25, "import_errors": {}}\n'
+
+    monkeypatch.setattr(lambda_bundling, "check_call", fake_check_call)
+    monkeypatch.setattr(lambda_bundling, "check_output", fake_check_output)
+    monkeypatch.setattr(shutil, "which", lambda _command: None)
+
+    return subprocess_calls
+
+
+def count_pip_installs(subprocess_calls: list[list[str]]) -> int:
+    return sum("pip" in command for command in subprocess_calls)
+
+
+def test_should_reuse_bundle_when_nothing_changed(subprocess_calls: list[list[str]]) -> None:
+    first = bundle_lambda("example")
+    second = bundle_lambda("example")
+
+    assert not first.cache_hit
+    assert second.cache_hit
+    assert first.assets == second.assets
+    assert count_pip_installs(subprocess_calls) == 1
+
+
+def test_should_rebuild_bundle_cached_without_metrics(subprocess_calls: list[list[str]]) -> None:
+    first = bundle_lambda("example")
+    # As left by a build from before bundle metrics were recorded
+    os.remove(Path(first.assets).with_name("bundle-metrics.json"))
+
+    second = bundle_lambda("example")
+
+    assert not second.cache_hit
+    assert second.import_time == 0.25
+    assert count_pip_installs(subprocess_calls) == 2
+
+
+def test_should_rebuild_bundle_when_handler_changes(subprocess_calls: list[list[str]]) -> None:
+    first = bundle_lambda("example")
+    Path("lambda_functions/example/lambda-handler.py").write_text("def handler(event, context):\n    return None\n")
+    second = bundle_lambda("example")
+
+    assert not second.cache_hit
+    assert first.assets != second.assets
+    assert os.path.isfile(second.assets)
+    # The superseded build is pruned
+    assert os.listdir("lambda_functions/.out/example") == [Path(second.assets).parent.name]
+    assert count_pip_installs(subprocess_calls) == 2
+
+
+def test_should_ignore_tool_caches_in_lambda_sources(subprocess_calls: list[list[str]]) -> None:
+    first = bundle_lambda("example")
+    for cache_file in (".mypy_cache/3.9/cache.db", ".pytest_cache/v/cache/lastfailed", ".DS_Store"):
+        Path("lambda_functions/example", cache_file).parent.mkdir(parents=True, exist_ok=True)
+        Path("lambda_functions/example", cache_file).write_text("{}")
+    second = bundle_lambda("example")
+
+    assert second.cache_hit
+    assert first.assets == second.assets
+    assert count_pip_installs(subprocess_calls) == 1
+
+
+def test_should_rebuild_bundle_when_requirements_change(subprocess_calls: list[list[str]]) -> None:
+    bundle_lambda("example")
+    Path("lambda_functions/example/requirements.txt").write_text("example-package==2.0.0\n")
+
+    assert not bundle_lambda("example").cache_hit
+    assert count_pip_installs(subprocess_calls) == 2
+
+
+def test_should_rebuild_bundle_when_bundling_code_changes(
+    subprocess_calls: list[list[str]], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    first = bundle_lambda("example")
+    monkeypatch.setattr(lambda_bundling, "BUNDLING_CODE_HASH", "changed zip layout")
+    second = bundle_lambda("example")
+
+    assert not second.cache_hit
+    assert first.assets != second.assets
+    assert count_pip_installs(subprocess_calls) == 2
+
+
+def test_should_bundle_shared_code_and_rebuild_when_it_changes(subprocess_calls: list[list[str]]) -> None:
+    Path("lambda_functions/shared").mkdir()
+    Path("lambda_functions/shared/credentials.py").write_text("")
+    first = bundle_lambda("example")
+    with zipfile.ZipFile(first.assets) as zipped_lambda_assets:
+        assert "shared/credentials.py" in zipped_lambda_assets.namelist()
+    Path("lambda_functions/shared/credentials.py").write_text("MAX_AGE = 300\n")
+    second = bundle_lambda("example")
+
+    assert not second.cache_hit
+    assert count_pip_installs(subprocess_calls) == 2
+
+
+def test_should_discover_only_directories_with_a_lambda_handler(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    for lambda_directory in ("second", "first"):
+        (tmp_path / "lambda_functions" / lambda_directory).mkdir(parents=True)
+        (tmp_path / "lambda_functions" / lambda_directory / "lambda-handler.py").write_text("")
+    (tmp_path / "lambda_functions" / ".out").mkdir()
+    (tmp_path / "lambda_functions" / "README.md").write_text("")
+
+    assert discover_lambda_functions() == ["first", "second"]
+
+
+def test_should_bundle_every_lambda_function(subprocess_calls: list[list[str]], monkeypatch: pytest.MonkeyPatch) -> None:
+    Path("lambda_functions/other").mkdir()
+    Path("lambda_functions/other/lambda-handler.py").write_text("")
+    Path("lambda_functions/other/requirements.txt").write_text("")
+    # Worker processes would not see the patched pip call
+    monkeypatch.setattr(lambda_bundling, "ProcessPoolExecutor", ThreadPoolExecutor)
+
+    lambda_bundles = bundle_lambda_functions()
+
+    assert list(lambda_bundles) == ["example", "other"]
+    assert all(os.path.isfile(bundle.assets) for bundle in lambda_bundles.values())
+    assert count_pip_installs(subprocess_calls) == 2
+
+
+def test_should_build_byte_identical_zips_from_identical_inputs(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    lambda_dir = tmp_path / "lambda_functions" / "example"
+    lambda_dir.mkdir(parents=True)
+    (lambda_dir / "lambda-handler.py").write_text("def handler(event, context):\n    return event\n")
+
+    zips = []
+    for build, mtime in (("first", 1_000_000_000), ("second", 1_700_000_000)):
+        package_dir = tmp_path / build / "packages" / "example_package"
+        package_dir.mkdir(parents=True)
+        # Create files in a different order each time, with different mtimes, as pip and os.walk would
+        for filename in ("b.py", "a.py") if build == "first" else ("a.py", "b.py"):
+            (package_dir / filename).write_text(f"NAME = '{filename}'\n")
+        for path in (package_dir / "a.py", package_dir / "b.py", lambda_dir / "lambda-handler.py"):
+            os.utime(path, (mtime, mtime))
+
+        zips.append(Path(zip_lambda_assets(str(tmp_path / build), "example")).read_bytes())
+
+    assert zips[0] == zips[1]
+
+
+def test_should_strip_bytecode_dist_info_and_tool_caches_from_zip(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "lambda_functions" / "example" / "__pycache__").mkdir(parents=True)
+    (tmp_path / "lambda_functions" / "example" / "lambda-handler.py").write_text("")
+    (tmp_path / "lambda_functions" / "example" / "__pycache__" / "lambda-handler.cpython-39.pyc").write_bytes(b"")
+    (tmp_path / "lambda_functions" / "example" / ".mypy_cache").mkdir()
+    (tmp_path / "lambda_functions" / "example" / ".mypy_cache" / "cache.db").write_bytes(b"")
+    packages_dir = tmp_path / "build" / "packages"
+    (packages_dir / "example_package-1.0.0.dist-info").mkdir(parents=True)
+    (packages_dir / "example_package-1.0.0.dist-info" / "RECORD").write_text("")
+    (packages_dir / "example_package").mkdir()
+    (packages_dir / "example_package" / "__init__.py").write_text("")
+    (packages_dir / "example_package" / "__init__.pyc").write_bytes(b"")
+
+    with zipfile.ZipFile(zip_lambda_assets(str(tmp_path / "build"), "example")) as zipped_lambda_assets:
+        assert zipped_lambda_assets.namelist() == ["example_package/__init__.py", "lambda-handler.py"]
+        assert {zip_info.date_time for zip_info in zipped_lambda_assets.infolist()} == {(1980, 1, 1, 0, 0, 0)}
+        assert {zip_info.external_attr >> 16 for zip_info in zipped_lambda_assets.infolist()} == {0o100644}
+
+
+def test_should_drop_runtime_provided_distributions_from_slim_requirements(tmp_path: Path) -> None:
+    (tmp_path / "requirements.txt").write_text(
+        'boto3==1.26.80 ; python_version >= "3.9" \\\n'
+        "    --hash=sha256:704065abc8fdd2519491c11eeb65d69f21d0baf278b66b0b44090cc09c8c7bf8\n"
+        "psycopg2-binary==2.9.5\n"
+        "python_dateutil==2.8.2\n"
+    )
+
+    write_slim_requirements(str(tmp_path / "requirements.txt"), str(tmp_path / "slim-requirements.txt"))
+
+    assert (tmp_path / "slim-requirements.txt").read_text() == "psycopg2-binary==2.9.5\n"
+
+
+def test_should_strip_tests_and_type_stubs_from_slim_packages(tmp_path: Path) -> None:
+    for path in (
+        "example_package/__init__.py",
+        "example_package/__init__.pyi",
+        "example_package/tests/test_example.py",
+        "mypy_boto3_iam/__init__.pyi",
+        "botocore-stubs/__init__.pyi",
+    ):
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text("")
+
+    strip_slim_noise(str(tmp_path))
+
+    assert sorted(str(path.relative_to(tmp_path)) for path in tmp_path.rglob("*")) == [
+        "example_package",
+        os.path.join("example_package", "__init__.py"),
+    ]
+
+
+def test_should_ship_precompiled_bytecode_in_slim_bundle(
+    subprocess_calls: list[list[str]], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(shutil, "which", lambda command: f"/usr/bin/{command}")
+
+    lambda_bundle = bundle_lambda("example", slim=True)
+
+    assert "--no-deps" in subprocess_calls[0]
+    assert subprocess_calls[1][0] == "/usr/bin/python3.9"
+    assert lambda_bundle.import_time == 0.25
+    with zipfile.ZipFile(lambda_bundle.assets) as zipped_lambda_assets:
+        assert zipped_lambda_assets.namelist() == [
+            "example_package/__init__.py",
+            "example_package/__pycache__/__init__.cpython-39.pyc",
+            "lambda-handler.py",
+            "requirements.txt",
+        ]
+
+
+def test_should_ship_source_only_in_slim_bundle_without_runtime_interpreter(subprocess_calls: list[list[str]]) -> None:
+    lambda_bundle = bundle_lambda("example", slim=True)
+
+    assert not any("compileall" in command for command in subprocess_calls)
+    with zipfile.ZipFile(lambda_bundle.assets) as zipped_lambda_assets:
+        assert "example_package/tests/test_example.py" not in zipped_lambda_assets.namelist()
+
+
+def test_should_measure_import_time_of_handler_imports(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    lambda_dir = tmp_path / "lambda_functions" / "example"
+    lambda_dir.mkdir(parents=True)
+    (lambda_dir / "lambda-handler.py").write_text(
+        "import os\n"
+        "import botocore\n"
+        "from example_package import VALUE\n"
+        "from shared.slow import SLOW\n"
+        "import pytest\n"
+        "import dropped_from_slim_package\n"
+        "\n"
+        "def handler(event, context):\n"
+        "    import not_measured\n"
+    )
+    (tmp_path / "lambda_functions" / "shared").mkdir()
+    (tmp_path / "lambda_functions" / "shared" / "__init__.py").write_text("")
+    (tmp_path / "lambda_functions" / "shared" / "slow.py").write_text("import time\ntime.sleep(0.05)\nSLOW = True\n")
+    packages_dir = tmp_path / "packages"
+    (packages_dir / "example_package").mkdir(parents=True)
+    (packages_dir / "example_package" / "__init__.py").write_text("VALUE = 1\n")
+
+    import_time, import_errors = measure_import_time(str(packages_dir), "example", sys.executable)
+
+    assert import_time >= 0.05
+    # botocore comes with the runtime; pytest is only installed locally, so it would be missing in Lambda
+    assert import_errors == {
+        "pytest": "ModuleNotFoundError: No module named 'pytest'",
+        "dropped_from_slim_package": "ModuleNotFoundError: No module named 'dropped_from_slim_package'",
+    }
+    assert not (tmp_path / "lambda_functions" / "shared" / "__pycache__").exists()
+
+
+def test_should_report_cache_hits_and_misses() -> None:
+    report = format_bundling_report(
+        [
+            LambdaBundle(
+                lambda_directory="first",
+                assets="first.zip",
+                cache_hit=True,
+                duration=0.5,
+                size=1048576,
+                import_time=0.085,
+                import_errors={},
+            ),
+            LambdaBundle(
+                lambda_directory="second",
+                assets="second.zip",
+                cache_hit=False,
+                duration=12.25,
+                size=5767168,
+                import_time=0.4,
+                import_errors={"aws_xray_sdk": "ModuleNotFoundError: No module named 'wrapt'"},
+            ),
+        ],
+        synth_duration=15,
+    )
+
+    assert report.splitlines() == [
+        "first: cache hit (0.50s), 1.0 MiB, handler imports in 85 ms",
+        "second: cache miss (12.25s), 5.5 MiB, handler imports in 400 ms",
+        "  aws_xray_sdk failed to import: ModuleNotFoundError: No module named 'wrapt'",
+        "Lambda bundling: 1 hit(s), 1 miss(es); synth took 15.00s",
+    ]
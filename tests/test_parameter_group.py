@@ -0,0 +1,102 @@
+import aws_cdk as cdk
+import pytest
+from aws_cdk import aws_ec2, aws_rds
+from aws_cdk.assertions import Template
+
+from stack.parameter_group import compute_parameters, create_parameter_group, instance_resources
+
+POSTGRES_15 = aws_rds.DatabaseInstanceEngine.postgres(version=aws_rds.PostgresEngineVersion.of("15", "15"))
+
+
+def synth_parameters(instance_class: str, instance_size: str, overrides: dict[str, str]) -> dict[str, str]:
+    stack = cdk.Stack(cdk.App(), "ParameterGroupStack")
+    instance_type = aws_ec2.InstanceType.of(
+        getattr(aws_ec2.InstanceClass, instance_class), getattr(aws_ec2.InstanceSize, instance_size)
+    )
+    parameter_group = create_parameter_group(stack, "ParameterGroup", POSTGRES_15, instance_type.to_string(), overrides)
+    # Parameter groups are only rendered once a database instance uses them
+    parameter_group.bind_to_instance()
+
+    template = Template.from_stack(stack)
+    template.has_resource_properties("AWS::RDS::DBParameterGroup", {"Family": "postgres15"})
+    (resource,) = template.find_resources("AWS::RDS::DBParameterGroup").values()
+    return resource["Properties"]["Parameters"]  # type: ignore[no-any-return]
+
+
+@pytest.mark.parametrize(
+    "instance_class, instance_size, expected",
+    [
+        (
+            "BURSTABLE3",
+            "SMALL",
+            {
+                "shared_buffers": "65536",
+                "effective_cache_size": "196608",
+                "work_mem": "4096",
+                "maintenance_work_mem": "131072",
+                "max_parallel_workers": "2",
+                "max_parallel_workers_per_gather": "1",
+            },
+        ),
+        (
+            "STANDARD5",
+            "XLARGE",
+            {
+                "shared_buffers": "524288",
+                "effective_cache_size": "1572864",
+                "work_mem": "4096",
+                "maintenance_work_mem": "1048576",
+                "max_worker_processes": "8",
+                "max_parallel_workers": "4",
+                "max_parallel_workers_per_gather": "2",
+            },
+        ),
+        (
+            "MEMORY6_GRAVITON",
+            "XLARGE4",
+            {
+                "shared_buffers": "4194304",
+                "effective_cache_size": "12582912",
+                "work_mem": "6710",
+                "maintenance_work_mem": "2097152",
+                "max_worker_processes": "16",
+                "max_parallel_workers": "16",
+                "max_parallel_workers_per_gather": "8",
+            },
+        ),
+    ],
+)
+def test_should_size_parameters_to_instance_type(instance_class: str, instance_size: str, expected: dict[str, str]) -> None:
+    parameters = synth_parameters(instance_class, instance_size, {})
+
+    assert parameters == {**parameters, **expected}
+    assert parameters["random_page_cost"] == "1.1"
+    assert parameters["shared_preload_libraries"] == "pg_stat_statements"
+
+
+def test_should_apply_overrides_over_computed_parameters() -> None:
+    parameters = synth_parameters("BURSTABLE3", "SMALL", {"work_mem": "16384", "log_min_duration_statement": 5000})  # type: ignore[dict-item]
+
+    assert parameters["work_mem"] == "16384"
+    assert parameters["log_min_duration_statement"] == "5000"
+    assert parameters["shared_buffers"] == "65536"
+
+
+def test_should_share_work_mem_between_overridden_max_connections() -> None:
+    parameters = synth_parameters("STANDARD5", "XLARGE", {"max_connections": "100"})
+
+    assert parameters["work_mem"] == "41943"
+    assert parameters["max_connections"] == "100"
+    assert compute_parameters("r6g.4xlarge", max_connections=100)["work_mem"] == "65536"
+
+
+def test_should_read_resources_of_rds_instance_class_names() -> None:
+    assert instance_resources("db.t4g.medium") == (2, 4)
+    assert instance_resources("x2g.large") == (2, 32)
+    assert compute_parameters("m6gd.large")["shared_buffers"] == "262144"
+
+
+@pytest.mark.parametrize("instance_type", ["t3.nano", "c5.large", "t3.4xlarge", "postgres"])
+def test_should_reject_unsupported_instance_types(instance_type: str) -> None:
+    with pytest.raises(ValueError, match="Unsupported instance type"):
+        instance_resources(instance_type)
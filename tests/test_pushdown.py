@@ -0,0 +1,256 @@
+import json
+from typing import Any
+
+import psycopg2
+import pytest
+from typer.testing import CliRunner
+
+from src.pushdown import (
+    analyse_plan,
+    app,
+    describe_operator_shippability,
+    describe_shippability,
+    expression_blockers,
+    foreign_scan_rows,
+    merge_shippability,
+    pushed_down_operations,
+)
+from tests.psycopg2_fakes import ScriptedConnection, ScriptedCursor
+
+PARCEL_SCAN = {
+    "Node Type": "Foreign Scan",
+    "Relation Name": "crs_parcel",
+    "Schema": "bde",
+    "Plan Rows": 1000,
+    "Plan Width": 200,
+    "Remote SQL": "SELECT id, status, shape FROM bde.crs_parcel WHERE ((status = 'CURR'::bpchar))",
+    "Filter": "public.st_dwithin(crs_parcel.shape, '0101000020C1080000'::geometry, '100'::double precision)",
+}
+TITLE_SCAN = {
+    "Node Type": "Foreign Scan",
+    "Relations": "(bde.crs_title t) INNER JOIN (bde.crs_title_estate e)",
+    "Plan Rows": 50,
+    "Plan Width": 40,
+    "Actual Rows": 20,
+    "Remote SQL": "SELECT t.title_no FROM (bde.crs_title t INNER JOIN bde.crs_title_estate e ON ((t.title_no = e.ttl_title_no)))"
+    " ORDER BY t.title_no ASC NULLS LAST LIMIT 10",
+}
+PLAN = {
+    "Node Type": "Sort",
+    "Sort Key": ["(lower((crs_parcel.appellation)::text))"],
+    "Plan Rows": 1000,
+    "Plan Width": 200,
+    "Plans": [
+        {
+            "Node Type": "Hash Join",
+            "Hash Cond": "(crs_parcel.title_no = t.title_no)",
+            "Join Filter": "(crs_parcel.shape && t.shape)",
+            "Plans": [PARCEL_SCAN, {"Node Type": "Hash", "Plans": [TITLE_SCAN]}],
+        },
+        {"Node Type": "Seq Scan", "Relation Name": "local_parcels", "Filter": "(st_isvalid(shape))"},
+    ],
+}
+
+
+def test_should_detect_operations_pushed_down_in_remote_sql() -> None:
+    assert pushed_down_operations(PARCEL_SCAN["Remote SQL"]) == ["filter"]  # type: ignore[arg-type]
+    assert pushed_down_operations(TITLE_SCAN["Remote SQL"]) == ["join", "sort", "limit"]  # type: ignore[arg-type]
+    assert pushed_down_operations("SELECT count(*) FROM bde.crs_parcel") == ["aggregate"]
+
+
+def test_should_find_functions_and_operators_in_local_expressions() -> None:
+    assert expression_blockers("((a.shape && b.shape) AND (a.id = ANY ('{1,2}'::integer[])))") == [
+        "operator &&",
+        "operator =",
+    ]
+    assert expression_blockers(PARCEL_SCAN["Filter"]) == ["public.st_dwithin"]  # type: ignore[arg-type]
+
+
+def test_should_split_plan_into_remote_and_local_work() -> None:
+    report = analyse_plan(PLAN)
+
+    assert [foreign_scan.relations for foreign_scan in report.foreign_scans] == [
+        "bde.crs_parcel",
+        "(bde.crs_title t) INNER JOIN (bde.crs_title_estate e)",
+    ]
+    assert report.local_operations == [
+        "sort",
+        "hash join join",
+        f"filter on bde.crs_parcel: {PARCEL_SCAN['Filter']}",
+    ]
+    assert report.blockers == ["lower", "operator &&", "operator =", "public.st_dwithin"]
+    assert report.foreign_tables == ["bde.crs_parcel", "bde.crs_title", "bde.crs_title_estate"]
+    assert report.rows_transferred == 1020
+    assert report.rows_estimated
+    assert report.bytes_transferred == 1000 * 200 + 20 * 40
+
+
+def test_should_count_rows_removed_by_local_filter_in_every_loop() -> None:
+    assert foreign_scan_rows({**PARCEL_SCAN, "Actual Rows": 5, "Rows Removed by Filter": 95, "Actual Loops": 3}) == (
+        300,
+        False,
+    )
+    assert foreign_scan_rows(TITLE_SCAN) == (20, False)
+    assert foreign_scan_rows(PARCEL_SCAN) == (1000, True)
+
+
+def test_should_report_local_aggregate_limit_and_filter() -> None:
+    def above(node_type: str, **keys: Any) -> dict[str, Any]:
+        return {"Node Type": node_type, **keys, "Plans": [PARCEL_SCAN]}
+
+    assert analyse_plan(above("Aggregate")).local_operations[0] == "aggregate"
+    assert analyse_plan(above("Limit")).local_operations[0] == "limit"
+    assert analyse_plan(above("Result", Filter="(id > 3)")).local_operations[0] == "filter: (id > 3)"
+    assert analyse_plan(above("Gather")).local_operations == [f"filter on bde.crs_parcel: {PARCEL_SCAN['Filter']}"]
+
+
+def test_should_explain_why_functions_are_not_shipped() -> None:
+    reasons = describe_shippability(
+        [
+            ("public.st_dwithin(geometry, geometry, double precision)", "i", "postgis", False),
+            ("pg_catalog.random()", "v", None, False),
+            ("public.parcel_area(integer)", "i", None, False),
+            ("pg_catalog.lower(text)", "i", None, True),
+        ]
+    )
+
+    assert reasons["public.st_dwithin"] == "extension postgis is not listed in the server's extensions option"
+    assert reasons["random"] == "not immutable"
+    assert reasons["parcel_area"] == "not built in and not part of an extension"
+    assert reasons["lower"].startswith("shippable on its own")
+
+
+def test_should_describe_only_operators_with_unshippable_overloads() -> None:
+    reasons = describe_operator_shippability(
+        [
+            ("&&", "anyarray", "anyarray", "i", None, True),
+            ("&&", "geometry", "geometry", "i", "postgis", False),
+            ("=", "integer", "integer", "i", None, True),
+            ("~~", "text", "text", "i", None, True),
+            ("%~", "integer", "integer", "v", None, False),
+            ("%~", "text", "text", "i", None, False),
+        ]
+    )
+
+    assert reasons == {
+        "operator &&": "geometry && geometry: extension postgis is not listed in the server's extensions option",
+        "operator %~": "integer %~ integer: not immutable; text %~ text: not built in and not part of an extension",
+    }
+
+
+def test_should_name_the_server_of_each_reason_when_there_are_several() -> None:
+    replica_reasons = {"public.st_dwithin": "extension postgis is not listed in the server's extensions option"}
+    assert merge_shippability({"bde_replica": replica_reasons}) == replica_reasons
+    assert merge_shippability(
+        {"bde_processor": {"public.st_dwithin": "shippable on its own"}, "bde_replica": replica_reasons}
+    ) == {
+        "public.st_dwithin": "bde_processor: shippable on its own; "
+        "bde_replica: extension postgis is not listed in the server's extensions option"
+    }
+    assert merge_shippability({}) == {}
+
+
+def test_should_print_report_for_query(monkeypatch: pytest.MonkeyPatch) -> None:
+    cur = ScriptedCursor(
+        [
+            (PLAN,),
+            [("bde_processor",)],
+            [("pg_catalog.lower(text)", "i", None, True)],
+            [("&&", "geometry", "geometry", "i", "postgis", False), ("=", "text", "text", "i", None, True)],
+        ]
+    )
+    conn = ScriptedConnection(cur)
+    monkeypatch.setattr(psycopg2, "connect", lambda dsn: conn)
+
+    result = CliRunner().invoke(app, ["--dsn=dbname=bde_analytics", "-"], input="SELECT 1")
+
+    assert cur.statements[0] == ("SELECT fdw_pushdown.explain(%s, %s)", ("SELECT 1", False))
+    # Checked against the server of the foreign tables in the plan
+    assert cur.statements[1][1] == (["bde.crs_parcel", "bde.crs_title", "bde.crs_title_estate"],)
+    assert cur.statements[2][1] == (["lower", "public.st_dwithin"], "bde_processor")
+    assert cur.statements[3][1] == (["&&", "="], "bde_processor")
+    assert "Foreign scan on bde.crs_parcel\n  pushed down: filter\n  estimated rows out of the scan" in result.stdout
+    assert "Not shipped: lower (shippable on its own" in result.stdout
+    assert "Not shipped: operator && (geometry && geometry: extension postgis" in result.stdout
+    # Built-in operators on built-in types are shipped, so they are not what kept the join local
+    assert "operator =" not in result.stdout
+    assert result.stdout.endswith(
+        "Total estimated rows out of the scan, after any local filter: 1,020 (~0.2 MiB)\n"
+        "Add --analyze for the rows actually transferred.\n"
+    )
+    assert conn.rollbacks == 1
+    assert conn.closed
+
+
+def test_should_check_operators_against_every_server_of_the_plan(monkeypatch: pytest.MonkeyPatch) -> None:
+    plan = {**PARCEL_SCAN, "Filter": "(crs_parcel.shape && '0103000020C1080000'::geometry)"}
+    cur = ScriptedCursor(
+        [
+            ({"Node Type": "Append", "Plans": [plan, {**plan, "Schema": "lds"}]},),
+            [("bde_processor",), ("bde_replica",)],
+            [("&&", "geometry", "geometry", "i", "postgis", True)],
+            [("&&", "geometry", "geometry", "i", "postgis", False)],
+        ]
+    )
+    monkeypatch.setattr(psycopg2, "connect", lambda dsn: ScriptedConnection(cur))
+
+    result = CliRunner().invoke(app, ["SELECT id FROM bde.crs_parcel UNION ALL SELECT id FROM lds.crs_parcel"])
+
+    assert cur.statements[1][1] == (["bde.crs_parcel", "lds.crs_parcel"],)
+    assert [params for _statement, params in cur.statements[2:]] == [
+        (["&&"], "bde_processor"),
+        (["&&"], "bde_replica"),
+    ]
+    assert "Not shipped: operator && (bde_replica: geometry && geometry: extension postgis is not listed" in result.stdout
+
+
+def test_should_check_functions_without_operators(monkeypatch: pytest.MonkeyPatch) -> None:
+    cur = ScriptedCursor(
+        [
+            (PARCEL_SCAN,),
+            [("bde_processor",)],
+            [("public.st_dwithin(geometry, geometry, double precision)", "i", "postgis", False)],
+        ]
+    )
+    monkeypatch.setattr(psycopg2, "connect", lambda dsn: ScriptedConnection(cur))
+
+    result = CliRunner().invoke(app, ["SELECT id FROM bde.crs_parcel"])
+
+    assert len(cur.statements) == 3
+    assert "Not shipped: public.st_dwithin (extension postgis is not listed" in result.stdout
+
+
+def test_should_print_json_report_without_blockers(monkeypatch: pytest.MonkeyPatch) -> None:
+    cur = ScriptedCursor([(TITLE_SCAN,)])
+    monkeypatch.setattr(psycopg2, "connect", lambda dsn: ScriptedConnection(cur))
+
+    result = CliRunner().invoke(app, ["--json", "--analyze", "SELECT title_no FROM bde.crs_title"])
+
+    report = json.loads(result.stdout)
+    assert report["foreign_scans"][0]["pushed_down"] == ["join", "sort", "limit"]
+    assert report["blockers"] == []
+    assert report["rows_transferred"] == 20
+    assert report["rows_estimated"] is False
+    assert len(cur.statements) == 1
+
+
+def test_should_print_rows_transferred_with_analyze(monkeypatch: pytest.MonkeyPatch) -> None:
+    cur = ScriptedCursor([({**TITLE_SCAN, "Rows Removed by Filter": 30},)])
+    monkeypatch.setattr(psycopg2, "connect", lambda dsn: ScriptedConnection(cur))
+
+    result = CliRunner().invoke(app, ["--analyze", "SELECT title_no FROM bde.crs_title"])
+
+    assert "  rows transferred: 50 " in result.stdout
+    assert result.stdout.endswith("Total rows transferred: 50 (~0.0 MiB)\n")
+
+
+def test_should_fail_when_explain_function_is_missing(monkeypatch: pytest.MonkeyPatch) -> None:
+    cur = ScriptedCursor([], errors={"SELECT fdw_pushdown.explain(%s, %s)": psycopg2.errors.UndefinedFunction()})
+    conn = ScriptedConnection(cur)
+    monkeypatch.setattr(psycopg2, "connect", lambda dsn: conn)
+
+    result = CliRunner().invoke(app, ["SELECT 1"])
+
+    assert result.exit_code == 1
+    assert "installed by the RDS Init lambda" in result.output
+    assert conn.closed
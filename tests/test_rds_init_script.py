@@ -0,0 +1,428 @@
+import importlib.util
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Iterator
+
+import psycopg2
+import pytest
+from psycopg2.extensions import connection
+from shared.table_cache import CachedTable
+
+from tests.postgres import TEST_POSTGRES_DSN, requires_postgres
+from tests.psycopg2_fakes import ScriptedConnection, ScriptedCursor
+
+HANDLER_PATH = Path(__file__).parents[1] / "lambda_functions" / "rds_init_script" / "lambda-handler.py"
+
+
+@pytest.fixture(name="handler_module")
+def fixture_handler_module(monkeypatch: pytest.MonkeyPatch) -> ModuleType:
+    monkeypatch.setenv("BDE_HOST_NAME", "bde.example.com")
+    monkeypatch.setenv("BDE_ANALYTICS_USER_SECRET", "bde-analytics-user")
+    monkeypatch.setenv("RDS_FDW_HOST", "bde-analytics.example.com")
+    monkeypatch.setenv("RDS_FDW_DB", "bde_analytics")
+    monkeypatch.setenv("RDS_FDW_ROOT", "bde-analytics-root")
+
+    spec = importlib.util.spec_from_file_location("rds_init_script_handler", HANDLER_PATH)
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeCredentials:
+    def get(self) -> dict[str, str]:
+        return {"username": "bde_analytics", "password": "rotated"}
+
+
+def use_connections(
+    monkeypatch: pytest.MonkeyPatch, handler_module: ModuleType, *connections: ScriptedConnection
+) -> list[ScriptedConnection]:
+    """Hand out the connections in order to the handler, and return them."""
+    remaining = list(connections)
+    monkeypatch.setattr(handler_module, "connect", lambda _credentials, **_connect_kwargs: remaining.pop(0))
+    return list(connections)
+
+
+def test_should_create_provisioner_role_with_admin_on_existing_analysts(handler_module: ModuleType) -> None:
+    cur = ScriptedCursor([None, ("160002",), [("asmith",), ("jdoe",)]])
+
+    handler_module.create_provisioner_role(cur, "bde_provisioner")
+
+    statements = [statement for statement, _params in cur.statements]
+    assert statements[1] == "CREATE ROLE bde_provisioner WITH LOGIN CREATEROLE"
+    assert "GRANT rds_iam TO bde_provisioner WITH ADMIN OPTION" in statements
+    assert "GRANT CREATE ON DATABASE bde_analytics TO bde_provisioner" in statements
+    assert "GRANT SET ON PARAMETER temp_file_limit TO bde_provisioner" in statements
+    assert cur.statements[6][1] == {"provisioner": "bde_provisioner"}
+    assert statements[7:] == [
+        "GRANT asmith TO bde_provisioner WITH ADMIN OPTION, INHERIT FALSE, SET FALSE",
+        "GRANT jdoe TO bde_provisioner WITH ADMIN OPTION, INHERIT FALSE, SET FALSE",
+    ]
+
+
+def test_should_only_grant_admin_on_analysts_from_postgres_16(handler_module: ModuleType) -> None:
+    # Before PostgreSQL 16 CREATEROLE covers every role that is not a superuser
+    cur = ScriptedCursor([(1,), ("150007",)])
+
+    handler_module.create_provisioner_role(cur, "bde_provisioner")
+
+    statements = [statement for statement, _params in cur.statements]
+    assert not any(statement.startswith("CREATE ROLE") for statement in statements)
+    assert statements[-1] == "SHOW server_version_num"
+
+
+def test_should_create_foreign_server_and_keep_user_mapping_in_step(handler_module: ModuleType) -> None:
+    cur = ScriptedCursor([("150007",), (["host=old.example.com", "fetch_size=10000"],)])
+
+    tuning = handler_module.create_foreign_server(cur, "bde_replica", "replica.example.com", FakeCredentials().get())
+
+    assert cur.statements[0] == (
+        "CREATE SERVER IF NOT EXISTS bde_replica FOREIGN DATA WRAPPER postgres_fdw OPTIONS (host %s, "
+        "port '5432', dbname 'bde', extensions 'postgis')",
+        ("replica.example.com",),
+    )
+    # The host follows cdk.json, and analyze_sampling is left out before PostgreSQL 16
+    assert tuning == {
+        "async_capable": "true",
+        "fdw_startup_cost": "100",
+        "fdw_tuple_cost": "0.2",
+        "host": "replica.example.com",
+    }
+    assert cur.statements[-2:] == [
+        (
+            "CREATE USER MAPPING IF NOT EXISTS FOR postgres SERVER bde_replica OPTIONS (user %s, password %s)",
+            ("bde_analytics", "rotated"),
+        ),
+        (
+            "ALTER USER MAPPING FOR postgres SERVER bde_replica OPTIONS (SET user %s, SET password %s)",
+            ("bde_analytics", "rotated"),
+        ),
+    ]
+
+
+def test_should_tune_foreign_tables_in_every_schema(handler_module: ModuleType, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(handler_module, "BDE_FOREIGN_SCHEMAS", ["bde", "lds"])
+    cur = ScriptedCursor([[("crs_parcel", "integer", 4, None)], [("crs_parcel", None)], [], []])
+    (conn,) = use_connections(monkeypatch, handler_module, ScriptedConnection(cur))
+
+    assert handler_module.tune_foreign_tables() == {
+        "bde": {"crs_parcel": {"fetch_size": "100000", "use_remote_estimate": "true"}},
+        "lds": {},
+    }
+    assert (conn.commits, conn.rollbacks, conn.closed) == (1, 0, True)
+
+
+def test_should_roll_back_table_tuning_when_it_fails(handler_module: ModuleType, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(handler_module, "BDE_FOREIGN_SCHEMAS", ["bde"])
+    cur = ScriptedCursor(
+        [[("crs_parcel", "integer", 4, None)], [("crs_parcel", None)]],
+        errors={
+            "ALTER FOREIGN TABLE bde.crs_parcel OPTIONS (ADD fetch_size '100000', ADD use_remote_estimate 'true')": (
+                psycopg2.errors.InsufficientPrivilege("must be owner of foreign table crs_parcel")
+            )
+        },
+    )
+    (conn,) = use_connections(monkeypatch, handler_module, ScriptedConnection(cur))
+
+    with pytest.raises(psycopg2.errors.InsufficientPrivilege):
+        handler_module.tune_foreign_tables()
+
+    assert (conn.commits, conn.rollbacks, conn.closed) == (0, 1, True)
+
+
+def test_should_create_cached_tables_one_transaction_each(handler_module: ModuleType, monkeypatch: pytest.MonkeyPatch) -> None:
+    crs_parcel = CachedTable(schema="bde", table="crs_parcel", key="id")
+    crs_title = CachedTable(schema="bde", table="crs_title", key="title_no")
+    monkeypatch.setattr(handler_module, "BDE_CACHED_TABLES", [crs_parcel, crs_title])
+    # crs_title is cached already
+    monkeypatch.setattr(handler_module, "create_cached_table", lambda _cur, cached_table: cached_table == crs_parcel)
+    (conn,) = use_connections(monkeypatch, handler_module, ScriptedConnection(ScriptedCursor([])))
+
+    assert handler_module.create_cached_tables() == ["bde.crs_parcel"]
+    assert (conn.commits, conn.rollbacks, conn.closed) == (2, 0, True)
+
+
+def test_should_roll_back_cached_table_when_copy_fails(handler_module: ModuleType, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(handler_module, "BDE_CACHED_TABLES", [CachedTable(schema="bde", table="crs_parcel", key="id")])
+
+    def create_cached_table(_cur: ScriptedCursor, _cached_table: CachedTable) -> bool:
+        raise psycopg2.errors.UniqueViolation("could not create unique index")
+
+    monkeypatch.setattr(handler_module, "create_cached_table", create_cached_table)
+    (conn,) = use_connections(monkeypatch, handler_module, ScriptedConnection(ScriptedCursor([])))
+
+    with pytest.raises(psycopg2.errors.UniqueViolation):
+        handler_module.create_cached_tables()
+
+    assert (conn.commits, conn.rollbacks, conn.closed) == (0, 1, True)
+
+
+def test_should_refuse_schemas_on_servers_not_in_bde_replicas(
+    handler_module: ModuleType, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(handler_module, "BDE_REPLICA_HOSTS", {"bde_replica": "replica.example.com"})
+    monkeypatch.setattr(handler_module, "BDE_SCHEMA_SERVERS", {"lds": "bde_replica", "bde": "bde_reader"})
+    # Nothing is connected to
+    use_connections(monkeypatch, handler_module)
+
+    with pytest.raises(ValueError, match="bde_schema_servers refers to servers not in bde_replicas: bde_reader"):
+        handler_module.handler({}, None)
+
+
+def test_should_set_up_servers_then_import_tune_and_cache(handler_module: ModuleType, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(handler_module, "bde_analytics_user_credentials", FakeCredentials())
+    monkeypatch.setattr(handler_module, "rds_fdw_provisioner", "bde_provisioner")
+    monkeypatch.setattr(handler_module, "BDE_REPLICA_HOSTS", {"bde_replica": "replica.example.com"})
+    monkeypatch.setattr(handler_module, "BDE_SCHEMA_SERVERS", {"lds": "bde_replica"})
+    monkeypatch.setattr(handler_module, "BDE_CACHED_TABLES", [CachedTable(schema="bde", table="crs_parcel", key="id")])
+    servers: list[tuple[str, str, dict[str, str]]] = []
+    provisioners: list[str] = []
+    imports: list[dict[str, Any]] = []
+
+    def create_foreign_server(_cur: ScriptedCursor, server: str, host: str, user: dict[str, str]) -> dict[str, str]:
+        servers.append((server, host, user))
+        return {"host": host}
+
+    def import_foreign_schemas(open_connection: Any, schemas: list[str], **kwargs: Any) -> dict[str, dict[str, Any]]:
+        imports.append({"connection": open_connection(), "schemas": schemas, **kwargs})
+        return {schema: {"added": []} for schema in schemas}
+
+    monkeypatch.setattr(handler_module, "create_foreign_server", create_foreign_server)
+    monkeypatch.setattr(handler_module, "create_provisioner_role", lambda _cur, provisioner: provisioners.append(provisioner))
+    monkeypatch.setattr(handler_module, "import_foreign_schemas", import_foreign_schemas)
+    monkeypatch.setattr(handler_module, "tune_foreign_tables", lambda: {"bde": {}})
+    monkeypatch.setattr(handler_module, "create_cached_tables", lambda: ["bde.crs_parcel"])
+    cur = ScriptedCursor([])
+    conn, import_conn = use_connections(
+        monkeypatch, handler_module, ScriptedConnection(cur), ScriptedConnection(ScriptedCursor([]))
+    )
+
+    report = handler_module.handler({"mode": "rebuild"}, None)
+
+    statements = [statement for statement, _params in cur.statements]
+    assert statements[:3] == [
+        "CREATE EXTENSION IF NOT EXISTS postgis",
+        "CREATE EXTENSION IF NOT EXISTS postgres_fdw",
+        "CREATE EXTENSION IF NOT EXISTS pg_stat_statements",
+    ]
+    assert statements[3] == handler_module.PUSHDOWN_SQL.read_text()
+    assert servers == [
+        ("bde_processor", "bde.example.com", FakeCredentials().get()),
+        ("bde_replica", "replica.example.com", FakeCredentials().get()),
+    ]
+    assert provisioners == ["bde_provisioner"]
+    assert (conn.commits, conn.rollbacks, conn.closed) == (1, 0, True)
+    assert imports == [
+        {
+            "connection": import_conn,
+            "schemas": ["bde", "table_version", "lds", "bde_ext", "bde_control"],
+            "rebuild": True,
+            "schema_servers": {"lds": "bde_replica"},
+        }
+    ]
+    assert report["fdw_tuning"] == {
+        "servers": {"bde_processor": {"host": "bde.example.com"}, "bde_replica": {"host": "replica.example.com"}},
+        "tables": {"bde": {}},
+    }
+    assert report["bde_cache"] == {"created": ["bde.crs_parcel"]}
+    assert report["lds"] == {"added": []}
+
+
+def test_should_leave_out_provisioner_and_cache_unless_configured(
+    handler_module: ModuleType, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(handler_module, "bde_analytics_user_credentials", FakeCredentials())
+    monkeypatch.setattr(handler_module, "create_foreign_server", lambda _cur, _server, host, _user: {"host": host})
+    monkeypatch.setattr(handler_module, "import_foreign_schemas", lambda _open_connection, schemas, **_kwargs: {})
+    monkeypatch.setattr(handler_module, "tune_foreign_tables", lambda: {})
+    cur = ScriptedCursor([])
+    use_connections(monkeypatch, handler_module, ScriptedConnection(cur))
+
+    report = handler_module.handler({}, None)
+
+    assert report == {"fdw_tuning": {"servers": {"bde_processor": {"host": "bde.example.com"}}, "tables": {}}}
+    assert len(cur.statements) == 4
+
+
+def test_should_roll_back_setup_when_it_fails(handler_module: ModuleType, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(handler_module, "bde_analytics_user_credentials", FakeCredentials())
+    cur = ScriptedCursor(
+        [], errors={"CREATE EXTENSION IF NOT EXISTS pg_stat_statements": psycopg2.errors.UndefinedFile("not available")}
+    )
+    (conn,) = use_connections(monkeypatch, handler_module, ScriptedConnection(cur))
+
+    with pytest.raises(psycopg2.errors.UndefinedFile):
+        handler_module.handler({}, None)
+
+    assert (conn.commits, conn.rollbacks, conn.closed) == (0, 1, True)
+
+
+class UncommittedConnection:
+    """A real connection for the handler whose commits are deferred, so the test can roll everything back."""
+
+    def __init__(self, conn: connection) -> None:
+        self.conn = conn
+
+    def cursor(self) -> Any:
+        return self.conn.cursor()
+
+    def commit(self) -> None:
+        pass
+
+    def rollback(self) -> None:
+        self.conn.rollback()
+
+    def close(self) -> None:
+        pass
+
+
+@pytest.fixture(name="postgres")
+def fixture_postgres() -> Iterator[connection]:
+    conn = psycopg2.connect(TEST_POSTGRES_DSN)
+    try:
+        yield conn
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def server_options(cur: Any, server: str) -> dict[str, str]:
+    cur.execute("SELECT srvoptions FROM pg_foreign_server WHERE srvname = %s", (server,))
+    return dict(option.split("=", 1) for option in cur.fetchone()[0])
+
+
+@requires_postgres
+def test_should_create_and_update_foreign_server_in_postgres(handler_module: ModuleType, postgres: connection) -> None:
+    with postgres.cursor() as cur:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS postgres_fdw")
+
+        handler_module.create_foreign_server(cur, "bde_test", "old.example.com", {"username": "bde", "password": "first"})
+        handler_module.create_foreign_server(cur, "bde_test", "new.example.com", {"username": "bde", "password": "second"})
+
+        options = server_options(cur, "bde_test")
+        assert (options["host"], options["dbname"], options["fetch_size"]) == ("new.example.com", "bde", "10000")
+        # The mapping follows the rotated secret
+        cur.execute("SELECT umoptions FROM pg_user_mappings WHERE srvname = 'bde_test' AND usename = 'postgres'")
+        assert cur.fetchone() == (["user=bde", "password=second"],)
+
+
+@requires_postgres
+def test_should_create_provisioner_role_in_postgres(
+    handler_module: ModuleType, postgres: connection, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    with postgres.cursor() as cur:
+        cur.execute("SELECT current_database(), current_setting('server_version_num')::integer")
+        database, server_version = cur.fetchone() or (None, 0)
+        monkeypatch.setattr(handler_module, "rds_fdw_db", database)
+        # rds_iam only exists on RDS
+        cur.execute("SELECT 1 FROM pg_roles WHERE rolname = 'rds_iam'")
+        if cur.fetchone() is None:
+            cur.execute("CREATE ROLE rds_iam")
+        cur.execute("CREATE ROLE bde_test_analyst LOGIN")
+        cur.execute("CREATE SCHEMA bde_test_analyst AUTHORIZATION bde_test_analyst")
+
+        # A second run finds the role and grants again
+        handler_module.create_provisioner_role(cur, "bde_test_provisioner")
+        handler_module.create_provisioner_role(cur, "bde_test_provisioner")
+
+        cur.execute("SELECT rolcanlogin, rolcreaterole FROM pg_roles WHERE rolname = 'bde_test_provisioner'")
+        assert cur.fetchone() == (True, True)
+        cur.execute(
+            "SELECT pg_has_role('bde_test_provisioner', 'rds_iam', 'MEMBER WITH ADMIN OPTION'), "
+            "has_database_privilege('bde_test_provisioner', %s, 'CREATE'), "
+            "has_parameter_privilege('bde_test_provisioner', 'temp_file_limit', 'SET')",
+            (database,),
+        )
+        assert cur.fetchone() == (True, True, True)
+        cur.execute(
+            "SELECT pg_has_role('bde_test_provisioner', 'bde_test_analyst', 'MEMBER WITH ADMIN OPTION'), "
+            "pg_has_role('bde_test_provisioner', 'bde_test_analyst', 'USAGE')"
+        )
+        # ADMIN on the analyst from PostgreSQL 16, without its privileges
+        assert cur.fetchone() == (server_version >= 160000, False)
+
+
+@requires_postgres
+def test_should_tune_foreign_tables_in_postgres(
+    handler_module: ModuleType, postgres: connection, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(handler_module, "BDE_FOREIGN_SCHEMAS", ["bde_test"])
+    use_connections(monkeypatch, handler_module, UncommittedConnection(postgres))  # type: ignore[arg-type]
+    with postgres.cursor() as cur:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS postgres_fdw")
+        cur.execute("CREATE SERVER bde_test FOREIGN DATA WRAPPER postgres_fdw")
+        cur.execute("CREATE SCHEMA bde_test")
+        cur.execute("CREATE FOREIGN TABLE bde_test.crs_parcel (id integer, status char(4)) SERVER bde_test")
+
+        assert handler_module.tune_foreign_tables() == {
+            "bde_test": {"crs_parcel": {"fetch_size": "100000", "use_remote_estimate": "true"}}
+        }
+
+        cur.execute("SELECT ftoptions FROM pg_foreign_table WHERE ftrelid = 'bde_test.crs_parcel'::regclass")
+        assert cur.fetchone() == (["fetch_size=100000", "use_remote_estimate=true"],)
+
+
+@requires_postgres
+def test_should_create_cached_tables_in_postgres(
+    handler_module: ModuleType, postgres: connection, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(
+        handler_module,
+        "BDE_CACHED_TABLES",
+        [CachedTable(schema="bde_test", table="crs_parcel", key="id", indexes=("status",))],
+    )
+    use_connections(
+        monkeypatch, handler_module, UncommittedConnection(postgres), UncommittedConnection(postgres)  # type: ignore[arg-type]
+    )
+    with postgres.cursor() as cur:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS postgis")
+        # A local table stands in for the foreign one; the copy reads it the same way
+        cur.execute("CREATE SCHEMA bde_test")
+        cur.execute("CREATE TABLE bde_test.crs_parcel (id integer, status char(4), shape geometry)")
+        cur.execute("INSERT INTO bde_test.crs_parcel VALUES (1, 'CURR', 'POINT(174 -41)')")
+        cur.execute("CREATE SCHEMA IF NOT EXISTS table_version")
+        cur.execute("CREATE TABLE IF NOT EXISTS table_version.revision (id integer)")
+        cur.execute("INSERT INTO table_version.revision VALUES (42)")
+
+        assert handler_module.create_cached_tables() == ["bde_test.crs_parcel"]
+        # The copy is kept on the next run
+        assert handler_module.create_cached_tables() == []
+
+        cur.execute("SELECT indexdef FROM pg_indexes WHERE schemaname = 'bde_cache' AND tablename = 'crs_parcel'")
+        index_definitions = " ".join(indexdef for (indexdef,) in cur.fetchall())
+        assert "UNIQUE INDEX crs_parcel_pkey" in index_definitions
+        assert "btree (status)" in index_definitions
+        assert "gist (shape)" in index_definitions
+        cur.execute("SELECT revision FROM bde_cache.refresh_state WHERE table_name = 'bde_test.crs_parcel'")
+        assert cur.fetchone() == (42,)
+
+
+@requires_postgres
+def test_should_install_pushdown_functions_in_postgres(handler_module: ModuleType, postgres: connection) -> None:
+    with postgres.cursor() as cur:
+        # Installed on every run, so it must replace what is there
+        cur.execute(handler_module.PUSHDOWN_SQL.read_text())
+        cur.execute(handler_module.PUSHDOWN_SQL.read_text())
+
+        cur.execute("CREATE EXTENSION IF NOT EXISTS postgis")
+        cur.execute("CREATE EXTENSION IF NOT EXISTS postgres_fdw")
+        cur.execute("CREATE SERVER bde_test FOREIGN DATA WRAPPER postgres_fdw OPTIONS (extensions 'postgis')")
+        cur.execute("CREATE SERVER bde_test_replica FOREIGN DATA WRAPPER postgres_fdw")
+
+        cur.execute(
+            "SELECT function_name, shippable FROM fdw_pushdown.function_shippability(ARRAY['lower', 'random'], 'bde_test')"
+        )
+        shippability = dict(cur.fetchall())
+        assert (shippability["pg_catalog.lower(text)"], shippability["pg_catalog.random()"]) == (True, False)
+        # PostGIS functions and operators are only shippable to the server that lists the extension
+        for server, shippable in (("bde_test", True), ("bde_test_replica", False)):
+            cur.execute(
+                "SELECT bool_and(shippable) FROM fdw_pushdown.function_shippability(ARRAY['st_dwithin'], %s)", (server,)
+            )
+            assert cur.fetchone() == (shippable,)
+            cur.execute(
+                "SELECT shippable FROM fdw_pushdown.operator_shippability(ARRAY['&&'], %s) "
+                "WHERE left_type = 'geometry' AND right_type = 'geometry'",
+                (server,),
+            )
+            assert cur.fetchone() == (shippable,)
@@ -0,0 +1,123 @@
+import csv
+import gzip
+import io
+import os
+from typing import Any, Iterator, Optional, Union
+
+import boto3
+import psycopg2
+import pytest
+from moto import mock_aws
+from mypy_boto3_s3 import S3Client
+from psycopg2 import sql
+from shared import bulk_export
+from shared.bulk_export import MultipartUploadWriter, export_query, load_export_queries
+
+from tests.postgres import TEST_POSTGRES_DSN, requires_postgres
+from tests.psycopg2_fakes import ScriptedConnection, ScriptedCursor
+
+BUCKET = "bde-analytics-exports"
+MIN_PART_BYTES = 5 * 1024 * 1024
+
+
+class CopyCursor(ScriptedCursor):
+    """Writes the scripted chunks to the target of COPY ... TO STDOUT, as psycopg2 does with the rows it receives."""
+
+    def __init__(self, chunks: list[bytes], errors: Optional[dict[str, Exception]] = None) -> None:
+        super().__init__([], errors)
+        self.chunks = chunks
+        self.rowcount = -1
+
+    def copy_expert(self, statement: Union[str, sql.Composable], file: Any) -> None:
+        self.execute(statement)
+        for chunk in self.chunks:
+            file.write(chunk)
+        self.rowcount = len(self.chunks)
+
+
+@pytest.fixture(name="s3")
+def fixture_s3(monkeypatch: pytest.MonkeyPatch) -> Iterator[S3Client]:
+    with mock_aws():
+        client = boto3.client("s3", region_name="ap-southeast-2")
+        client.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={"LocationConstraint": "ap-southeast-2"})
+        monkeypatch.setattr(bulk_export, "s3_client", lambda: client)
+        yield client
+
+
+def download(s3: S3Client, key: str) -> bytes:
+    return gzip.decompress(s3.get_object(Bucket=BUCKET, Key=key)["Body"].read())
+
+
+def test_should_load_export_queries() -> None:
+    assert load_export_queries('{"parcels": "SELECT id FROM bde.crs_parcel"}') == {"parcels": "SELECT id FROM bde.crs_parcel"}
+    assert not load_export_queries(None)
+
+
+def test_should_upload_query_result_as_gzipped_csv(s3: S3Client) -> None:
+    cur = CopyCursor([b"id,status\n", b"1,CURR\n", b"2,HIST\n"])
+    conn = ScriptedConnection(cur)
+
+    report = export_query(conn, "SELECT id, status FROM bde.crs_parcel", BUCKET, "exports/parcels.csv.gz")  # type: ignore[arg-type]
+
+    assert download(s3, "exports/parcels.csv.gz") == b"id,status\n1,CURR\n2,HIST\n"
+    assert cur.statements == [
+        ("SET TRANSACTION READ ONLY", None),
+        ("COPY (SELECT id, status FROM bde.crs_parcel) TO STDOUT WITH (FORMAT csv, HEADER)", None),
+    ]
+    assert conn.commits == 1
+    assert report["rows"] == 3
+    assert report["bytes"] == 24
+    assert report["parts"] == 1
+    assert report["url"].startswith(f"https://{BUCKET}.s3.amazonaws.com/exports/parcels.csv.gz?")
+    head = s3.head_object(Bucket=BUCKET, Key="exports/parcels.csv.gz")
+    assert head["ContentType"] == "application/gzip"
+    assert head["ContentDisposition"] == 'attachment; filename="parcels.csv.gz"'
+    assert "ContentEncoding" not in head
+
+
+def test_should_upload_a_part_whenever_the_compressed_buffer_is_full(s3: S3Client) -> None:
+    # Random bytes barely compress, so each chunk fills most of a part
+    chunks = [os.urandom(MIN_PART_BYTES) for _chunk in range(3)]
+    writer = MultipartUploadWriter(BUCKET, "exports/random.csv.gz", part_bytes=MIN_PART_BYTES)
+
+    for chunk in chunks:
+        writer.write(chunk)
+        assert writer.buffer.tell() < MIN_PART_BYTES
+    writer.complete()
+
+    assert download(s3, "exports/random.csv.gz") == b"".join(chunks)
+    assert len(writer.parts) > 1
+    assert [part["PartNumber"] for part in writer.parts] == list(range(1, len(writer.parts) + 1))
+    assert writer.bytes_uploaded == s3.head_object(Bucket=BUCKET, Key="exports/random.csv.gz")["ContentLength"]
+
+
+def test_should_abort_upload_when_query_fails(s3: S3Client) -> None:
+    statement = "COPY (SELECT * FROM bde.crs_missing) TO STDOUT WITH (FORMAT csv, HEADER)"
+    conn = ScriptedConnection(CopyCursor([], errors={statement: psycopg2.errors.UndefinedTable("no such table")}))
+
+    with pytest.raises(psycopg2.errors.UndefinedTable):
+        export_query(conn, "SELECT * FROM bde.crs_missing", BUCKET, "exports/missing.csv.gz")  # type: ignore[arg-type]
+
+    assert conn.rollbacks == 1
+    assert "Uploads" not in s3.list_multipart_uploads(Bucket=BUCKET)
+    assert "Contents" not in s3.list_objects_v2(Bucket=BUCKET)
+
+
+@requires_postgres
+def test_should_stream_query_from_postgres(s3: S3Client) -> None:
+    conn = psycopg2.connect(TEST_POSTGRES_DSN)
+    try:
+        report = export_query(
+            conn,
+            "SELECT i AS id, md5(i::text) AS title_no FROM generate_series(1, 300000) AS i",
+            BUCKET,
+            "exports/titles.csv.gz",
+            part_bytes=MIN_PART_BYTES,
+        )
+    finally:
+        conn.close()
+
+    rows = list(csv.reader(io.StringIO(download(s3, "exports/titles.csv.gz").decode())))
+    assert rows[0] == ["id", "title_no"]
+    assert len(rows) == report["rows"] + 1 == 300001
+    assert report["parts"] > 1
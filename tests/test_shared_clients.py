@@ -0,0 +1,49 @@
+from typing import Any, Iterator
+
+import boto3
+import pytest
+from shared import clients
+
+
+@pytest.fixture(name="created_clients")
+def fixture_created_clients(monkeypatch: pytest.MonkeyPatch) -> Iterator[list[str]]:
+    created_clients: list[str] = []
+
+    class FakeStsClient:
+        @staticmethod
+        def get_caller_identity() -> dict[str, str]:
+            return {"Account": "123456789012"}
+
+    def fake_client(service_name: str, **_kwargs: Any) -> FakeStsClient:
+        created_clients.append(service_name)
+        return FakeStsClient()
+
+    monkeypatch.setattr(boto3, "client", fake_client)
+
+    yield created_clients
+
+    for cached_function in (
+        clients.iam_client,
+        clients.rds_client,
+        clients.s3_client,
+        clients.secretsmanager_client,
+        clients.sts_client,
+        clients.aws_account_id,
+    ):
+        cached_function.cache_clear()
+
+
+def test_should_create_each_client_once(created_clients: list[str]) -> None:
+    for _invocation in range(2):
+        clients.iam_client()
+        clients.rds_client()
+        clients.s3_client()
+        clients.secretsmanager_client()
+        clients.sts_client()
+
+    assert created_clients == ["iam", "rds", "s3", "secretsmanager", "sts"]
+
+
+def test_should_look_up_account_id_once(created_clients: list[str]) -> None:
+    assert clients.aws_account_id() == clients.aws_account_id() == "123456789012"
+    assert created_clients == ["sts"]
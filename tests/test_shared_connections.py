@@ -0,0 +1,111 @@
+from typing import Any
+
+import psycopg2
+import pytest
+from psycopg2.extensions import STATUS_BEGIN, STATUS_READY
+from shared import connections
+from shared.connections import CONNECT_TIMEOUT_SECONDS, WarmConnection
+
+
+class FakeCursor:
+    def __init__(self, conn: "FakeConnection") -> None:
+        self.conn = conn
+
+    def __enter__(self) -> "FakeCursor":
+        return self
+
+    def __exit__(self, *_args: Any) -> None:
+        pass
+
+    def execute(self, query: str) -> None:
+        if self.conn.stale:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.conn.queries.append(query)
+
+
+class FakeConnection:
+    def __init__(self, **connect_kwargs: Any) -> None:
+        self.connect_kwargs = connect_kwargs
+        self.closed = 0
+        self.stale = False
+        self.status = STATUS_READY
+        self.queries: list[str] = []
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+
+    def rollback(self) -> None:
+        self.queries.append("ROLLBACK")
+        self.status = STATUS_READY
+
+    def close(self) -> None:
+        self.closed = 1
+
+
+class FakeCredentials:
+    def get(self) -> dict[str, str]:
+        return {"username": "provisioner", "password": "token"}
+
+    def invalidate(self) -> None:
+        pass
+
+
+@pytest.fixture(name="opened_connections")
+def fixture_opened_connections(monkeypatch: pytest.MonkeyPatch) -> list[FakeConnection]:
+    opened_connections: list[FakeConnection] = []
+
+    def fake_connect(credentials: FakeCredentials, **connect_kwargs: Any) -> FakeConnection:
+        credentials.invalidate()
+        opened_connections.append(FakeConnection(user=credentials.get()["username"], **connect_kwargs))
+        return opened_connections[-1]
+
+    monkeypatch.setattr(connections, "connect", fake_connect)
+
+    return opened_connections
+
+
+def test_should_connect_with_timeout_and_keepalives(opened_connections: list[FakeConnection]) -> None:
+    WarmConnection(FakeCredentials(), host="rds").get()
+
+    assert opened_connections[0].connect_kwargs["user"] == "provisioner"
+    assert opened_connections[0].connect_kwargs["host"] == "rds"
+    assert opened_connections[0].connect_kwargs["connect_timeout"] == CONNECT_TIMEOUT_SECONDS
+    assert opened_connections[0].connect_kwargs["keepalives"] == 1
+
+
+def test_should_reuse_healthy_connection_across_invocations(opened_connections: list[FakeConnection]) -> None:
+    warm_connection = WarmConnection(FakeCredentials(), host="rds")
+
+    first = warm_connection.get()
+    opened_connections[0].status = STATUS_BEGIN  # Left in a transaction by an earlier invocation
+    second = warm_connection.get()
+
+    assert first is second
+    assert len(opened_connections) == 1
+    assert opened_connections[0].queries == ["ROLLBACK", "SELECT 1", "ROLLBACK"]
+
+
+@pytest.mark.parametrize("closed, stale", [(1, False), (0, True)])
+def test_should_reconnect_when_connection_is_closed_or_stale(
+    opened_connections: list[FakeConnection], closed: int, stale: bool
+) -> None:
+    warm_connection = WarmConnection(FakeCredentials(), host="rds")
+    first = warm_connection.get()
+    opened_connections[0].closed, opened_connections[0].stale = closed, stale
+
+    second = warm_connection.get()
+
+    assert second is not first
+    assert len(opened_connections) == 2
+    assert opened_connections[0].closed
+
+
+def test_should_close_connection_once(opened_connections: list[FakeConnection]) -> None:
+    warm_connection = WarmConnection(FakeCredentials(), host="rds")
+    warm_connection.get()
+
+    warm_connection.close()
+    warm_connection.close()
+
+    assert opened_connections[0].closed
+    assert warm_connection.conn is None
@@ -0,0 +1,94 @@
+from typing import Any
+
+import psycopg2
+import pytest
+from aws_lambda_powertools.utilities import parameters
+from shared import credentials
+from shared.credentials import IamAuthTokenCredentials, SecretCredentials, connect
+
+
+@pytest.fixture(name="secret_versions")
+def fixture_secret_versions(monkeypatch: pytest.MonkeyPatch) -> list[dict[str, Any]]:
+    monkeypatch.setenv("RDS_FDW_ROOT", "root-secret")
+    secret_versions = [{"username": "postgres", "password": "old"}, {"username": "postgres", "password": "rotated"}]
+    fetches: list[dict[str, Any]] = []
+
+    def fake_get_secret(name: str, transform: str, max_age: int, force_fetch: bool) -> dict[str, str]:
+        assert (name, transform) == ("root-secret", "json")
+        fetches.append({"max_age": max_age, "force_fetch": force_fetch})
+        return secret_versions[min(len(fetches), len(secret_versions)) - 1]
+
+    monkeypatch.setattr(parameters, "get_secret", fake_get_secret)
+
+    return fetches
+
+
+def test_should_force_fetch_secret_only_after_invalidation(secret_versions: list[dict[str, Any]]) -> None:
+    root_credentials = SecretCredentials("RDS_FDW_ROOT", max_age=60)
+
+    root_credentials.get()
+    root_credentials.invalidate()
+    root_credentials.get()
+    root_credentials.get()
+
+    assert secret_versions == [
+        {"max_age": 60, "force_fetch": False},
+        {"max_age": 60, "force_fetch": True},
+        {"max_age": 60, "force_fetch": False},
+    ]
+
+
+def test_should_connect_with_cached_secret(secret_versions: list[dict[str, Any]], monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(psycopg2, "connect", lambda user, password, host: f"{user}:{password}@{host}")
+
+    assert str(connect(SecretCredentials("RDS_FDW_ROOT"), host="rds")) == "postgres:old@rds"
+    assert len(secret_versions) == 1
+
+
+def test_should_reconnect_with_refreshed_secret_after_authentication_failure(
+    secret_versions: list[dict[str, Any]], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def fake_connect(user: str, password: str, host: str) -> str:
+        if password == "old":
+            raise psycopg2.OperationalError('FATAL:  password authentication failed for user "postgres"')
+        return f"{user}:{password}@{host}"
+
+    monkeypatch.setattr(psycopg2, "connect", fake_connect)
+
+    assert str(connect(SecretCredentials("RDS_FDW_ROOT"), host="rds")) == "postgres:rotated@rds"
+    assert [fetch["force_fetch"] for fetch in secret_versions] == [False, True]
+
+
+def test_should_not_retry_other_connection_failures(
+    secret_versions: list[dict[str, Any]], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def fake_connect(**_kwargs: str) -> None:
+        raise psycopg2.OperationalError("could not connect to server: Connection refused")
+
+    monkeypatch.setattr(psycopg2, "connect", fake_connect)
+
+    with pytest.raises(psycopg2.OperationalError):
+        connect(SecretCredentials("RDS_FDW_ROOT"), host="rds")
+    assert len(secret_versions) == 1
+
+
+def test_should_reuse_iam_auth_token_until_it_expires_or_is_invalidated(monkeypatch: pytest.MonkeyPatch) -> None:
+    tokens: list[str] = []
+
+    class FakeRdsClient:
+        @staticmethod
+        def generate_db_auth_token(DBHostname: str, Port: int, DBUsername: str) -> str:  # pylint: disable=invalid-name
+            tokens.append(f"{DBUsername}@{DBHostname}:{Port}/{len(tokens)}")
+            return tokens[-1]
+
+    monkeypatch.setattr(credentials, "rds_client", FakeRdsClient)
+    iam_auth_credentials = IamAuthTokenCredentials("rds", 5432, "provisioner", max_age=600)
+
+    first = iam_auth_credentials.get()
+    assert iam_auth_credentials.get() == first == {"username": "provisioner", "password": "provisioner@rds:5432/0"}
+
+    iam_auth_credentials.invalidate()
+    assert iam_auth_credentials.get()["password"] == "provisioner@rds:5432/1"
+
+    expired_credentials = IamAuthTokenCredentials("rds", 5432, "provisioner", max_age=0)
+    assert expired_credentials.get() != expired_credentials.get()
@@ -0,0 +1,108 @@
+from shared.fdw_tuning import (
+    FdwTuningProfile,
+    apply_server_tuning,
+    apply_table_tuning,
+    estimate_column_width,
+    load_fdw_tuning_profile,
+)
+
+from tests.psycopg2_fakes import ScriptedCursor
+
+
+def test_should_load_profile_from_config_with_defaults() -> None:
+    profile = load_fdw_tuning_profile(
+        '{"server_options": {"async_capable": true, "fetch_size": 5000}, "tables": {"bde.crs_parcel": {"fetch_size": 200}}}'
+    )
+
+    assert profile.server_options == {
+        "fetch_size": "5000",
+        "async_capable": "true",
+        "fdw_startup_cost": "100",
+        "fdw_tuple_cost": "0.2",
+        "analyze_sampling": "system",
+    }
+    assert profile.tables == {"bde.crs_parcel": {"fetch_size": "200"}}
+    assert profile.max_fetch_size == FdwTuningProfile().max_fetch_size
+    assert load_fdw_tuning_profile(None) == FdwTuningProfile()
+
+
+def test_should_estimate_column_width_from_statistics_then_type() -> None:
+    assert estimate_column_width("public.geometry", -1, 180) == 180
+    assert estimate_column_width("integer", 4, None) == 4
+    assert estimate_column_width("character varying(100)", -1, None) == 100
+    assert estimate_column_width("public.geometry(MultiPolygon,2193)", -1, None) == 1024
+    assert estimate_column_width("text", -1, None) == 32
+
+
+def test_should_size_fetch_within_bounds() -> None:
+    profile = FdwTuningProfile(fetch_batch_bytes=1000000, min_fetch_size=100, max_fetch_size=50000)
+
+    assert profile.fetch_size(10) == 50000
+    assert profile.fetch_size(1000) == 1000
+    assert profile.fetch_size(100000) == 100
+
+
+def test_should_only_alter_server_options_that_differ() -> None:
+    cur = ScriptedCursor([("160002",), (["fetch_size=100000", "async_capable=true", "host=bde"],)])
+    profile = FdwTuningProfile(server_options={"fetch_size": "10000", "async_capable": "true", "fdw_tuple_cost": "0.2"})
+
+    assert apply_server_tuning(cur, profile) == {"fetch_size": "10000", "fdw_tuple_cost": "0.2"}  # type: ignore[arg-type]
+    assert cur.statements[-1] == (
+        "ALTER SERVER bde_processor OPTIONS (SET fetch_size '10000', ADD fdw_tuple_cost '0.2')",
+        None,
+    )
+
+
+def test_should_keep_replica_server_host_in_step() -> None:
+    cur = ScriptedCursor([("160002",), (["fetch_size=10000", "host=old-replica"],)])
+    profile = FdwTuningProfile(server_options={"fetch_size": "10000"})
+
+    assert apply_server_tuning(cur, profile, "bde_replica", "new-replica") == {"host": "new-replica"}  # type: ignore[arg-type]
+    assert cur.statements == [
+        ("SHOW server_version_num", None),
+        ("SELECT srvoptions FROM pg_foreign_server WHERE srvname = %s", ("bde_replica",)),
+        ("ALTER SERVER bde_replica OPTIONS (SET host 'new-replica')", None),
+    ]
+
+
+def test_should_only_set_analyze_sampling_from_postgres_16() -> None:
+    profile = FdwTuningProfile(server_options={"fetch_size": "10000", "analyze_sampling": "system"})
+
+    for server_version, changed in (("150005", {}), ("160002", {"analyze_sampling": "system"})):
+        cur = ScriptedCursor([(server_version,), (["fetch_size=10000"],)])
+        assert apply_server_tuning(cur, profile) == changed  # type: ignore[arg-type]
+
+
+def test_should_tune_each_foreign_table_from_row_width_and_statistics() -> None:
+    cur = ScriptedCursor(
+        [
+            [
+                ("crs_parcel", "integer", 4, None),
+                ("crs_parcel", "public.geometry", -1, None),
+                ("crs_land_district", "integer", 4, 4),
+                ("crs_land_district", "character varying(100)", -1, 12),
+                ("crs_title", "integer", 4, None),
+            ],
+            [
+                ("crs_land_district", ["fetch_size=25000", "use_remote_estimate=false"]),
+                ("crs_parcel", None),
+                ("crs_title", ["schema_name=bde", "table_name=crs_title"]),
+            ],
+        ]
+    )
+    profile = FdwTuningProfile(
+        fetch_batch_bytes=1000000,
+        min_fetch_size=100,
+        max_fetch_size=100000,
+        tables={"bde.crs_title": {"fetch_size": "500"}},
+    )
+
+    changes = apply_table_tuning(cur, profile, "bde")  # type: ignore[arg-type]
+
+    assert changes == {
+        "crs_parcel": {"fetch_size": "950", "use_remote_estimate": "true"},
+        "crs_title": {"fetch_size": "500", "use_remote_estimate": "true"},
+    }
+    assert cur.statements[2][0] == (
+        "ALTER FOREIGN TABLE bde.crs_parcel OPTIONS (ADD fetch_size '950', ADD use_remote_estimate 'true')"
+    )
@@ -0,0 +1,251 @@
+from typing import Any, Optional, Union
+
+import psycopg2
+import pytest
+from psycopg2 import sql
+from shared.foreign_schema import (
+    FOREIGN_SERVER,
+    SQL_FOREIGN_TABLE_SERVERS,
+    ForeignTables,
+    diff_foreign_tables,
+    import_foreign_schema,
+    import_foreign_schemas,
+    sync_foreign_schema,
+)
+
+from tests.psycopg2_fakes import render
+
+
+class FakeCursor:
+    def __init__(
+        self,
+        foreign_tables: dict[str, ForeignTables],
+        failing_statements: tuple[str, ...] = (),
+        servers: Optional[dict[str, str]] = None,
+    ) -> None:
+        self.foreign_tables = foreign_tables
+        self.failing_statements = failing_statements
+        # Server of each local foreign table, by "schema.table"; the primary when missing
+        self.servers = servers or {}
+        self.statements: list[str] = []
+        self.rows: list[tuple[str, ...]] = []
+
+    def execute(self, statement: Union[str, sql.Composable], params: Optional[tuple[Any, ...]] = None) -> None:
+        if params is not None and statement == SQL_FOREIGN_TABLE_SERVERS:
+            (schema,) = params
+            self.rows = [
+                (table, self.servers.get(f"{schema}.{table}", FOREIGN_SERVER)) for table in self.foreign_tables.get(schema, {})
+            ]
+            return
+        if params is not None:
+            (schema,) = params
+            self.rows = [
+                (table, column, column_type)
+                for table, columns in self.foreign_tables.get(schema, {}).items()
+                for column, column_type in columns.items()
+            ]
+            return
+        self.statements.append(render(statement))
+        if self.statements[-1] in self.failing_statements:
+            if self.statements[-1].startswith("DROP"):
+                raise psycopg2.errors.DependentObjectsStillExist(f"cannot drop {self.statements[-1]}")
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+    def fetchall(self) -> list[tuple[str, ...]]:
+        return self.rows
+
+    def __enter__(self) -> "FakeCursor":
+        return self
+
+    def __exit__(self, *_args: Any) -> None:
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cur: FakeCursor) -> None:
+        self.cur = cur
+        self.committed = False
+        self.closed = False
+
+    def cursor(self) -> FakeCursor:
+        return self.cur
+
+    def commit(self) -> None:
+        self.committed = True
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def test_should_diff_tables_and_columns() -> None:
+    changes = diff_foreign_tables(
+        local={"crs_parcel": {"id": "integer", "status": "character(4)", "old": "text"}, "crs_old": {"id": "integer"}},
+        remote={"crs_parcel": {"id": "integer", "status": "character varying(4)", "shape": "geometry"}, "crs_new": {}},
+    )
+
+    assert changes.report() == {
+        "added_tables": ["crs_new"],
+        "moved_tables": [],
+        "dropped_tables": ["crs_old"],
+        "added_columns": ["crs_parcel.shape"],
+        "dropped_columns": ["crs_parcel.old"],
+        "altered_columns": ["crs_parcel.status"],
+    }
+
+
+def test_should_not_change_anything_when_schemas_match() -> None:
+    cur = FakeCursor({"bde": {"crs_parcel": {"id": "integer"}}, "bde_sync": {"crs_parcel": {"id": "integer"}}})
+
+    report = sync_foreign_schema(cur, "bde")  # type: ignore[arg-type]
+
+    assert not any(report.values())
+    assert cur.statements == [
+        "CREATE SCHEMA IF NOT EXISTS bde",
+        "DROP SCHEMA IF EXISTS bde_sync CASCADE",
+        "CREATE SCHEMA bde_sync",
+        "IMPORT FOREIGN SCHEMA bde FROM SERVER bde_processor INTO bde_sync",
+        "DROP SCHEMA bde_sync CASCADE",
+    ]
+
+
+def test_should_apply_only_changes_and_skip_those_blocked_by_dependent_views() -> None:
+    cur = FakeCursor(
+        {
+            "bde": {"crs_parcel": {"id": "integer", "status": "character(4)", "old": "text"}, "crs_old": {"id": "integer"}},
+            "bde_sync": {"crs_parcel": {"id": "integer", "status": "text", "shape": "geometry"}, "crs_new": {"id": "integer"}},
+        },
+        failing_statements=("DROP FOREIGN TABLE bde.crs_old",),
+    )
+
+    report = sync_foreign_schema(cur, "bde")  # type: ignore[arg-type]
+
+    assert report["added_tables"] == ["crs_new"]
+    assert report["errors"] == ["cannot drop DROP FOREIGN TABLE bde.crs_old"]
+    assert cur.statements[4:-1] == [
+        "ALTER FOREIGN TABLE bde_sync.crs_new SET SCHEMA bde",
+        "SAVEPOINT sync_foreign_schema",
+        "DROP FOREIGN TABLE bde.crs_old",
+        "ROLLBACK TO SAVEPOINT sync_foreign_schema",
+        "ALTER FOREIGN TABLE bde.crs_parcel ADD COLUMN shape geometry",
+        "SAVEPOINT sync_foreign_schema",
+        "ALTER FOREIGN TABLE bde.crs_parcel DROP COLUMN old",
+        "RELEASE SAVEPOINT sync_foreign_schema",
+        "SAVEPOINT sync_foreign_schema",
+        "ALTER FOREIGN TABLE bde.crs_parcel ALTER COLUMN status TYPE text",
+        "RELEASE SAVEPOINT sync_foreign_schema",
+    ]
+
+
+def test_should_move_tables_to_another_server_unless_a_view_depends_on_them() -> None:
+    cur = FakeCursor(
+        {
+            "lds": {"nz_parcels": {"id": "integer"}, "nz_addresses": {"id": "integer"}},
+            "lds_sync": {"nz_parcels": {"id": "integer"}, "nz_addresses": {"id": "integer", "shape": "geometry"}},
+        },
+        failing_statements=("DROP FOREIGN TABLE lds.nz_addresses",),
+    )
+
+    report = sync_foreign_schema(cur, "lds", "bde_replica")  # type: ignore[arg-type]
+
+    assert report["moved_tables"] == ["nz_parcels"]
+    assert report["added_tables"] == []
+    assert report["added_columns"] == ["nz_addresses.shape"]
+    assert report["errors"] == ["cannot drop DROP FOREIGN TABLE lds.nz_addresses"]
+    assert cur.statements[3:-1] == [
+        "IMPORT FOREIGN SCHEMA lds FROM SERVER bde_replica INTO lds_sync",
+        "SAVEPOINT sync_foreign_schema",
+        "DROP FOREIGN TABLE lds.nz_addresses",
+        "ROLLBACK TO SAVEPOINT sync_foreign_schema",
+        "SAVEPOINT sync_foreign_schema",
+        "DROP FOREIGN TABLE lds.nz_parcels",
+        "RELEASE SAVEPOINT sync_foreign_schema",
+        "ALTER FOREIGN TABLE lds_sync.nz_parcels SET SCHEMA lds",
+        "ALTER FOREIGN TABLE lds.nz_addresses ADD COLUMN shape geometry",
+    ]
+
+
+def test_should_leave_tables_already_on_the_server_in_place() -> None:
+    cur = FakeCursor(
+        {"lds": {"nz_parcels": {"id": "integer"}}, "lds_sync": {"nz_parcels": {"id": "integer"}}},
+        servers={"lds.nz_parcels": "bde_replica"},
+    )
+
+    report = sync_foreign_schema(cur, "lds", "bde_replica")  # type: ignore[arg-type]
+
+    assert not any(report.values())
+
+
+def test_should_import_every_schema_over_its_own_connection() -> None:
+    opened_connections: list[FakeConnection] = []
+
+    def open_connection() -> FakeConnection:
+        opened_connections.append(FakeConnection(FakeCursor({})))
+        return opened_connections[-1]
+
+    reports = import_foreign_schemas(open_connection, ["bde", "lds"], rebuild=True)  # type: ignore[arg-type]
+
+    assert list(reports) == ["bde", "lds"]
+    assert all(report["attempts"] == 1 for report in reports.values())
+    assert sorted(connection.cur.statements[-1] for connection in opened_connections) == [
+        "IMPORT FOREIGN SCHEMA bde FROM SERVER bde_processor INTO bde",
+        "IMPORT FOREIGN SCHEMA lds FROM SERVER bde_processor INTO lds",
+    ]
+    assert all(connection.committed and connection.closed for connection in opened_connections)
+
+
+def test_should_import_schemas_from_their_configured_server() -> None:
+    opened_connections: list[FakeConnection] = []
+
+    def open_connection() -> FakeConnection:
+        opened_connections.append(FakeConnection(FakeCursor({})))
+        return opened_connections[-1]
+
+    reports = import_foreign_schemas(
+        open_connection, ["bde_control", "lds"], rebuild=True, schema_servers={"lds": "bde_replica"}  # type: ignore[arg-type]
+    )
+
+    assert reports["bde_control"]["server"] == "bde_processor"
+    assert reports["lds"]["server"] == "bde_replica"
+    assert sorted(connection.cur.statements[-1] for connection in opened_connections) == [
+        "IMPORT FOREIGN SCHEMA bde_control FROM SERVER bde_processor INTO bde_control",
+        "IMPORT FOREIGN SCHEMA lds FROM SERVER bde_replica INTO lds",
+    ]
+
+
+def test_should_retry_import_after_connection_failure() -> None:
+    cursors = [
+        FakeCursor({}, failing_statements=("IMPORT FOREIGN SCHEMA bde FROM SERVER bde_processor INTO bde_sync",)),
+        FakeCursor({"bde_sync": {"crs_parcel": {"id": "integer"}}}),
+    ]
+    connections = [FakeConnection(cur) for cur in reversed(cursors)]
+
+    report = import_foreign_schema(connections.pop, "bde", retry_delay=0)  # type: ignore[arg-type]
+
+    assert report["attempts"] == 2
+    assert report["added_tables"] == ["crs_parcel"]
+
+
+def test_should_retry_import_when_connecting_fails() -> None:
+    outcomes: list[Union[FakeConnection, Exception]] = [
+        psycopg2.OperationalError("could not connect to server"),
+        FakeConnection(FakeCursor({"bde_sync": {"crs_parcel": {"id": "integer"}}})),
+    ]
+
+    def open_connection() -> FakeConnection:
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    report = import_foreign_schema(open_connection, "bde", retry_delay=0)  # type: ignore[arg-type]
+
+    assert report["attempts"] == 2
+    assert report["added_tables"] == ["crs_parcel"]
+
+
+def test_should_give_up_import_after_last_attempt() -> None:
+    def open_connection() -> FakeConnection:
+        return FakeConnection(FakeCursor({}, failing_statements=("CREATE SCHEMA IF NOT EXISTS bde",)))
+
+    with pytest.raises(psycopg2.OperationalError):
+        import_foreign_schema(open_connection, "bde", attempts=2, retry_delay=0)  # type: ignore[arg-type]
@@ -0,0 +1,85 @@
+from datetime import datetime, timezone
+
+import psycopg2
+import pytest
+from shared.foreign_statistics import analyze_foreign_tables, prioritise_foreign_tables
+
+from tests.psycopg2_fakes import ScriptedConnection, ScriptedCursor
+
+YESTERDAY = datetime(2023, 5, 1, tzinfo=timezone.utc)
+LAST_WEEK = datetime(2023, 4, 24, tzinfo=timezone.utc)
+
+
+def test_should_prioritise_configured_then_unanalyzed_then_most_queried_then_stalest() -> None:
+    assert prioritise_foreign_tables(
+        [
+            ("bde.crs_stale", LAST_WEEK, False, 0),
+            ("bde.crs_fresh", YESTERDAY, False, 0),
+            ("bde.crs_popular", YESTERDAY, False, 500),
+            ("bde.crs_new", None, False, 0),
+            ("bde.crs_parcel", YESTERDAY, False, 10),
+        ],
+        priority_tables=["bde.crs_parcel"],
+    ) == ["bde.crs_parcel", "bde.crs_new", "bde.crs_popular", "bde.crs_stale", "bde.crs_fresh"]
+
+
+def test_should_try_tables_whose_last_attempt_failed_after_the_others() -> None:
+    assert prioritise_foreign_tables(
+        [
+            ("bde.crs_timed_out", YESTERDAY, True, 900),
+            ("bde.crs_parcel", LAST_WEEK, True, 10),
+            ("bde.crs_fresh", YESTERDAY, False, 0),
+            ("bde.crs_new", None, False, 0),
+        ],
+        priority_tables=["bde.crs_parcel"],
+    ) == ["bde.crs_new", "bde.crs_fresh", "bde.crs_parcel", "bde.crs_timed_out"]
+
+
+def test_should_analyze_and_record_each_table_and_report_failures() -> None:
+    cur = ScriptedCursor(
+        [
+            ("160004",),
+            ("pg_stat_statements",),
+            [("bde.crs_parcel", None, False, 5), ("lds.titles", None, False, 0), ("lds.owners", None, False, 0)],
+        ],
+        errors={
+            "ANALYZE lds.titles": psycopg2.errors.QueryCanceled("canceling statement due to statement timeout"),
+            "ANALYZE lds.owners": psycopg2.errors.UndefinedTable('relation "owners" does not exist'),
+        },
+    )
+    conn = ScriptedConnection(cur)
+
+    report = analyze_foreign_tables(conn, ["bde", "lds"], [], time_budget=60, statistics_target=10)  # type: ignore[arg-type]
+
+    assert list(report["analyzed"]) == ["bde.crs_parcel"]
+    assert report["errors"] == {
+        "lds.titles": "canceling statement due to statement timeout",
+        "lds.owners": 'relation "owners" does not exist',
+    }
+    assert report["remaining"] == 0
+    assert cur.statements[3][0].startswith("ALTER TABLE fdw_stats.analyze_log")
+    assert "LEFT JOIN pg_stat_statements" in cur.statements[5][0]
+    assert ("SET LOCAL default_statistics_target = %s", (10,)) in cur.statements
+    assert cur.statements[9][0].startswith("INSERT INTO fdw_stats.analyze_log")
+    # Failed attempts are recorded after the rollback, so the next run tries the other tables first
+    failures = [params for statement, params in cur.statements if "DO UPDATE SET attempted_at" in statement]
+    assert failures == [("lds.titles", "timed out"), ("lds.owners", "failed")]
+    assert (conn.commits, conn.rollbacks) == (4, 2)
+
+
+def test_should_stop_when_time_budget_is_spent() -> None:
+    cur = ScriptedCursor([("160004",), (None,), [("bde.crs_parcel", None, False, 0)]])
+
+    report = analyze_foreign_tables(ScriptedConnection(cur), ["bde"], [], time_budget=0, statistics_target=10)  # type: ignore[arg-type]
+
+    assert report == {"analyzed": {}, "errors": {}, "remaining": 1}
+    assert "pg_stat_statements" not in cur.statements[5][0]
+
+
+def test_should_refuse_to_analyze_without_remote_sampling() -> None:
+    cur = ScriptedCursor([("150007",)])
+
+    with pytest.raises(RuntimeError, match="before PostgreSQL 16"):
+        analyze_foreign_tables(ScriptedConnection(cur), ["bde"], [], time_budget=60, statistics_target=10)  # type: ignore[arg-type]
+
+    assert cur.statements == [("SHOW server_version_num", None)]
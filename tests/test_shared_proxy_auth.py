@@ -0,0 +1,200 @@
+import base64
+import hashlib
+import hmac
+from typing import Any, Iterator
+
+import pytest
+from shared import proxy_auth
+from shared.proxy_auth import (
+    delete_proxy_password,
+    generate_proxy_password,
+    list_proxy_analyst_roles,
+    list_rds_iam_analyst_roles,
+    load_declared_proxy_auth,
+    register_proxy_secrets,
+    scram_sha_256_verifier,
+    store_proxy_password,
+)
+
+from tests.psycopg2_fakes import ScriptedCursor
+
+ROOT_AUTH = {"AuthScheme": "SECRETS", "SecretArn": "arn:root", "IAMAuth": "REQUIRED", "UserName": "postgres"}
+# As the stack declares it, without the UserName the proxy reports
+DECLARED_AUTH = [{"AuthScheme": "SECRETS", "SecretArn": "arn:root", "IAMAuth": "REQUIRED"}]
+
+
+class ResourceExistsException(Exception):
+    pass
+
+
+class ResourceNotFoundException(Exception):
+    pass
+
+
+class FakeSecretsManagerClient:
+    class exceptions:  # pylint: disable=invalid-name
+        ResourceExistsException = ResourceExistsException
+        ResourceNotFoundException = ResourceNotFoundException
+
+    def __init__(self, existing: dict[str, str]) -> None:
+        self.secrets = existing
+        self.calls: list[tuple[str, dict[str, Any]]] = []
+
+    def get_random_password(self, **kwargs: Any) -> dict[str, str]:
+        self.calls.append(("get_random_password", kwargs))
+        return {"RandomPassword": "generated"}
+
+    def create_secret(self, **kwargs: Any) -> dict[str, str]:
+        self.calls.append(("create_secret", kwargs))
+        if kwargs["Name"] in self.secrets:
+            raise ResourceExistsException()
+        self.secrets[kwargs["Name"]] = f"arn:{kwargs['Name']}"
+        return {"ARN": self.secrets[kwargs["Name"]]}
+
+    def put_secret_value(self, **kwargs: Any) -> dict[str, str]:
+        self.calls.append(("put_secret_value", kwargs))
+        return {"ARN": self.secrets[kwargs["SecretId"]]}
+
+    def delete_secret(self, **kwargs: Any) -> None:
+        self.calls.append(("delete_secret", kwargs))
+        if kwargs["SecretId"] not in self.secrets:
+            raise ResourceNotFoundException()
+        del self.secrets[kwargs["SecretId"]]
+
+    def get_paginator(self, _operation: str) -> "FakeSecretsManagerClient":
+        return self
+
+    def paginate(self, **kwargs: Any) -> Iterator[dict[str, list[dict[str, str]]]]:
+        self.calls.append(("list_secrets", kwargs))
+        arns = list(self.secrets.values())
+        yield {"SecretList": [{"ARN": arn} for arn in arns[:1]]}
+        yield {"SecretList": [{"ARN": arn} for arn in arns[1:]]}
+
+
+class FakeRdsClient:
+    def __init__(self, auth: list[dict[str, str]]) -> None:
+        self.auth = auth
+        self.modified: list[list[dict[str, str]]] = []
+
+    def describe_db_proxies(self, DBProxyName: str) -> dict[str, Any]:  # pylint: disable=invalid-name
+        assert DBProxyName == "analyst-proxy"
+        return {"DBProxies": [{"Auth": self.auth}]}
+
+    def modify_db_proxy(self, DBProxyName: str, Auth: list[dict[str, str]]) -> None:  # pylint: disable=invalid-name
+        assert DBProxyName == "analyst-proxy"
+        self.modified.append(Auth)
+
+
+@pytest.fixture(name="secretsmanager")
+def fixture_secretsmanager(monkeypatch: pytest.MonkeyPatch) -> FakeSecretsManagerClient:
+    client = FakeSecretsManagerClient({"bde-analytics/proxy/jdoe": "arn:bde-analytics/proxy/jdoe"})
+    monkeypatch.setattr(proxy_auth, "secretsmanager_client", lambda: client)
+    return client
+
+
+def test_should_generate_password_without_characters_needing_quotes(secretsmanager: FakeSecretsManagerClient) -> None:
+    assert generate_proxy_password() == "generated"
+    assert secretsmanager.calls[0][1]["ExcludeCharacters"] == "\"@/\\ '"
+
+
+def test_should_create_secret_or_replace_password_of_existing_one(secretsmanager: FakeSecretsManagerClient) -> None:
+    assert store_proxy_password("asmith", "secret") == "arn:bde-analytics/proxy/asmith"
+    assert store_proxy_password("jdoe", "secret") == "arn:bde-analytics/proxy/jdoe"
+
+    assert [call for call, _kwargs in secretsmanager.calls] == ["create_secret", "create_secret", "put_secret_value"]
+    assert secretsmanager.calls[-1][1]["SecretString"] == '{"username": "jdoe", "password": "secret"}'
+
+
+def test_should_register_analyst_secrets_after_the_declared_entries(
+    secretsmanager: FakeSecretsManagerClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    secretsmanager.secrets["bde-analytics/proxy/asmith"] = "arn:bde-analytics/proxy/asmith"
+    jdoe_auth = {**ROOT_AUTH, "SecretArn": "arn:bde-analytics/proxy/jdoe", "UserName": "jdoe"}
+    # The secret of an analyst moved back to IAM auth is gone, but its entry is still there
+    rds = FakeRdsClient([ROOT_AUTH, jdoe_auth, {**ROOT_AUTH, "SecretArn": "arn:bde-analytics/proxy/bgone"}])
+    monkeypatch.setattr(proxy_auth, "rds_client", lambda: rds)
+
+    assert register_proxy_secrets("analyst-proxy", DECLARED_AUTH) == ["arn:bde-analytics/proxy/asmith"]  # type: ignore[arg-type]
+    assert rds.modified == [
+        [
+            *DECLARED_AUTH,
+            {"AuthScheme": "SECRETS", "SecretArn": "arn:bde-analytics/proxy/jdoe", "IAMAuth": "REQUIRED"},
+            {"AuthScheme": "SECRETS", "SecretArn": "arn:bde-analytics/proxy/asmith", "IAMAuth": "REQUIRED"},
+        ]
+    ]
+
+    rds.auth = rds.modified[0]
+    assert register_proxy_secrets("analyst-proxy", DECLARED_AUTH) == []  # type: ignore[arg-type]
+    assert len(rds.modified) == 1
+
+
+def test_should_restore_analyst_secrets_after_a_deployment_resets_the_proxy(
+    secretsmanager: FakeSecretsManagerClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    rds = FakeRdsClient([ROOT_AUTH])
+    monkeypatch.setattr(proxy_auth, "rds_client", lambda: rds)
+
+    assert register_proxy_secrets("analyst-proxy", DECLARED_AUTH) == ["arn:bde-analytics/proxy/jdoe"]  # type: ignore[arg-type]
+    assert rds.modified[0][: len(DECLARED_AUTH)] == DECLARED_AUTH
+
+
+def test_should_load_declared_proxy_auth() -> None:
+    assert (
+        load_declared_proxy_auth('[{"AuthScheme": "SECRETS", "SecretArn": "arn:root", "IAMAuth": "REQUIRED"}]')
+        == DECLARED_AUTH
+    )
+    assert not load_declared_proxy_auth(None)
+
+
+def test_should_delete_proxy_password_once(secretsmanager: FakeSecretsManagerClient) -> None:
+    delete_proxy_password("jdoe")
+    delete_proxy_password("jdoe")
+
+    assert "bde-analytics/proxy/jdoe" not in secretsmanager.secrets
+    assert secretsmanager.calls[0] == (
+        "delete_secret",
+        {"SecretId": "bde-analytics/proxy/jdoe", "ForceDeleteWithoutRecovery": True},
+    )
+
+
+def test_should_compute_scram_verifier_that_authenticates_rfc_7677_exchange() -> None:
+    # https://www.rfc-editor.org/rfc/rfc7677#section-3: user "user", password "pencil"
+    auth_message = (
+        b"n=user,r=rOprNGfwEbeRWgbNEkqO,"
+        b"r=rOprNGfwEbeRWgbNEkqO%hvYDpWUa2RaTCAfuxFIlj)hNlF$k0,s=W22ZaJ0SNY7soEsUEjb6gQ==,i=4096,"
+        b"c=biws,r=rOprNGfwEbeRWgbNEkqO%hvYDpWUa2RaTCAfuxFIlj)hNlF$k0"
+    )
+    client_proof = base64.b64decode("dHzbZapWIk4jUhN+Ute9ytag9zjfMHgsqmmiz7AndVQ=")
+
+    verifier = scram_sha_256_verifier("pencil", salt=base64.b64decode("W22ZaJ0SNY7soEsUEjb6gQ=="))
+
+    mechanism, iterations_salt, keys = verifier.split("$")
+    assert (mechanism, iterations_salt) == ("SCRAM-SHA-256", "4096:W22ZaJ0SNY7soEsUEjb6gQ==")
+    stored_key, server_key = (base64.b64decode(key) for key in keys.split(":"))
+    # Verified the way the server does it: the client key recovered from the proof must hash to the stored key
+    client_signature = hmac.new(stored_key, auth_message, "sha256").digest()
+    client_key = bytes(proof ^ signature for proof, signature in zip(client_proof, client_signature))
+    assert hashlib.sha256(client_key).digest() == stored_key
+    assert (
+        base64.b64encode(hmac.new(server_key, auth_message, "sha256").digest())
+        == b"6rriTRBi23WpRR/wtup+mMhUZUn/dB5nLTJRsjl95G4="
+    )
+
+
+def test_should_salt_each_verifier() -> None:
+    assert scram_sha_256_verifier("secret") != scram_sha_256_verifier("secret")
+    assert "secret" not in scram_sha_256_verifier("secret")
+
+
+def test_should_list_analyst_roles_still_on_iam_auth() -> None:
+    cur = ScriptedCursor([[("asmith",), ("jdoe",)]])
+
+    assert list_rds_iam_analyst_roles(cur) == ["asmith", "jdoe"]  # type: ignore[arg-type]
+    assert "g.rolname = 'rds_iam'" in cur.statements[0][0]
+
+
+def test_should_list_analyst_roles_on_proxy_passwords() -> None:
+    cur = ScriptedCursor([[("asmith",)]])
+
+    assert list_proxy_analyst_roles(cur) == ["asmith"]  # type: ignore[arg-type]
+    assert "NOT pg_has_role(r.oid, 'rds_iam', 'MEMBER')" in cur.statements[0][0]
@@ -0,0 +1,87 @@
+from typing import Any, Iterator
+
+import pytest
+from shared import reconciliation
+from shared.reconciliation import AnalystRole, diff_analysts, list_analyst_iam_users, read_analyst_roles
+
+from tests.psycopg2_fakes import ScriptedCursor
+
+ANALYST_TAG = {"Key": "BDE_Analytics_User", "Value": "True"}
+
+
+class FakeIamClient:
+    def __init__(self, pages: list[list[dict[str, Any]]]) -> None:
+        self.pages = pages
+        self.paginated: list[dict[str, Any]] = []
+
+    def get_paginator(self, operation: str) -> "FakeIamClient":
+        assert operation == "get_account_authorization_details"
+        return self
+
+    def paginate(self, **kwargs: Any) -> Iterator[dict[str, list[dict[str, Any]]]]:
+        self.paginated.append(kwargs)
+        for page in self.pages:
+            yield {"UserDetailList": page}
+
+
+def test_should_list_only_tagged_iam_users_across_pages(monkeypatch: pytest.MonkeyPatch) -> None:
+    iam = FakeIamClient(
+        [
+            [
+                {
+                    "UserName": "jdoe",
+                    "Tags": [ANALYST_TAG],
+                    "AttachedManagedPolicies": [{"PolicyName": "bde-analytics-iam-policy-jdoe"}],
+                },
+                {"UserName": "deployer", "Tags": [{"Key": "Team", "Value": "Platform"}]},
+            ],
+            [{"UserName": "asmith", "Tags": [ANALYST_TAG]}, {"UserName": "ci"}],
+        ]
+    )
+    monkeypatch.setattr(reconciliation, "iam_client", lambda: iam)
+
+    assert list_analyst_iam_users() == {"jdoe": {"bde-analytics-iam-policy-jdoe"}, "asmith": set()}
+    assert iam.paginated == [{"Filter": ["User"]}]
+
+
+def test_should_read_roles_and_schemas_in_one_query() -> None:
+    cur = ScriptedCursor([[("asmith", False, True), ("jdoe", True, False)]])
+
+    assert read_analyst_roles(cur, ["asmith", "jdoe"]) == {  # type: ignore[arg-type]
+        "asmith": AnalystRole(has_schema=False, can_login=True),
+        "jdoe": AnalystRole(has_schema=True, can_login=False),
+    }
+    assert len(cur.statements) == 1
+    assert cur.statements[0][1] == (["asmith", "jdoe"],)
+
+
+def test_should_diff_iam_users_against_analyst_roles() -> None:
+    drift = diff_analysts(
+        iam_users={
+            "jdoe": {"bde-analytics-iam-policy-jdoe"},
+            "asmith": set(),
+            "bnew": {"bde-analytics-iam-policy-bnew"},
+        },
+        roles={
+            "jdoe": AnalystRole(has_schema=True, can_login=True),
+            "asmith": AnalystRole(has_schema=False, can_login=True),
+            "left": AnalystRole(has_schema=True, can_login=True),
+        },
+    )
+
+    assert drift.report() == {
+        "missing_roles": ["bnew"],
+        "missing_schemas": ["asmith"],
+        "missing_policies": ["asmith"],
+        "revoked_roles": [],
+        "orphaned_roles": ["left"],
+    }
+
+
+def test_should_restore_revoked_roles_of_retagged_users_instead_of_creating_them() -> None:
+    drift = diff_analysts(
+        iam_users={"jdoe": {"bde-analytics-iam-policy-jdoe"}},
+        roles={"jdoe": AnalystRole(has_schema=True, can_login=False)},
+    )
+
+    assert (drift.missing_roles, drift.revoked_roles, drift.orphaned_roles) == ([], ["jdoe"], [])
@@ -0,0 +1,39 @@
+from shared.resource_profile import (
+    AnalystResourceProfile,
+    apply_resource_profile,
+    list_analyst_roles,
+    load_analyst_resource_profile,
+)
+
+from tests.psycopg2_fakes import ScriptedCursor
+
+
+def test_should_load_profile_over_defaults() -> None:
+    profile = load_analyst_resource_profile('{"work_mem": "128MB", "temp_file_limit": null, "connection_limit": 2}')
+
+    assert profile == AnalystResourceProfile(work_mem="128MB", temp_file_limit=None, connection_limit=2)
+    assert load_analyst_resource_profile(None) == AnalystResourceProfile()
+
+
+def test_should_ignore_unknown_profile_keys() -> None:
+    assert AnalystResourceProfile.from_config({"maintenance_work_mem": "1GB"}) == AnalystResourceProfile()
+
+
+def test_should_set_limits_on_role_and_reset_those_left_out() -> None:
+    cur = ScriptedCursor([])
+
+    apply_resource_profile(cur, "jdoe", AnalystResourceProfile(temp_file_limit=None))  # type: ignore[arg-type]
+
+    assert [statement for statement, _params in cur.statements] == [
+        "ALTER ROLE jdoe CONNECTION LIMIT 5",
+        "ALTER ROLE jdoe SET statement_timeout = '15min'",
+        "ALTER ROLE jdoe SET work_mem = '64MB'",
+        "ALTER ROLE jdoe RESET temp_file_limit",
+        "ALTER ROLE jdoe SET idle_in_transaction_session_timeout = '10min'",
+    ]
+
+
+def test_should_list_analyst_roles() -> None:
+    cur = ScriptedCursor([[("asmith",), ("jdoe",)]])
+
+    assert list_analyst_roles(cur) == ["asmith", "jdoe"]  # type: ignore[arg-type]
@@ -0,0 +1,90 @@
+import json
+
+import psycopg2
+import pytest
+from shared.statement_telemetry import (
+    StatementStats,
+    collect_statement_deltas,
+    foreign_table_pattern,
+    publish_statement_metrics,
+)
+
+from tests.psycopg2_fakes import ScriptedConnection, ScriptedCursor
+
+PARCEL_QUERY = StatementStats("jdoe", 1, "SELECT * FROM bde.crs_parcel WHERE id = $1", 10, 500.0, 100, 0, True)
+LOCAL_QUERY = StatementStats("jdoe", 2, "SELECT * FROM jdoe.parcels", 5, 20.0, 50, 8192, False)
+TITLE_QUERY = StatementStats("asmith", 3, "SELECT * FROM bde.crs_title", 2, 2000.0, 4000, 0, True)
+
+
+def test_should_diff_counters_against_snapshot_and_replace_it() -> None:
+    foreign_tables = [("bde", "crs_parcel"), ("bde", "crs_title")]
+    current = [tuple(vars(statement).values())[:-1] for statement in (PARCEL_QUERY, LOCAL_QUERY, TITLE_QUERY)]
+    snapshot = [("jdoe", 1, 4, 200.0, 40, 0), ("jdoe", 2, 5, 20.0, 50, 8192), ("asmith", 3, 7, 9000.0, 9000, 0)]
+    cur = ScriptedCursor([foreign_tables, current, snapshot])
+    conn = ScriptedConnection(cur)
+
+    deltas = collect_statement_deltas(conn, ["bde"])  # type: ignore[arg-type]
+
+    # jdoe's local query did nothing since the snapshot, and asmith's counters were reset
+    assert deltas == [StatementStats("jdoe", 1, PARCEL_QUERY.query, 6, 300.0, 60, 0, True), TITLE_QUERY]
+    assert cur.statements[-2][0] == "TRUNCATE fdw_stats.statement_snapshot"
+    assert cur.statements[-1][1] == (
+        ["jdoe", "jdoe", "asmith"],
+        [1, 2, 3],
+        [10, 5, 2],
+        [500.0, 20.0, 2000.0],
+        [100, 50, 4000],
+        [0, 8192, 0],
+    )
+    assert conn.commits == 1
+
+
+@pytest.mark.parametrize(
+    "query, foreign_scan",
+    [
+        ("SELECT * FROM bde.crs_parcel WHERE id = $1", True),
+        ('SELECT * FROM "bde"."crs_parcel" p JOIN jdoe.parcels USING (id)', True),
+        ("select count(*) from BDE . crs_parcel", True),
+        ("SELECT * FROM bde_cache.crs_parcel", False),
+        ("SELECT parcel_id FROM jdoe.crs_parcel", False),
+        ("SELECT * FROM bde.crs_parcel_history", False),
+        ("SELECT * FROM crs_parcel", False),
+    ],
+)
+def test_should_only_match_schema_qualified_foreign_tables(query: str, foreign_scan: bool) -> None:
+    pattern = foreign_table_pattern([("bde", "crs_parcel")])
+
+    assert pattern is not None
+    assert (pattern.search(query) is not None) == foreign_scan
+
+
+def test_should_flag_no_statements_without_foreign_tables() -> None:
+    cur = ScriptedCursor([[], [tuple(vars(PARCEL_QUERY).values())[:-1]], []])
+
+    (delta,) = collect_statement_deltas(ScriptedConnection(cur), ["bde"])  # type: ignore[arg-type]
+
+    assert not delta.foreign_scan
+
+
+def test_should_roll_back_when_collection_fails() -> None:
+    cur = ScriptedCursor([], errors={"LOCK TABLE fdw_stats.statement_snapshot": psycopg2.errors.LockNotAvailable()})
+    conn = ScriptedConnection(cur)
+
+    with pytest.raises(psycopg2.errors.LockNotAvailable):
+        collect_statement_deltas(conn, ["bde"])  # type: ignore[arg-type]
+
+    assert conn.rollbacks == 1
+
+
+def test_should_publish_per_role_and_top_foreign_statement_metrics(capsys: pytest.CaptureFixture[str]) -> None:
+    roles = publish_statement_metrics([PARCEL_QUERY, LOCAL_QUERY, TITLE_QUERY], top_statements=1)
+
+    assert roles["jdoe"] == {"calls": 15, "total_time": 520.0, "temp_bytes": 8192, "foreign_statement_rows_returned": 100}
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert len(records) == 4 * 2 + 4
+    statement_records = [record for record in records if "QueryId" in record]
+    assert {record["QueryId"] for record in statement_records} == {"3"}
+    assert statement_records[0]["Query"] == "SELECT * FROM bde.crs_title"
+    assert statement_records[-1]["StatementRowsReturned"] == [4000.0]
+    assert records[3]["_aws"]["CloudWatchMetrics"][0]["Namespace"] == "BdeFdwRds"
+    assert records[3]["ForeignStatementRowsReturned"] == [100.0]
@@ -0,0 +1,80 @@
+import pytest
+from shared import table_cache
+from shared.table_cache import CachedTable, create_cached_table, fetch_value, load_cached_tables, refresh_cached_table
+
+from tests.psycopg2_fakes import ScriptedCursor
+
+CRS_PARCEL = CachedTable(schema="bde", table="crs_parcel", key="id", indexes=("status",))
+
+
+def test_should_load_cached_tables_from_config() -> None:
+    assert load_cached_tables('[{"table": "bde.crs_parcel", "key": "id", "indexes": ["status"]}]') == [CRS_PARCEL]
+    assert load_cached_tables(None) == []
+
+
+def test_should_refuse_tables_with_the_same_name_in_different_schemas() -> None:
+    with pytest.raises(ValueError, match="different schemas: bde.parcels, lds.parcels"):
+        load_cached_tables('[{"table": "lds.parcels", "key": "id"}, {"table": "bde.parcels", "key": "id"}]')
+
+
+def test_should_copy_and_index_table_with_revision_read_before_copy() -> None:
+    cur = ScriptedCursor([(None,), (42,), [("shape",)]])
+
+    assert create_cached_table(cur, CRS_PARCEL)  # type: ignore[arg-type]
+
+    statements = [statement for statement, _params in cur.statements]
+    assert statements.index("SELECT max(id) FROM table_version.revision") < statements.index(
+        "CREATE TABLE bde_cache.crs_parcel AS SELECT * FROM bde.crs_parcel"
+    )
+    assert "ALTER TABLE bde_cache.crs_parcel ADD PRIMARY KEY (id)" in statements
+    assert "CREATE INDEX ON bde_cache.crs_parcel (status)" in statements
+    assert "CREATE INDEX ON bde_cache.crs_parcel USING gist (shape)" in statements
+    assert cur.statements[-1][1] == ("bde.crs_parcel", 42)
+
+
+def test_should_keep_table_that_is_already_cached() -> None:
+    cur = ScriptedCursor([("bde_cache.crs_parcel",)])
+
+    assert not create_cached_table(cur, CRS_PARCEL)  # type: ignore[arg-type]
+    assert not any(statement.startswith("CREATE TABLE bde_cache.crs_parcel") for statement, _params in cur.statements)
+
+
+def test_should_skip_refresh_when_no_new_revision() -> None:
+    cur = ScriptedCursor([(42,), (42,)])
+
+    assert refresh_cached_table(cur, CRS_PARCEL) == {"revision": 42, "changed_rows": 0}  # type: ignore[arg-type]
+    assert len(cur.statements) == 2
+
+
+def test_should_skip_refresh_of_table_not_copied_yet() -> None:
+    cur = ScriptedCursor([None])
+
+    assert refresh_cached_table(cur, CRS_PARCEL) is None  # type: ignore[arg-type]
+    assert len(cur.statements) == 1
+
+
+def test_should_raise_when_query_returns_no_row() -> None:
+    with pytest.raises(RuntimeError, match="returned none"):
+        fetch_value(ScriptedCursor([None]))  # type: ignore[arg-type]
+
+
+def test_should_refresh_only_changed_rows_in_batches(monkeypatch: pytest.MonkeyPatch) -> None:
+    cur = ScriptedCursor([(40,), (42,), [(1,), (2,), (3,)]])
+    monkeypatch.setattr(table_cache, "REFRESH_BATCH_SIZE", 2)
+
+    report = refresh_cached_table(cur, CRS_PARCEL)  # type: ignore[arg-type]
+
+    assert report == {"revision": 42, "changed_rows": 3}
+    assert cur.statements[2] == (
+        "SELECT DISTINCT id FROM table_version.bde_crs_parcel_revision "
+        "WHERE (_revision_created > %(refreshed)s AND _revision_created <= %(revision)s) "
+        "OR (_revision_expired > %(refreshed)s AND _revision_expired <= %(revision)s)",
+        {"refreshed": 40, "revision": 42},
+    )
+    assert cur.statements[3:7] == [
+        ("DELETE FROM bde_cache.crs_parcel WHERE id = ANY(%s)", ([1, 2],)),
+        ("INSERT INTO bde_cache.crs_parcel SELECT * FROM bde.crs_parcel WHERE id = ANY(%s)", ([1, 2],)),
+        ("DELETE FROM bde_cache.crs_parcel WHERE id = ANY(%s)", ([3],)),
+        ("INSERT INTO bde_cache.crs_parcel SELECT * FROM bde.crs_parcel WHERE id = ANY(%s)", ([3],)),
+    ]
+    assert cur.statements[-1][1] == (42, "bde.crs_parcel")